@@ -1,38 +1,111 @@
 import csv
 import cv2
 import os
+import numpy as np
 from pathlib import Path
 
+from object_detection import Detections
+
+
 class AccuracyEvaluator:
 
+    # size of the frames the annotations without header were made on, they are scaled from it to the size asked for
+    annotation_resolution = (640, 640)
+
+    # annotation files come in three layouts, all with boxes as center x, center y, width, height
+    # without header: one object per row, rows spread evenly over the video, boxes at annotation resolution
+    # header starting with "frame": frame index, then id, x, y, width, height and class, any number of rows per frame,
+    #   frames between the first and last one listed without rows have no objects, boxes in video pixels
+    # header starting with "time": the same with seconds instead of frame indices, only the frames nearest to the
+    #   listed times are annotated
     def __init__(self, annotation_folder, video_image_provider):
         self.video_image_provider = video_image_provider
         video_path = video_image_provider.video_path
         self.video_path = video_path;
         self.annotation_directory_path = annotation_folder;
+        self.annotation = None
+
+        # the annotation is read on the first evaluation
+        self.loaded = False
+
+    def load(self):
+        self.loaded = True
 
         if not os.path.exists(self.annotation_directory_path):
             return
 
-        self.annotation = None
         for annotation_file_path in os.listdir(self.annotation_directory_path):
-            if Path(annotation_file_path).stem == Path(video_path).stem:
+            if Path(annotation_file_path).stem == Path(self.video_path).stem:
                 annotation_file_path = os.path.join(self.annotation_directory_path, annotation_file_path)
                 with open(annotation_file_path, newline='') as annotation_file:
-                    reader = csv.reader(annotation_file, delimiter=',', quotechar='\"')
-                    self.annotation = list(reader)
+                    reader = csv.reader(annotation_file, delimiter=',', quotechar='\"', skipinitialspace=True)
+                    self.annotation = [row for row in reader if len(row) > 0]
 
-        if self.annotation is None:
+        if self.annotation is None or len(self.annotation) == 0:
+            self.annotation = None
             return
 
-        self.frame_count = video_image_provider.frame_count
+        header = [column.strip().lower() for column in self.annotation[0]]
+        if header[0] in ("frame", "time"):
+            self.indexed_by = header[0]
+            rows = self.annotation[1:]
+            column = {name: i for i, name in enumerate(header)}
+            self.keys = np.array([float(row[0]) for row in rows])
+            self.ids = np.array([int(row[column["id"]]) if "id" in column else i for i, row in enumerate(rows)])
+            self.boxes = np.array([[float(row[column[name]]) for name in ("x", "y", "width", "height")] for row in rows], dtype=np.float32).reshape(-1, 4)
+            self.names = np.array([row[column["class"]] if "class" in column else "" for row in rows])
+        else:
+            self.indexed_by = None
+            self.keys = np.arange(len(self.annotation), dtype=np.float64)
+            self.ids = np.zeros(len(self.annotation), dtype=np.int64)
+            self.boxes = np.array([[float(c) for c in row[0:4]] for row in self.annotation], dtype=np.float32)
+            self.names = np.array([row[4] if len(row) > 4 else "" for row in self.annotation])
+
+            self.frame_count = self.video_image_provider.frame_count
+            self.frames_per_annotation = float(self.frame_count) / len(self.annotation)
+
+        # rows ordered by frame or time, so the rows of a frame are found by bisection
+        order = np.argsort(self.keys, kind="stable")
+        self.keys, self.ids, self.boxes, self.names = self.keys[order], self.ids[order], self.boxes[order], self.names[order]
 
-        self.frames_per_annotation = float(self.frame_count) / len(self.annotation)
+        # annotations are drawn in black
+        self.class_names, self.class_ids = np.unique(self.names, return_inverse=True)
+        self.class_colors = np.zeros((len(self.class_names), 3), dtype=np.int64)
 
-    def evaluate(self):
+    # objects annotated on a frame as Detections, with the object ids as track ids, None if the frame is not annotated
+    # index is the frame index, the frame last taken from the provider if None
+    # boxes of annotations without header are scaled to resolution if given
+    def evaluate(self, resolution=None, index=None):
+        if not self.loaded:
+            self.load()
         if self.annotation is None:
             return None
-        current_index = int(self.video_image_provider.current_frame / self.frames_per_annotation)
-        if current_index >= len(self.annotation):
-            current_index = len(self.annotation) - 1
-        return (self.annotation[current_index])
+        if index is None:
+            index = self.video_image_provider.current_frame - 1
+
+        if self.indexed_by == "frame":
+            if index < self.keys[0] or index > self.keys[-1]:
+                return None
+            key = index
+        elif self.indexed_by == "time":
+            dt = self.video_image_provider.dt()
+            time = index * dt
+            after = min(np.searchsorted(self.keys, time), len(self.keys) - 1)
+            before = max(after - 1, 0)
+            key = self.keys[after] if abs(self.keys[after] - time) < abs(self.keys[before] - time) else self.keys[before]
+            if abs(key - time) > dt / 2:
+                return None
+        else:
+            key = min(int((index + 1) / self.frames_per_annotation), len(self.keys) - 1)
+
+        first = np.searchsorted(self.keys, key, side="left")
+        last = np.searchsorted(self.keys, key, side="right")
+        boxes = self.boxes[first:last]
+        if self.indexed_by is None and resolution is not None:
+            boxes = boxes * np.float32([
+                resolution[0] / self.annotation_resolution[0], resolution[1] / self.annotation_resolution[1]
+            ] * 2)
+
+        return Detections.create(
+            boxes, self.class_ids[first:last], None, self.class_names, self.class_colors, self.ids[first:last]
+        )
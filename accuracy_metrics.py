@@ -0,0 +1,154 @@
+import numpy as np
+
+from object_tracking import iou_matrix, assign
+
+
+class StreamingMetrics:
+
+    # overlaps a detection needs to count as found, from 0.5 to 0.95 as in coco
+    iou_thresholds = np.round(np.arange(.5, .96, .05), 2)
+    # detections are counted in confidence bins, so precision / recall curves need no list of all detections
+    confidence_bins = 101
+    # overlap a track needs to match an object for the tracking metrics
+    tracking_iou = .5
+
+    # detection and tracking accuracy accumulated frame by frame, in memory independent of the video length
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.true_positives = np.zeros((len(self.iou_thresholds), self.confidence_bins), dtype=np.int64)
+        self.false_positives = np.zeros((len(self.iou_thresholds), self.confidence_bins), dtype=np.int64)
+        self.frames = 0
+        self.truths = 0
+
+        # clear mot counts, over the frames scored with track ids
+        self.tracked_objects = 0
+        self.matches = 0
+        self.match_iou = 0.0
+        self.misses = 0
+        self.false_alarms = 0
+        self.id_switches = 0
+        # track id each object was matched to last, by object id
+        self.last_match = {}
+
+    # score the Detections of one frame against the annotated ones, unannotated frames with truth None are skipped
+    # the track ids of the annotation are object ids, detections without track ids only count for the detection metrics
+    def update(self, truth, detections):
+        if truth is None:
+            return
+
+        ids = np.empty(0, dtype=np.int64)
+        if detections is None:
+            hypotheses = np.empty((0, 4), dtype=np.float32)
+            scores = np.empty(0, dtype=np.float32)
+        else:
+            detections = detections.valid_only()
+            hypotheses = detections.boxes
+            scores = detections.confidences.astype(np.float32)
+            ids = detections.track_ids if (detections.track_ids >= 0).all() else None
+
+        iou = iou_matrix(truth.boxes, hypotheses)
+        self.frames += 1
+        self.truths += len(truth)
+        self.__count_detections(iou, scores)
+
+        if ids is not None:
+            self.__count_tracking(iou, truth.track_ids.tolist(), ids.tolist())
+
+    # combine the counts of another instance, like the same configuration on another video
+    def merge(self, other):
+        self.true_positives += other.true_positives
+        self.false_positives += other.false_positives
+        self.frames += other.frames
+        self.truths += other.truths
+        self.tracked_objects += other.tracked_objects
+        self.matches += other.matches
+        self.match_iou += other.match_iou
+        self.misses += other.misses
+        self.false_alarms += other.false_alarms
+        self.id_switches += other.id_switches
+
+    # area under the interpolated precision / recall curve at one of the iou thresholds
+    def average_precision(self, threshold_index):
+        if self.truths == 0:
+            return None
+
+        # most confident bins first
+        true_positives = np.cumsum(self.true_positives[threshold_index, ::-1])
+        false_positives = np.cumsum(self.false_positives[threshold_index, ::-1])
+        detections = true_positives + false_positives
+        precision = np.where(detections > 0, true_positives / np.maximum(detections, 1), 1.0)
+        recall = true_positives / self.truths
+
+        precision = np.maximum.accumulate(precision[::-1])[::-1]
+        recall_steps = np.diff(np.concatenate(([0.0], recall)))
+        return float(np.sum(recall_steps * precision))
+
+    def summary(self):
+        threshold_50 = int(np.flatnonzero(self.iou_thresholds == .5)[0])
+        true_positives = int(self.true_positives[threshold_50].sum())
+        detections = true_positives + int(self.false_positives[threshold_50].sum())
+        average_precisions = [self.average_precision(i) for i in range(len(self.iou_thresholds))]
+
+        return {
+            "annotated_frames": self.frames,
+            "objects": self.truths,
+            "precision": true_positives / detections if detections > 0 else None,
+            "recall": true_positives / self.truths if self.truths > 0 else None,
+            "ap50": average_precisions[threshold_50],
+            "ap50_95": float(np.mean(average_precisions)) if self.truths > 0 else None,
+            "mota": 1 - (self.misses + self.false_alarms + self.id_switches) / self.tracked_objects if self.tracked_objects > 0 else None,
+            "motp": self.match_iou / self.matches if self.matches > 0 else None,
+            "id_switches": self.id_switches
+        }
+
+    # greedy matching in order of confidence at every threshold at once, as in coco
+    def __count_detections(self, iou, scores):
+        bins = np.clip((scores * (self.confidence_bins - 1)).astype(np.int64), 0, self.confidence_bins - 1)
+        thresholds = self.iou_thresholds[:, None]
+        matched = np.zeros((len(self.iou_thresholds), iou.shape[0]), dtype=bool)
+        hits = np.zeros((len(self.iou_thresholds), iou.shape[1]), dtype=bool)
+
+        if iou.shape[0] > 0:
+            for hypothesis in np.argsort(-scores, kind="stable"):
+                overlaps = np.where(matched, -1, iou[:, hypothesis][None, :])
+                best = overlaps.argmax(axis=1)
+                hit = overlaps[np.arange(len(best)), best] >= thresholds[:, 0]
+                matched[np.flatnonzero(hit), best[hit]] = True
+                hits[hit, hypothesis] = True
+
+        for threshold in range(len(self.iou_thresholds)):
+            self.true_positives[threshold] += np.bincount(bins[hits[threshold]], minlength=self.confidence_bins)
+            self.false_positives[threshold] += np.bincount(bins[~hits[threshold]], minlength=self.confidence_bins)
+
+    # clear mot matching, objects keep their last track while it still overlaps enough
+    def __count_tracking(self, iou, truth_ids, ids):
+        ids = list(ids)
+        truth_rows = []
+        hypothesis_cols = []
+        for row, truth_id in enumerate(truth_ids):
+            last = self.last_match.get(truth_id)
+            if last is not None and last in ids:
+                col = ids.index(last)
+                if iou[row, col] >= self.tracking_iou and col not in hypothesis_cols:
+                    truth_rows.append(row)
+                    hypothesis_cols.append(col)
+
+        free_rows = np.setdiff1d(np.arange(iou.shape[0]), truth_rows)
+        free_cols = np.setdiff1d(np.arange(iou.shape[1]), hypothesis_cols)
+        rows, cols = assign(iou[np.ix_(free_rows, free_cols)], self.tracking_iou)
+        for row, col in zip(free_rows[rows], free_cols[cols]):
+            last = self.last_match.get(truth_ids[row])
+            if last is not None and last != ids[col]:
+                self.id_switches += 1
+            truth_rows.append(row)
+            hypothesis_cols.append(col)
+
+        for row, col in zip(truth_rows, hypothesis_cols):
+            self.last_match[truth_ids[row]] = ids[col]
+            self.match_iou += float(iou[row, col])
+        self.tracked_objects += iou.shape[0]
+        self.matches += len(truth_rows)
+        self.misses += iou.shape[0] - len(truth_rows)
+        self.false_alarms += iou.shape[1] - len(truth_rows)
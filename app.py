@@ -2,13 +2,9 @@ import cv2
 import time
 import sys
 import os
-import copy
 import numpy as np
 import tkinter as tk
 import tkinter.ttk as ttk
-from PIL import Image, ImageTk
-from threading import Thread
-from threading import Event
 
 from video_image_provider import VideoImageProvider
 try:
@@ -17,8 +13,17 @@ except:
     pass
 from object_detection import NoDetection
 from yolo_object_detection import YoloObjectDetection
-from object_tracking import NoTracking, CV2Tracking
+from sliced_detection import SlicedDetection
+from motion_gating import MotionGatedDetection
+from object_tracking import NoTracking, CV2Tracking, SortTracking, FlowTracking
 from accuracy_evaluation import AccuracyEvaluator
+from frame_processor import FrameProcessor
+from detection_scheduling import FixedFrequencyScheduler, AdaptiveScheduler
+from resolution_control import ResolutionController
+from pipeline import Pipeline
+from image_display import ImageDisplay
+from detection_cache import DetectionCache, CachedDetection
+from instrumentation import metrics, MetricsExporter
 
 
 class MainWindow():
@@ -30,7 +35,16 @@ class MainWindow():
         self.image_display_width = display_height * image_aspect_ratio
         self.interval = 10
         self.detector_frequency = 30
-        self.frame_counter = 0
+        # seconds a detection may take before the adaptive input size steps down
+        self.detection_latency = .2
+
+        # fixed runs the detector every detector_frequency frames, adaptive at most that many frames apart
+        self.detection_schedulers = [FixedFrequencyScheduler(self.detector_frequency), AdaptiveScheduler(self.detector_frequency)]
+
+        # capture, detection / tracking and drawing run in worker threads, the gui only displays the result
+        self.processor = FrameProcessor(self.detection_schedulers[0])
+        self.pipeline = Pipeline(self.processor)
+        self.pipeline.display_resolution = (int(self.image_display_width), self.display_height)
 
         # configure style
         self.big_font = ('Helvetica', 15)
@@ -41,6 +55,11 @@ class MainWindow():
         # create the main canvas for the image
         self.canvas = tk.Canvas(self.window, width=self.image_display_width, height=self.display_height)
         self.canvas.grid(row=0, column=0, padx=10, pady=5)
+        self.display = ImageDisplay(self.canvas, self.pipeline.display_resolution)
+
+        # pipeline latency and dropped frames under the image
+        self.status_display = ttk.Label(self.window)
+        self.status_display.grid(row=1, column=0, padx=10, pady=0)
 
         # right frame for the controls
         self.tab_control = ttk.Notebook(self.window, width=int(self.display_width - self.image_display_width), height=self.display_height)
@@ -71,6 +90,31 @@ class MainWindow():
         self.change_detector_frequency(0)
         ttk.Button(self.detector_frequency_control, text="+", command=lambda: self.change_detector_frequency(+1)).grid(row=0, column=3, padx=3, pady=0)
 
+        # init detection scheduling controls
+        self.detection_scheduler_control = ttk.Frame(self.detector_tab)
+        self.detection_scheduler_control.pack(fill=tk.BOTH, padx=10, pady=10)
+        ttk.Label(self.detection_scheduler_control, text="Scheduling: ").grid(row=0, column=0, padx=3, pady=0)
+        i = 0
+        for scheduler in self.detection_schedulers:
+            ttk.Button(self.detection_scheduler_control, text=scheduler.name, command=lambda i=i: self.processor.set_scheduler(self.detection_schedulers[i])).grid(row=0, column=i + 1, padx=3, pady=0)
+            i += 1
+
+        # init adaptive input size toggle, the size in use is shown in the status line
+        self.adaptive_input_size = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.detector_tab, text="Adaptive input size", variable=self.adaptive_input_size, command=self.toggle_adaptive_input_size).pack(fill=tk.X, padx=10, pady=5)
+
+        # init motion overlay toggle
+        self.show_motion = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.detector_tab, text="Show motion", variable=self.show_motion, command=lambda: setattr(self.processor, "show_motion", self.show_motion.get())).pack(fill=tk.X, padx=10, pady=5)
+
+        # init frame rate and stage time overlay toggle, the stages are only timed while it is shown or exported
+        self.show_hud = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.detector_tab, text="Show HUD", variable=self.show_hud, command=self.toggle_hud).pack(fill=tk.X, padx=10, pady=5)
+        self.hud = None
+        self.hud_interval = .5
+        self.hud_stages = ["capture", "convert", "detect", "tracker init", "track", "draw", "resize", "display", "latency"]
+        self.last_hud_update = 0
+
         # class settings tab
         self.classes_tab = ttk.Frame(self.tab_control)
         self.tab_control.add(self.classes_tab, text='Classes')
@@ -85,15 +129,20 @@ class MainWindow():
 
         self.object_trackers = []
         self.selected_tracker = -1
-        self.detections = None
 
         self.accuracy_evaluators = {}
 
+        # metrics files for dashboards, set by the environment variables METRICS_JSONL and METRICS_PROMETHEUS
+        self.metrics_exporter = MetricsExporter(metrics, os.environ.get("METRICS_JSONL"), os.environ.get("METRICS_PROMETHEUS"))
+        metrics.enabled = self.metrics_exporter.enabled()
+
     # change detector run frequency relatively
     def change_detector_frequency(self, change):
         self.detector_frequency += change
         if self.detector_frequency <= 0:
             self.detector_frequency = 1
+        self.detection_schedulers[0].frequency = self.detector_frequency
+        self.detection_schedulers[1].max_interval = self.detector_frequency
         self.detector_frequency_display.configure(text=f"{self.detector_frequency:02}")
 
     # update ui and selection of image providers
@@ -103,7 +152,12 @@ class MainWindow():
         self.provider_buttons.clear()
 
         if change_selection >= 0:
+            if 0 <= self.selected_provider < len(self.image_providers):
+                self.processor.set_provider(None)
+                self.image_providers[self.selected_provider].close()
             self.selected_provider = change_selection
+            provider = self.image_providers[self.selected_provider]
+            self.processor.set_provider(provider, self.accuracy_evaluators.get(provider))
 
         i = 0
         for provider in self.image_providers:
@@ -121,7 +175,9 @@ class MainWindow():
         if change_selection >= 0:
             self.selected_detector = change_selection
             self.update_classes_controls()
-            self.object_trackers[self.selected_tracker].reset()
+            # models are read and warmed up in the background, detection waits for them
+            self.object_detectors[self.selected_detector].load(background=True)
+            self.processor.set_detector(self.object_detectors[self.selected_detector])
 
         i = 0
         for detector in self.object_detectors:
@@ -138,6 +194,7 @@ class MainWindow():
 
         if change_selection >= 0:
             self.selected_tracker = change_selection
+            self.processor.set_tracker(self.object_trackers[self.selected_tracker])
 
         i = 0
         for tracker in self.object_trackers:
@@ -165,110 +222,86 @@ class MainWindow():
             self.classes_buttons.append(button)
             i += 1
 
-    # capture an image and apply detection / classification / tracking
+    # display the newest frame finished by the pipeline
     def update_image(self):
-        # do not ask for an image if there is no provider or an invalid one is selected
-        if not 0 <= self.selected_provider < len(self.image_providers):
-            self.window.after(self.interval * 10, self.update_image)
-            return
-
-        # acquire a new image
-        self.image = self.image_providers[self.selected_provider].next()
-        self.image = cv2.cvtColor(cv2.resize(self.image, self.object_detectors[self.selected_detector].image_resolution()), cv2.COLOR_BGR2RGB)
-        self.image_to_detect = copy.deepcopy(self.image)
-
-        self.truth = None
-        current_evaluator = self.accuracy_evaluators.get(self.image_providers[self.selected_provider]);
-        if current_evaluator is not None:
-            self.truth = current_evaluator.evaluate();
-
-        # draw true boxes if available
-        if self.truth is not None:
-            true_class_name = self.truth[-1]
-            true_box = np.int16(self.truth[0:4])
-
-            center_point = true_box[0:2]
-            rect_size = np.int16(true_box[2:4]/2)
-            start_point = center_point - rect_size
-            end_point = center_point + rect_size
-            text_point = start_point + [0, 10] + [0, rect_size[1] * 2]
-
-            start_point = tuple(start_point)
-            end_point = tuple(end_point)
-            text_point = tuple(text_point)
-            color = (0, 0, 0)
-
-            self.image = cv2.rectangle(self.image, start_point, end_point, color, 1)
-            self.image = cv2.putText(
-                self.image, f"{true_class_name}",
-                text_point, cv2.FONT_HERSHEY_SIMPLEX,
-                .5, color, 1, cv2.LINE_AA
-            )
-
-        # if a detector is selected and enough frames have passed since last detection, run detection
-        if 0 <= self.selected_detector < len(self.object_detectors):
-            if self.frame_counter % self.detector_frequency == 0:
-                # run the selected detector
-                boxes, colors, names, confidences = self.object_detectors[self.selected_detector].detect(self.image_to_detect, .2, .5)
-                self.detections = [boxes, colors, names, confidences]
-                if 0 <= self.selected_tracker < len(self.object_trackers):
-                    self.object_trackers[self.selected_tracker].init(self.image_to_detect, boxes)
-            elif 0 <= self.selected_tracker < len(self.object_trackers):
-                if self.detections is not None:
-                    self.detections[0] = self.object_trackers[self.selected_tracker].track(self.image_to_detect)
-
-
-
-            # draw bounding boxes
-            if self.detections is not None and self.detections[0] is not None:
-                for i in range(len(self.detections[0])):
-                    boxes = self.detections[0]
-                    colors = self.detections[1]
-                    names = self.detections[2]
-                    confidences = self.detections[3]
-
-                    if boxes[i] is None:
-                        continue
-
-                    center_point = np.int16(boxes[i][0:2])
-                    rect_size = np.int16(np.int16(boxes[i][2:4])/2)
-                    start_point = center_point - rect_size
-                    end_point = center_point + rect_size
-                    text_point = start_point - [0, 5]
-
-                    start_point = tuple(start_point)
-                    end_point = tuple(end_point)
-                    text_point = tuple(text_point)
-                    color = tuple([int(c) for c in colors[i]])
-
-                    self.image = cv2.rectangle(self.image, start_point, end_point, color, 1)
-                    self.image = cv2.putText(
-                        self.image, f"{names[i]} {confidences[i]:.02}",
-                        text_point, cv2.FONT_HERSHEY_SIMPLEX,
-                        .5, color, 1, cv2.LINE_AA
-                    )
-
-        self.frame_counter += 1
-
-        # format the image to be displayed
-        self.image = Image.fromarray(self.image)
-        self.image = ImageTk.PhotoImage(self.image)
-
-        # draw the image onto the GUI
-        self.canvas.create_image(0, 0, anchor=tk.NW, image=self.image)
+        image = self.pipeline.latest()
+
+        if image is not None:
+            with metrics.span("display"):
+                self.display.show(image)
+
+        if self.show_hud.get():
+            self.update_hud()
+        self.metrics_exporter.update()
+
+        if self.pipeline.latency is not None:
+            status = f"latency: {self.pipeline.latency * 1000:.0f} ms, dropped frames: {self.pipeline.dropped_frames()}"
+            if self.processor.detector is not None:
+                for name, value in self.processor.detector.statistics().items():
+                    status += f", {name}: {value}"
+            accuracy = self.processor.accuracy
+            if accuracy.frames > 0:
+                summary = accuracy.summary()
+                status += f", AP50: {summary['ap50']:.2f}"
+                if summary["mota"] is not None:
+                    status += f", MOTA: {summary['mota']:.2f}"
+            self.status_display.configure(text=status)
 
         # update again after set interval
         self.window.after(self.interval, self.update_image)
 
+    # let the input size of the detector follow its latency, or keep the size it has
+    def toggle_adaptive_input_size(self):
+        controller = ResolutionController(self.detection_latency) if self.adaptive_input_size.get() else None
+        self.processor.set_resolution_controller(controller)
+
+    # turn the overlay and with it the instrumentation on or off
+    def toggle_hud(self):
+        metrics.enabled = self.show_hud.get() or self.metrics_exporter.enabled()
+        if not self.show_hud.get() and self.hud is not None:
+            self.canvas.delete(self.hud)
+            self.hud = None
+
+    # frame rate, time per stage and counters over the image, refreshed every hud_interval seconds
+    def update_hud(self):
+        now = time.perf_counter()
+        if self.hud is not None and now - self.last_hud_update < self.hud_interval:
+            return
+        self.last_hud_update = now
+
+        snapshot = metrics.snapshot()
+        spans = snapshot["spans"]
+        lines = []
+        if "display interval" in spans:
+            lines.append(f"{1000 / max(spans['display interval']['mean_ms'], 1e-3):.1f} fps")
+        for stage in self.hud_stages:
+            if stage in spans:
+                lines.append(f"{stage}: {spans[stage]['mean_ms']:.1f} ms, p95 {spans[stage]['p95_ms']:.1f} ms")
+        for name, value in list(snapshot["counters"].items()) + list(snapshot["gauges"].items()):
+            lines.append(f"{name}: {value}")
+        text = "\n".join(lines)
+
+        if self.hud is None:
+            self.hud = self.canvas.create_text(8, 8, anchor=tk.NW, text=text, fill="yellow", font=("Courier", 11))
+        else:
+            self.canvas.itemconfigure(self.hud, text=text)
+
+    # stop the pipeline threads before closing the window
+    def close(self):
+        self.pipeline.stop()
+        self.metrics_exporter.update(force=True)
+        self.window.destroy()
+
 
 # start the main window
+start_time = time.perf_counter()
 root = tk.Tk()
 main_window = MainWindow(root, display_width=1024, display_height=600, image_aspect_ratio=1/1)
 
 # load all videos in directory "videos" as input providers
 if os.path.exists("videos"):
     for video in os.listdir("videos"):
-        new_provider = VideoImageProvider(os.path.join("videos", video))
+        new_provider = VideoImageProvider(os.path.join("videos", video), loop=True, decode_ahead=4, real_time=True)
         main_window.image_providers.append(new_provider)
         main_window.accuracy_evaluators[new_provider] = AccuracyEvaluator("video annotations", new_provider)
 
@@ -280,19 +313,36 @@ if 'picamera2' in sys.modules:
 main_window.object_detectors.append(NoDetection())
 
 # add all yolo models in "yolo" directory, each in its own subdirectory containing model.onnx and classes.csv
-main_window.object_detectors.extend(YoloObjectDetection.look_for_models())
+# detections of video frames are kept on disk, replayed clips do not run the model again
+yolo_detectors = YoloObjectDetection.look_for_models()
+detection_cache = DetectionCache("detection cache")
+main_window.object_detectors.extend([CachedDetection(detector, detection_cache) for detector in yolo_detectors])
+
+# add sliced variants of the yolo models for small objects in large images
+main_window.object_detectors.extend([SlicedDetection(detector) for detector in yolo_detectors])
+
+# add motion gated variants that skip static frames and only detect around moving regions
+main_window.object_detectors.extend([MotionGatedDetection(detector) for detector in yolo_detectors])
 
 # add different types of trackers
 main_window.object_trackers.append(NoTracking())
 trackers = ["CSRT", "KCF", "MOSSE"]
 for t in trackers:
     main_window.object_trackers.append(CV2Tracking(t, (640, 640)))
+    main_window.object_trackers.append(CV2Tracking(t, (640, 640), parallel=True))
+main_window.object_trackers.append(SortTracking())
+main_window.object_trackers.append(FlowTracking((640, 640)))
 
 # start updating parts of the main window
 main_window.update_provider_controls()
 main_window.update_detector_controls()
 main_window.update_tracker_controls()
+main_window.pipeline.start()
 main_window.update_image()
+root.protocol("WM_DELETE_WINDOW", main_window.close)
+
+# providers, evaluators and models only open on selection, so startup stays short with many of them
+root.after_idle(lambda: print(f"startup: {time.perf_counter() - start_time:.2f} s"))
 
 # start the application
 root.mainloop()
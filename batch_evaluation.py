@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import json
+import os
+import time
+import cv2
+import numpy as np
+from multiprocessing import Pool
+
+from video_image_provider import VideoImageProvider
+from yolo_object_detection import YoloObjectDetection, read_model_config
+from object_tracking import create_tracker, tracker_names
+from accuracy_evaluation import AccuracyEvaluator
+from accuracy_metrics import StreamingMetrics
+from frame_processor import FrameProcessor
+from detection_scheduling import create_scheduler, scheduler_names
+from detection_cache import DetectionCache, CachedDetection
+
+
+# every worker process runs its own single threaded opencv, the pool already uses all cores
+def init_worker():
+    cv2.setNumThreads(1)
+
+
+# run one configuration through one video once, returns the measurements
+def evaluate_video(job):
+    video_path, model_dir, tracker_type, scheduler_name, detector_frequency, annotation_folder, cache_dir = job
+
+    provider = VideoImageProvider(video_path, loop=False)
+    evaluator = AccuracyEvaluator(annotation_folder, provider)
+
+    tracker = create_tracker(tracker_type, (640, 640))
+
+    detector = YoloObjectDetection(
+        'YOLO: ' + os.path.basename(model_dir),
+        os.path.join(model_dir, "model.onnx"),
+        os.path.join(model_dir, "classes.csv"),
+        # one inference thread per worker, like opencv
+        config=dict(read_model_config(model_dir), threads=1)
+    )
+    # configurations share the detections of frames they all detect on
+    if cache_dir is not None:
+        detector = CachedDetection(detector, DetectionCache(cache_dir))
+
+    processor = FrameProcessor(create_scheduler(scheduler_name, detector_frequency))
+    processor.set_provider(provider, evaluator)
+    processor.set_tracker(tracker)
+    processor.set_detector(detector)
+
+    frame_times = []
+    detector_calls = 0
+    start_time = time.perf_counter()
+    while True:
+        frame_start = time.perf_counter()
+        image, truth, source = processor.capture()
+        if image is None:
+            break
+
+        image, detections = processor.process(image, source)
+        frame_times.append(time.perf_counter() - frame_start)
+        if processor.last_step == "detect":
+            detector_calls += 1
+
+        processor.score(truth, detections)
+
+    elapsed = time.perf_counter() - start_time
+    frame_ms = np.array(frame_times) * 1000
+
+    return {
+        "video": os.path.basename(video_path),
+        "model": detector.name,
+        "tracker": tracker_type,
+        "scheduler": scheduler_name,
+        "detector_frequency": detector_frequency,
+        "frames": len(frame_times),
+        "detector_calls": detector_calls,
+        "cached_detections": detector.hits if cache_dir is not None else 0,
+        **processor.accuracy.summary(),
+        # the counts behind the summary, merged over videos and left out of the json report
+        "accuracy": processor.accuracy,
+        # None for videos that could not be read or have no frames
+        "fps": len(frame_times) / elapsed if len(frame_times) and elapsed > 0 else None,
+        "latency_ms": float(frame_ms.mean()) if len(frame_ms) else None,
+        "latency_p95_ms": float(np.percentile(frame_ms, 95)) if len(frame_ms) else None
+    }
+
+
+# merge the per video results of each configuration into one overall result
+def merge_results(results):
+    configurations = {}
+    for result in results:
+        key = (result["model"], result["tracker"], result["scheduler"], result["detector_frequency"])
+        configurations.setdefault(key, []).append(result)
+
+    overall = []
+    for (model, tracker, scheduler, detector_frequency), videos in configurations.items():
+        frames = sum(r["frames"] for r in videos)
+        # speed only over the videos that gave frames, None if none of them did
+        timed = [r for r in videos if r["frames"] > 0 and r["fps"]]
+        accuracy = StreamingMetrics()
+        for r in videos:
+            accuracy.merge(r["accuracy"])
+        overall.append({
+            "model": model,
+            "tracker": tracker,
+            "scheduler": scheduler,
+            "detector_frequency": detector_frequency,
+            "videos": len(videos),
+            "frames": frames,
+            "detector_calls": sum(r["detector_calls"] for r in videos),
+            **accuracy.summary(),
+            "fps": sum(r["frames"] for r in timed) / sum(r["frames"] / r["fps"] for r in timed) if timed else None,
+            "latency_ms": sum(r["latency_ms"] * r["frames"] for r in timed) / sum(r["frames"] for r in timed) if timed else None
+        })
+    return overall
+
+
+def format_row(result, name):
+    scores = ["-" if result[key] is None else f"{result[key]:.3f}" for key in ["ap50", "ap50_95", "precision", "recall", "mota"]]
+    fps = "-" if result["fps"] is None else f"{result['fps']:.1f}"
+    latency = "-" if result["latency_ms"] is None else f"{result['latency_ms']:.2f}"
+    return \
+        f"{name:<32} {result['model']:<24} {result['tracker']:<14} {result['scheduler']:<8} {result['detector_frequency']:>4} " \
+        f"{result['frames']:>7} {result['detector_calls']:>7} " + " ".join(f"{score:>7}" for score in scores) + \
+        f" {result['id_switches']:>6} {fps:>8} {latency:>8}"
+
+
+def print_report(results, overall):
+    header = \
+        f"{'video':<32} {'model':<24} {'tracker':<14} {'schedule':<8} {'freq':>4} " \
+        f"{'frames':>7} {'detect':>7} {'ap50':>7} {'ap50:95':>7} {'prec':>7} {'recall':>7} {'mota':>7} " \
+        f"{'idsw':>6} {'fps':>8} {'ms':>8}"
+    print(header)
+    for result in sorted(results, key=lambda r: (r["model"], r["tracker"], r["scheduler"], r["detector_frequency"], r["video"])):
+        print(format_row(result, result["video"]))
+    print()
+    print(header)
+    for result in overall:
+        print(format_row(result, "overall"))
+
+
+def model_directories(base_folder):
+    return [
+        os.path.join(base_folder, directory) for directory in sorted(os.listdir(base_folder))
+        if os.path.isfile(os.path.join(base_folder, directory, "model.onnx"))
+        and os.path.isfile(os.path.join(base_folder, directory, "classes.csv"))
+    ]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="evaluate detector / tracker configurations over a folder of videos")
+    parser.add_argument("--videos", default="videos")
+    parser.add_argument("--annotations", default="video annotations")
+    parser.add_argument("--models", nargs="+", help="model directories, defaults to all in yolo/")
+    parser.add_argument("--trackers", nargs="+", default=tracker_names)
+    parser.add_argument("--schedulers", nargs="+", default=scheduler_names)
+    parser.add_argument("--detector-frequencies", type=int, nargs="+", default=[1, 5, 15, 30])
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--output", help="json file for the full report")
+    parser.add_argument("--cache", help="detection cache directory, configurations then only detect on each frame once")
+    args = parser.parse_args()
+
+    models = args.models or model_directories("yolo")
+    videos = [os.path.join(args.videos, video) for video in sorted(os.listdir(args.videos))]
+    jobs = list(itertools.product(videos, models, args.trackers, args.schedulers, args.detector_frequencies, [args.annotations], [args.cache]))
+    print(f"{len(jobs)} runs on {args.processes} processes")
+
+    start_time = time.perf_counter()
+    with Pool(args.processes, initializer=init_worker) as pool:
+        results = []
+        for result in pool.imap_unordered(evaluate_video, jobs):
+            results.append(result)
+            print(f"{len(results)}/{len(jobs)} {result['video']} {result['tracker']} {result['scheduler']} {result['detector_frequency']}", flush=True)
+
+    overall = merge_results(results)
+    for result in results:
+        result.pop("accuracy")
+    print_report(results, overall)
+    print(f"evaluated in {time.perf_counter() - start_time:.1f} s")
+
+    if args.output is not None:
+        with open(args.output, "w") as output:
+            json.dump({"videos": results, "overall": overall}, output, indent=2)
@@ -0,0 +1,588 @@
+import argparse
+import os
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from functools import partial
+
+from yolo_object_detection import YoloObjectDetection, decode_output, read_model_config
+from inference_backend import create_backend, backend_names
+from object_tracking import CV2Tracking, FlowTracking, create_tracker, tracker_names, iou_matrix
+from object_detection import Detections
+from video_image_provider import VideoImageProvider
+from synthetic_image_provider import SyntheticImageProvider
+from accuracy_evaluation import AccuracyEvaluator
+from sliced_detection import SlicedDetection
+from letterbox import Letterbox
+from instrumentation import Metrics, metrics
+from frame_processor import FrameProcessor
+from detection_scheduling import FixedFrequencyScheduler
+from pipeline import Pipeline
+from process_pipeline import ProcessPipeline
+from resolution_control import ResolutionController
+
+
+# time a function over a number of runs, returns mean milliseconds per call
+def time_it(function, runs):
+    function()
+    start = time.perf_counter()
+    for _ in range(runs):
+        function()
+    return (time.perf_counter() - start) / runs * 1000
+
+
+# yolo detector from a model directory containing model.onnx and classes.csv, or the first one in "yolo"
+def load_detector(model_dir):
+    if model_dir is None:
+        detectors = YoloObjectDetection.look_for_models()
+        if len(detectors) == 0:
+            raise SystemExit("no yolo model found, pass --model")
+        return detectors[0]
+    return YoloObjectDetection(
+        'YOLO: ' + os.path.basename(model_dir),
+        os.path.join(model_dir, "model.onnx"),
+        os.path.join(model_dir, "classes.csv"),
+        config=read_model_config(model_dir)
+    )
+
+
+# model directory of a detector from load_detector
+def model_directory(model_dir):
+    if model_dir is not None:
+        return model_dir
+    return os.path.dirname(load_detector(None).model_path)
+
+
+# milliseconds at the given percentiles of a list of seconds
+def percentiles(seconds, points=(50, 95, 99)):
+    return np.percentile(np.array(seconds) * 1000, points)
+
+
+# first frames of a video, resized to the given resolution
+def read_frames(video_path, count, resolution):
+    video = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < count:
+        success, image = video.read()
+        if not success:
+            break
+        frames.append(cv2.cvtColor(cv2.resize(image, resolution), cv2.COLOR_BGR2RGB))
+    video.release()
+    return frames
+
+
+# boxes spread over a grid covering the image, as center x, center y, width, height
+def grid_boxes(count, resolution, size=40):
+    columns = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / columns))
+    boxes = []
+    for i in range(count):
+        x = (i % columns + .5) * resolution[0] / columns
+        y = (i // columns + .5) * resolution[1] / rows
+        boxes.append([int(x), int(y), size, size])
+    return np.int16(boxes)
+
+
+# random yolo shaped output, mostly background with a few confident candidates
+def synthetic_output(n_classes, n_objects, n_confident, seed=0):
+    rng = np.random.default_rng(seed)
+    out = np.empty((1, 4 + n_classes, n_objects), dtype=np.float32)
+    out[0, 0:2] = rng.uniform(0, 640, (2, n_objects))
+    out[0, 2:4] = rng.uniform(5, 100, (2, n_objects))
+    out[0, 4:] = rng.uniform(0, .1, (n_classes, n_objects))
+    confident = rng.choice(n_objects, n_confident, replace=False)
+    out[0, 4 + rng.integers(0, n_classes, n_confident), confident] = rng.uniform(.2, 1, n_confident)
+    return out
+
+
+# the per candidate python loop YoloObjectDetection.detect used before decode_output
+def loop_decode(out, threshold, nms_threshold, enable_classes):
+    _, n_outputs, n_objects = out.shape
+
+    class_ids = []
+    class_confs = []
+    boxes = []
+
+    for i in range(n_objects):
+        conf = out[:, 4:, i].reshape(-1)
+
+        class_id = np.argmax(conf)
+
+        if not enable_classes[class_id]:
+            continue
+
+        class_conf = conf[class_id]
+
+        if class_conf >= threshold:
+            class_ids.append(class_id)
+            class_confs.append(class_conf)
+            boxes.append([int(a) for a in out[:, :4, i].reshape(4)])
+
+    valid_boxes = cv2.dnn.NMSBoxes(
+        boxes, class_confs, threshold, nms_threshold
+    )
+
+    return np.int16(boxes)[valid_boxes], np.array(class_ids)[valid_boxes], np.float16(class_confs)[valid_boxes]
+
+
+def benchmark_decode(args):
+    enable_classes = [True] * args.classes
+    print(f"{'candidates':>10} {'confident':>10} {'loop ms':>10} {'vector ms':>10} {'speedup':>8}")
+    for n_confident in args.confident:
+        out = synthetic_output(args.classes, args.objects, n_confident)
+        loop_ms = time_it(lambda: loop_decode(out, .2, .5, enable_classes), args.runs)
+        vector_ms = time_it(lambda: decode_output(out[0], .2, .5, enable_classes, 300), args.runs)
+        print(f"{args.objects:>10} {n_confident:>10} {loop_ms:>10.3f} {vector_ms:>10.3f} {loop_ms / vector_ms:>7.1f}x")
+
+
+def benchmark_batch(args):
+    detector = load_detector(args.model)
+    frames = read_frames(args.video, args.frames, detector.image_resolution())
+    print(f"{'batch size':>10} {'frames/s':>10} {'ms/frame':>10}")
+    for batch_size in args.batch_sizes:
+        detector.batch_size = batch_size
+        ms = time_it(lambda: detector.detect_batch(frames, .2, .5), args.runs)
+        if detector.batch_size != batch_size:
+            print(f"{batch_size:>10} model does not support batches")
+            break
+        print(f"{batch_size:>10} {len(frames) / ms * 1000:>10.1f} {ms / len(frames):>10.2f}")
+
+
+def benchmark_tracking(args):
+    resolution = (640, 640)
+    frames = read_frames(args.video, args.frames + 1, resolution)
+    print(f"{'tracker':>8} {'objects':>8} {'serial ms':>10} {'parallel ms':>12} {'speedup':>8}")
+    for tracker_type in args.trackers:
+        serial = CV2Tracking(tracker_type, resolution)
+        parallel = CV2Tracking(tracker_type, resolution, parallel=True, workers=args.workers)
+        for count in args.objects:
+            detections = Detections.create(grid_boxes(count, resolution))
+            times = []
+            for tracker in [serial, parallel]:
+                tracker.init(frames[0], detections)
+                start = time.perf_counter()
+                for frame in frames[1:]:
+                    tracker.track(frame)
+                times.append((time.perf_counter() - start) / (len(frames) - 1) * 1000)
+            print(f"{tracker_type:>8} {count:>8} {times[0]:>10.2f} {times[1]:>12.2f} {times[0] / times[1]:>7.1f}x")
+
+
+# per object trackers against optical flow of all objects at once, on source resolution frames of every video
+# video boxes are spread over a grid, synthetic boxes are the moving objects and are scored against where they end up
+def benchmark_flow(args):
+    sources = []
+    for video in sorted(os.listdir(args.videos)):
+        frames = [cv2.cvtColor(image, cv2.COLOR_BGR2RGB) for image in read_source_frames(os.path.join(args.videos, video), args.frames + 1)]
+        if len(frames) > 1:
+            sources.append((video, frames))
+    if args.synthetic:
+        sources.append(("synthetic", None))
+
+    print(f"{'source':>24} {'tracker':>13} {'objects':>8} {'ms/frame':>9} {'init ms':>8} {'kept':>6} {'iou':>6}")
+    for name, frames in sources:
+        for count in args.objects:
+            provider = None
+            if name == "synthetic":
+                provider = SyntheticImageProvider(objects=count, frame_count=args.frames + 1)
+                frames = [provider.next_frame().image for _ in range(args.frames + 1)]
+                boxes = provider.boxes(0)
+            else:
+                boxes = grid_boxes(count, (frames[0].shape[1], frames[0].shape[0]))
+
+            for tracker_name in args.trackers:
+                tracker = create_tracker(tracker_name, (640, 640))
+                start = time.perf_counter()
+                tracker.init(frames[0], Detections.create(boxes))
+                init_ms = (time.perf_counter() - start) * 1000
+                start = time.perf_counter()
+                for frame in frames[1:]:
+                    tracked = tracker.track(frame)
+                ms = (time.perf_counter() - start) / (len(frames) - 1) * 1000
+
+                kept = tracked.valid.mean() * 100
+                iou = float("nan")
+                if provider is not None:
+                    iou = float(np.mean(np.diag(iou_matrix(provider.boxes(len(frames) - 1), tracked.boxes)) * tracked.valid))
+                print(f"{name[:24]:>24} {tracker_name:>13} {count:>8} {ms:>9.2f} {init_ms:>8.2f} {kept:>5.0f}% {iou:>6.2f}")
+
+
+def benchmark_sliced(args):
+    detector = load_detector(args.model)
+    frames = read_frames(args.video, args.frames, tuple(args.resolution))
+    print(f"{'tile size':>10} {'overlap':>8} {'max tiles':>10} {'tiles':>6} {'frames/s':>10} {'ms/frame':>10}")
+    for tile_size in args.tile_sizes:
+        for max_tiles in args.max_tiles:
+            sliced = SlicedDetection(detector, tile_size=tile_size, overlap=args.overlap, max_tiles=max_tiles or None)
+            ms = time_it(lambda: [sliced.detect(frame, .2, .5) for frame in frames], args.runs) / len(frames)
+            print(f"{tile_size:>10} {args.overlap:>8} {max_tiles or 'all':>10} {sliced.last_tile_count:>6} {1000 / ms:>10.1f} {ms:>10.2f}")
+
+
+# frames as decoded, at source resolution in bgr
+def read_source_frames(video_path, count):
+    video = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < count:
+        success, image = video.read()
+        if not success:
+            break
+        frames.append(image)
+    video.release()
+    return frames
+
+
+# resize to the detector resolution, convert to rgb and build a blob, as FrameProcessor and detect did before
+def squash_preprocess(image, resolution):
+    resized = cv2.resize(image, resolution)
+    converted = cv2.cvtColor(resized, cv2.COLOR_BGR2RGB)
+    blob = cv2.dnn.blobFromImage(converted, scalefactor=1/255, size=resolution)
+    return [resized, converted, blob]
+
+
+# convert once for display and tracking, letterbox into the reused blob
+def letterbox_preprocess(image, letterbox):
+    converted = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    blob, placements = letterbox.prepare([converted])
+    return [converted, blob]
+
+
+# numpy buffers allocated by a preprocessing function per frame, and their bytes
+# every result is kept alive, so buffers reused across frames are counted once and new ones every frame
+def count_allocations(preprocess, frames):
+    kept = []
+    tracemalloc.start()
+    for frame in frames:
+        kept.append(preprocess(frame))
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    traces = snapshot.filter_traces([tracemalloc.DomainFilter(True, np.lib.tracemalloc_domain)]).traces
+    large = [trace.size for trace in traces if trace.size >= 1024]
+    return len(large) / len(frames), sum(large) / len(frames)
+
+
+def benchmark_preprocess(args):
+    resolution = tuple(args.resolution)
+    frames = read_source_frames(args.video, args.frames)
+    letterbox = Letterbox(resolution)
+    letterbox.prepare([frames[0]])
+
+    height, width = frames[0].shape[0:2]
+    print(f"{width}x{height} frames to {resolution[0]}x{resolution[1]}")
+    print(f"{'path':>10} {'p50 ms':>8} {'p95 ms':>8} {'buffers/frame':>14} {'MB/frame':>9}")
+    paths = {
+        "squash": lambda frame: squash_preprocess(frame, resolution),
+        "letterbox": lambda frame: letterbox_preprocess(frame, letterbox)
+    }
+    for name, preprocess in paths.items():
+        seconds = []
+        for _ in range(args.runs):
+            for frame in frames:
+                start = time.perf_counter()
+                preprocess(frame)
+                seconds.append(time.perf_counter() - start)
+
+        p50, p95 = percentiles(seconds, (50, 95))
+        buffers, size = count_allocations(preprocess, frames)
+        print(f"{name:>10} {p50:>8.2f} {p95:>8.2f} {buffers:>14.1f} {size / 1e6:>9.2f}")
+
+
+# cost of a timing span and a counter, with instrumentation off and on
+def benchmark_instrumentation(args):
+    print(f"{'state':>6} {'span ns':>8} {'count ns':>9}")
+    for enabled in [False, True]:
+        metrics = Metrics(enabled)
+
+        def span():
+            with metrics.span("stage"):
+                pass
+
+        span_ms = time_it(lambda: [span() for _ in range(1000)], args.runs)
+        count_ms = time_it(lambda: [metrics.count("calls") for _ in range(1000)], args.runs)
+        print(f"{'on' if enabled else 'off':>6} {span_ms * 1000:>8.0f} {count_ms * 1000:>9.0f}")
+
+
+# forward pass latency of every model variant in a directory on every available backend
+def benchmark_backends(args):
+    model_dir = model_directory(args.model)
+    config = read_model_config(model_dir)
+    resolution = tuple(config.get("input_size", (640, 640)))
+    variants = sorted(item for item in os.listdir(model_dir) if item.startswith("model") and item.endswith(".onnx"))
+
+    frames = read_frames(args.video, 1, resolution)
+    blob = cv2.dnn.blobFromImages(frames, scalefactor=1/255, size=resolution)
+
+    print(f"{'model':>16} {'backend':>40} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for variant in variants:
+        for name in args.backends or backend_names:
+            for threads in args.threads or [config.get("threads")]:
+                backend = create_backend(
+                    os.path.join(model_dir, variant), name, threads,
+                    config.get("dnn_backend", "default"), config.get("dnn_target", "cpu")
+                )
+                backend.forward(blob)
+
+                seconds = []
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    backend.forward(blob)
+                    seconds.append(time.perf_counter() - start)
+
+                p50, p95, p99 = percentiles(seconds)
+                print(f"{variant:>16} {backend.description():>40} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f}")
+
+
+# the components app.py sets up before its window appears, and the cost of first using them
+def benchmark_startup(args):
+    start = time.perf_counter()
+    providers = [VideoImageProvider(os.path.join(args.videos, video)) for video in sorted(os.listdir(args.videos))]
+    evaluators = [AccuracyEvaluator(args.annotations, provider) for provider in providers]
+    detectors = YoloObjectDetection.look_for_models()
+    startup_ms = (time.perf_counter() - start) * 1000
+    print(f"startup with {len(providers)} videos and {len(detectors)} models: {startup_ms:.1f} ms")
+
+    if len(providers) > 0:
+        start = time.perf_counter()
+        providers[0].next()
+        evaluators[0].evaluate()
+        print(f"first image of {providers[0].name}: {(time.perf_counter() - start) * 1000:.1f} ms")
+    for detector in detectors:
+        start = time.perf_counter()
+        detector.load()
+        print(f"load and warm up {detector.name}: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+# detection latency against accuracy at every input size of a model on an annotated video, and with the size adapted
+def benchmark_resolution(args):
+    detector = load_detector(args.model)
+    detector.load()
+    sizes = [tuple(size) for size in args.sizes] if args.sizes else detector.input_sizes()
+    runs = [(f"{width}x{height}", (width, height), None) for width, height in sizes]
+    if args.target_latency is not None:
+        runs.append((f"adaptive {args.target_latency:g} ms", sizes[-1], ResolutionController(args.target_latency / 1000)))
+
+    print(f"{'input size':>18} {'p50 ms':>8} {'p95 ms':>8} {'frames/s':>9} {'ap50':>6} {'ap50:95':>8} {'recall':>7}")
+    for name, size, controller in runs:
+        detector.set_input_size(size)
+        provider = VideoImageProvider(args.video)
+        processor = FrameProcessor(FixedFrequencyScheduler(1))
+        processor.set_provider(provider, AccuracyEvaluator(args.annotations, provider))
+        processor.set_detector(detector)
+        processor.set_resolution_controller(controller)
+
+        seconds = []
+        used_sizes = {}
+        while args.frames is None or len(seconds) < args.frames:
+            image, truth, source = processor.capture()
+            if image is None:
+                break
+            start = time.perf_counter()
+            image, detections = processor.process(image, source)
+            seconds.append(time.perf_counter() - start)
+            processor.score(truth, detections)
+            used_sizes[detector.image_resolution()] = used_sizes.get(detector.image_resolution(), 0) + 1
+        provider.close()
+
+        # the first detection at a size allocates the buffers of the backend
+        p50, p95 = percentiles(seconds[1:], (50, 95)) if len(seconds) > 1 else (None, None)
+        fps = len(seconds) / sum(seconds) if sum(seconds) > 0 else None
+        # videos without annotations have no scores
+        summary = processor.accuracy.summary()
+        speed = ["-" if value is None else f"{value:.2f}" for value in (p50, p95)] + ["-" if fps is None else f"{fps:.1f}"]
+        scores = ["-" if summary[key] is None else f"{summary[key]:.3f}" for key in ("ap50", "ap50_95", "recall")]
+        print(
+            f"{name:>18} {speed[0]:>8} {speed[1]:>8} {speed[2]:>9} "
+            f"{scores[0]:>6} {scores[1]:>8} {scores[2]:>7}"
+        )
+        if controller is not None:
+            print(f"{'':>18} frames per size: " + ", ".join(f"{w}x{h} {count}" for (w, h), count in sorted(used_sizes.items())))
+
+
+# one thread capturing, detecting, tracking and drawing each frame in turn
+def run_sequential(args, provider_factory):
+    processor = FrameProcessor(FixedFrequencyScheduler(args.detector_frequency))
+    processor.set_provider(provider_factory())
+    processor.set_detector(load_detector(args.model))
+    processor.set_tracker(create_tracker(args.tracker, (640, 640)))
+    processor.detector.load()
+
+    start = None
+    while start is None or time.perf_counter() - start < args.seconds:
+        image, truth, source = processor.capture()
+        capture_time = time.perf_counter()
+        image, detections = processor.process(image, source)
+        if args.render:
+            scale = (args.display[0] / image.shape[1], args.display[1] / image.shape[0])
+            processor.draw(cv2.resize(image, tuple(args.display)), detections, truth, scale)
+        metrics.count("processed frames")
+        metrics.record("latency", time.perf_counter() - capture_time)
+        # the first detection includes warming up the model
+        if start is None:
+            metrics.reset()
+            start = time.perf_counter()
+    processor.provider.close()
+    return time.perf_counter() - start
+
+
+# the threaded pipeline of the app or the process pipeline, with a consumer taking the newest frames like the gui
+def run_pipeline(args, pipeline):
+    if not args.render:
+        pipeline.rendering.clear()
+    pipeline.start()
+
+    start = None
+    while start is None or time.perf_counter() - start < args.seconds:
+        if pipeline.latest(timeout=Pipeline.poll_interval) is None and not args.render:
+            time.sleep(Pipeline.poll_interval)
+        if start is None and metrics.counters.get("processed frames", 0) > 0:
+            metrics.reset()
+            start = time.perf_counter()
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+    return elapsed
+
+
+# frames per second and latency from capture to the finished frame, in one thread, in threads and in processes
+def benchmark_processes(args):
+    metrics.enabled = True
+    if args.synthetic:
+        provider_factory = partial(SyntheticImageProvider, tuple(args.synthetic), objects=args.objects)
+    else:
+        provider_factory = partial(VideoImageProvider, args.video, loop=True)
+    print(
+        f"{os.cpu_count()} cores, {args.tracker} tracker, detection every {args.detector_frequency} frames, "
+        f"drawing {'on' if args.render else 'off'}"
+    )
+    print(f"{'mode':>12} {'frames/s':>10} {'p50 ms':>8} {'p95 ms':>8} {'dropped':>8}")
+    for mode in args.modes:
+        metrics.reset()
+        if mode == "sequential":
+            elapsed = run_sequential(args, provider_factory)
+            dropped = 0
+        elif mode == "threads":
+            processor = FrameProcessor(FixedFrequencyScheduler(args.detector_frequency))
+            processor.set_provider(provider_factory())
+            processor.set_detector(load_detector(args.model))
+            processor.set_tracker(create_tracker(args.tracker, (640, 640)))
+            processor.detector.load()
+            pipeline = Pipeline(processor)
+            pipeline.paced = False
+            pipeline.display_resolution = tuple(args.display)
+            elapsed = run_pipeline(args, pipeline)
+            processor.provider.close()
+            dropped = pipeline.dropped_frames()
+        else:
+            pipeline = ProcessPipeline(
+                provider_factory,
+                detector_factory=partial(load_detector, args.model),
+                tracker_factory=partial(create_tracker, args.tracker, (640, 640)),
+                scheduler_factory=partial(FixedFrequencyScheduler, args.detector_frequency),
+                slots=args.slots, display_resolution=args.display, paced=False
+            )
+            elapsed = run_pipeline(args, pipeline)
+            dropped = pipeline.dropped_frames()
+
+        snapshot = metrics.snapshot()
+        latency = snapshot["spans"].get("latency", {})
+        frames = snapshot["counters"].get("processed frames", 0)
+        print(
+            f"{mode:>12} {frames / elapsed:>10.1f} {latency.get('p50_ms', float('nan')):>8.2f} "
+            f"{latency.get('p95_ms', float('nan')):>8.2f} {dropped:>8}"
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmarks of the detection and tracking pipeline")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    decode_parser = subparsers.add_parser("decode", help="yolo output decoding, python loop against vectorized")
+    decode_parser.add_argument("--classes", type=int, default=5)
+    decode_parser.add_argument("--objects", type=int, default=8400)
+    decode_parser.add_argument("--confident", type=int, nargs="+", default=[0, 10, 100, 1000])
+    decode_parser.add_argument("--runs", type=int, default=20)
+    decode_parser.set_defaults(function=benchmark_decode)
+
+    batch_parser = subparsers.add_parser("batch", help="detector throughput against inference batch size")
+    batch_parser.add_argument("--model", help="model directory, defaults to the first one in yolo/")
+    batch_parser.add_argument("--video", default="videos/birds-compressed.mp4")
+    batch_parser.add_argument("--frames", type=int, default=32)
+    batch_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    batch_parser.add_argument("--runs", type=int, default=3)
+    batch_parser.set_defaults(function=benchmark_batch)
+
+    tracking_parser = subparsers.add_parser("tracking", help="tracking time against object count, serial and parallel")
+    tracking_parser.add_argument("--video", default="videos/birds-compressed.mp4")
+    tracking_parser.add_argument("--frames", type=int, default=20)
+    tracking_parser.add_argument("--trackers", nargs="+", default=list(CV2Tracking.tracker_types))
+    tracking_parser.add_argument("--objects", type=int, nargs="+", default=[1, 5, 10, 20])
+    tracking_parser.add_argument("--workers", type=int, default=None, help="threads of the parallel mode, defaults to one per core")
+    tracking_parser.set_defaults(function=benchmark_tracking)
+
+    flow_parser = subparsers.add_parser("flow", help="optical flow of all objects in one pass against the per object opencv trackers")
+    flow_parser.add_argument("--videos", default="videos")
+    flow_parser.add_argument("--frames", type=int, default=20)
+    flow_parser.add_argument("--trackers", nargs="+", choices=tracker_names, default=list(CV2Tracking.tracker_types) + [FlowTracking.name])
+    flow_parser.add_argument("--objects", type=int, nargs="+", default=[1, 5, 10])
+    flow_parser.add_argument("--synthetic", action=argparse.BooleanOptionalAction, default=True, help="also track the objects of synthetic frames and score them")
+    flow_parser.set_defaults(function=benchmark_flow)
+
+    sliced_parser = subparsers.add_parser("sliced", help="sliced detection throughput against tile count")
+    sliced_parser.add_argument("--model", help="model directory, defaults to the first one in yolo/")
+    sliced_parser.add_argument("--video", default="videos/one plane.mp4")
+    sliced_parser.add_argument("--resolution", type=int, nargs=2, default=[1280, 720])
+    sliced_parser.add_argument("--frames", type=int, default=4)
+    sliced_parser.add_argument("--tile-sizes", type=int, nargs="+", default=[320, 480, 640])
+    sliced_parser.add_argument("--overlap", type=float, default=.2)
+    sliced_parser.add_argument("--max-tiles", type=int, nargs="+", default=[0, 2, 4], help="0 runs all tiles")
+    sliced_parser.add_argument("--runs", type=int, default=2)
+    sliced_parser.set_defaults(function=benchmark_sliced)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="per frame preprocessing time and allocations, squashing against letterboxing")
+    preprocess_parser.add_argument("--video", default="videos/one plane.mp4")
+    preprocess_parser.add_argument("--frames", type=int, default=20)
+    preprocess_parser.add_argument("--resolution", type=int, nargs=2, default=[640, 640])
+    preprocess_parser.add_argument("--runs", type=int, default=5)
+    preprocess_parser.set_defaults(function=benchmark_preprocess)
+
+    instrumentation_parser = subparsers.add_parser("instrumentation", help="overhead of timing spans and counters, off and on")
+    instrumentation_parser.add_argument("--runs", type=int, default=100)
+    instrumentation_parser.set_defaults(function=benchmark_instrumentation)
+
+    backends_parser = subparsers.add_parser("backends", help="forward pass latency of each model variant on each inference backend")
+    backends_parser.add_argument("--model", help="model directory, defaults to the first one in yolo/")
+    backends_parser.add_argument("--video", default="videos/birds-compressed.mp4")
+    backends_parser.add_argument("--backends", nargs="+", choices=backend_names, help="defaults to all available")
+    backends_parser.add_argument("--threads", type=int, nargs="+", help="thread counts to try, defaults to the model config")
+    backends_parser.add_argument("--runs", type=int, default=50)
+    backends_parser.set_defaults(function=benchmark_backends)
+
+    startup_parser = subparsers.add_parser("startup", help="time to set up all providers and models, and to first use them")
+    startup_parser.add_argument("--videos", default="videos")
+    startup_parser.add_argument("--annotations", default="video annotations")
+    startup_parser.set_defaults(function=benchmark_startup)
+
+    resolution_parser = subparsers.add_parser("resolution", help="detection latency and accuracy at each input size of a model, fixed and adapted")
+    resolution_parser.add_argument("--model", help="model directory, defaults to the first one in yolo/")
+    resolution_parser.add_argument("--video", default="videos/one plane-compressed.mp4", help="annotated video")
+    resolution_parser.add_argument("--annotations", default="video annotations")
+    resolution_parser.add_argument("--sizes", type=int, nargs=2, action="append", metavar=("WIDTH", "HEIGHT"), help="input sizes to compare, defaults to those of the model")
+    resolution_parser.add_argument("--target-latency", type=float, help="also run with the input size adapted to this many milliseconds per detection")
+    resolution_parser.add_argument("--frames", type=int, help="frames to detect on, defaults to the whole video")
+    resolution_parser.set_defaults(function=benchmark_resolution)
+
+    processes_parser = subparsers.add_parser("processes", help="whole pipeline in one thread, in threads and in shared memory processes")
+    processes_parser.add_argument("--model", help="model directory, defaults to the first one in yolo/")
+    processes_parser.add_argument("--video", default="videos/birds-compressed.mp4")
+    processes_parser.add_argument("--synthetic", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), help="procedural frames of this size instead of the video")
+    processes_parser.add_argument("--objects", type=int, default=5, help="moving boxes in the synthetic frames")
+    processes_parser.add_argument("--tracker", default="KCF", choices=tracker_names)
+    processes_parser.add_argument("--detector-frequency", type=int, default=5)
+    processes_parser.add_argument("--modes", nargs="+", choices=["sequential", "threads", "processes"], default=["sequential", "threads", "processes"])
+    processes_parser.add_argument("--render", action=argparse.BooleanOptionalAction, default=True, help="draw the overlays on every frame")
+    processes_parser.add_argument("--display", type=int, nargs=2, default=[600, 600], help="width and height frames are drawn at")
+    processes_parser.add_argument("--slots", type=int, default=4, help="shared memory frames in flight")
+    processes_parser.add_argument("--seconds", type=float, default=20)
+    processes_parser.set_defaults(function=benchmark_processes)
+
+    args = parser.parse_args()
+    args.function(args)
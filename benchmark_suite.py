@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+
+from yolo_object_detection import YoloObjectDetection, decode_output, read_model_config
+from inference_backend import create_backend
+from object_tracking import CV2Tracking
+from object_detection import Detections
+from video_image_provider import VideoImageProvider
+from frame_processor import FrameProcessor
+from letterbox import Letterbox
+from benchmark import grid_boxes
+
+try:
+    import onnx
+    from onnx import helper, numpy_helper, TensorProto
+except:
+    pass
+
+
+# yolo shaped model for benchmarking without a trained one, outputs (batch, 4 + classes, 8400) like yolov8 at 640
+# three strided convolutions stand in for the detection heads at strides 8, 16 and 32, the weights are random but fixed
+# height and width are left open like in models exported with dynamic axes, resolution only scales the boxes
+def write_synthetic_model(model_dir, classes_path, resolution=(640, 640), seed=0):
+    if 'onnx' not in sys.modules:
+        raise SystemExit("generating the synthetic model needs the onnx package, or pass --model")
+
+    with open(classes_path) as classes_file:
+        n_classes = sum(1 for line in classes_file if line.strip())
+    n_outputs = 4 + n_classes
+    rng = np.random.default_rng(seed)
+
+    nodes = []
+    initializers = []
+    heads = []
+    for stride in [8, 16, 32]:
+        weights = np.float32(rng.standard_normal((n_outputs, 3, stride, stride)) * .5 / stride)
+        initializers.append(numpy_helper.from_array(weights, f"weights{stride}"))
+        nodes.append(helper.make_node("Conv", ["images", f"weights{stride}"], [f"conv{stride}"], strides=[stride, stride], kernel_shape=[stride, stride]))
+        nodes.append(helper.make_node("Reshape", [f"conv{stride}", "shape"], [f"head{stride}"]))
+        heads.append(f"head{stride}")
+
+    # boxes are scaled to pixels, classes stay sigmoid scores
+    scale = np.ones((1, n_outputs, 1), dtype=np.float32)
+    scale[0, 0:4] = max(resolution)
+    initializers.append(numpy_helper.from_array(scale, "scale"))
+    initializers.append(numpy_helper.from_array(np.int64([0, n_outputs, -1]), "shape"))
+    nodes.append(helper.make_node("Concat", heads, ["heads"], axis=2))
+    nodes.append(helper.make_node("Sigmoid", ["heads"], ["scores"]))
+    nodes.append(helper.make_node("Mul", ["scores", "scale"], ["output0"]))
+
+    graph = helper.make_graph(
+        nodes, "synthetic yolo",
+        [helper.make_tensor_value_info("images", TensorProto.FLOAT, ["batch", 3, "height", "width"])],
+        [helper.make_tensor_value_info("output0", TensorProto.FLOAT, ["batch", n_outputs, "anchors"])],
+        initializers
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+
+    os.makedirs(model_dir, exist_ok=True)
+    onnx.save(model, os.path.join(model_dir, "model.onnx"))
+    shutil.copyfile(classes_path, os.path.join(model_dir, "classes.csv"))
+
+
+# latencies of a stage, summarized as throughput and percentiles
+def summarize(seconds, items=1):
+    ms = np.array(seconds) * 1000
+    return {
+        "samples": len(ms),
+        "per_second": items * len(ms) / (ms.sum() / 1000),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99))
+    }
+
+
+# seconds of every call of function on every input
+def time_calls(function, inputs, runs=1):
+    function(inputs[0])
+    seconds = []
+    for _ in range(runs):
+        for item in inputs:
+            start = time.perf_counter()
+            function(item)
+            seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def benchmark_decode(videos, frames):
+    seconds = []
+    decoded = []
+    for video in videos:
+        provider = VideoImageProvider(video, loop=False)
+        for _ in range(frames):
+            start = time.perf_counter()
+            image = provider.next()
+            if image is None:
+                break
+            seconds.append(time.perf_counter() - start)
+            decoded.append(image)
+        provider.close()
+    return seconds, decoded
+
+
+def run_suite(args, model_dir):
+    results = {}
+    config = read_model_config(model_dir)
+    resolution = tuple(config.get("input_size", (640, 640)))
+    videos = [os.path.join(args.videos, video) for video in sorted(os.listdir(args.videos)) if video.endswith(".mp4")]
+
+    seconds, frames = benchmark_decode(videos, args.frames)
+    results["video decode"] = summarize(seconds)
+
+    # frames as the processor hands them to the detector and tracker
+    images = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+
+    letterbox = Letterbox(resolution)
+    results["preprocess"] = summarize(time_calls(
+        lambda frame: letterbox.prepare([cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)]), frames
+    ))
+
+    backend = create_backend(
+        os.path.join(model_dir, "model.onnx"), config.get("backend"), config.get("threads"),
+        config.get("dnn_backend", "default"), config.get("dnn_target", "cpu")
+    )
+    blobs = [letterbox.prepare([image])[0].copy() for image in images[0:args.forward_frames]]
+    results["forward"] = summarize(time_calls(backend.forward, blobs))
+
+    detector = YoloObjectDetection(
+        "YOLO: benchmark", os.path.join(model_dir, "model.onnx"), os.path.join(model_dir, "classes.csv"), config=config
+    )
+    outputs = [backend.forward(blob)[0] for blob in blobs]
+    results["decode and nms"] = summarize(time_calls(
+        lambda out: decode_output(out, args.threshold, args.nms_threshold, detector.enable_classes, detector.max_candidates), outputs
+    ))
+    results["detect"] = summarize(time_calls(
+        lambda image: detector.detect(image, args.threshold, args.nms_threshold), images[0:args.forward_frames]
+    ))
+
+    # trackers on consecutive frames of the first video, at the resolution FrameProcessor tracks at
+    sequence = images[0:args.tracking_frames + 1]
+    for tracker_type in args.trackers:
+        tracker = CV2Tracking(tracker_type, (640, 640))
+        for count in args.objects:
+            detections = Detections.create(grid_boxes(count, (sequence[0].shape[1], sequence[0].shape[0]), size=80))
+            tracker.init(sequence[0], detections)
+            results[f"track {tracker_type} {count}"] = summarize(time_calls(tracker.track, sequence[1:]), count)
+
+    # a fixed number of boxes, the synthetic model finds few after nms
+    processor = FrameProcessor()
+    image_size = (images[0].shape[1], images[0].shape[0])
+    names, colors = detector.class_table()
+    detections = Detections.create(
+        grid_boxes(args.draw_boxes, image_size), np.arange(args.draw_boxes) % len(names), .5, names, colors
+    )
+    truth = Detections.create([[100, 100, 50, 50]], names=np.array(["plane"]), colors=np.zeros((1, 3), dtype=np.int64))
+    canvases = [image.copy() for image in images[0:args.forward_frames]]
+    results[f"draw {args.draw_boxes}"] = summarize(time_calls(lambda image: processor.draw(image, detections, truth), canvases))
+
+    return results
+
+
+# stages slower than the baseline by more than the tolerance, as (stage, baseline, current)
+def compare(results, baseline, metric, tolerance):
+    regressions = []
+    print(f"{'stage':>24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for stage, result in results.items():
+        if stage not in baseline:
+            print(f"{stage:>24} {'-':>10} {result[metric]:>10.3f}")
+            continue
+        before = baseline[stage][metric]
+        change = result[metric] / before - 1 if before > 0 else 0
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{stage:>24} {before:>10.3f} {result[metric]:>10.3f} {change:>+8.0%}{flag}")
+        if change > tolerance:
+            regressions.append((stage, before, result[metric]))
+    return regressions
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpus": os.cpu_count(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "opencv threads": cv2.getNumThreads()
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="times every stage of the pipeline on the bundled videos with a synthetic or given model",
+        epilog="timings only compare on the machine they were taken on, so no baseline comes with the repository: record one "
+               "with --record-baseline on the machine and settings to watch, later runs there fail on stages slower than it"
+    )
+    parser.add_argument("--model", help="model directory with model.onnx and classes.csv, a synthetic model is generated if missing")
+    parser.add_argument("--classes", default="yolo/flying objects/classes.csv", help="classes of the synthetic model")
+    parser.add_argument("--videos", default="videos")
+    parser.add_argument("--frames", type=int, default=30, help="frames decoded from each video")
+    parser.add_argument("--forward-frames", type=int, default=20, help="frames the model runs on")
+    parser.add_argument("--tracking-frames", type=int, default=10)
+    parser.add_argument("--trackers", nargs="+", default=list(CV2Tracking.tracker_types))
+    parser.add_argument("--objects", type=int, nargs="+", default=[1, 5, 20])
+    parser.add_argument("--draw-boxes", type=int, default=20, help="boxes drawn per frame")
+    parser.add_argument("--threshold", type=float, default=.2)
+    parser.add_argument("--nms-threshold", type=float, default=.5)
+    parser.add_argument("--threads", type=int, default=1, help="opencv threads, fixed so runs are comparable")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json", help="results of an earlier run on this machine to compare against, skipped with a warning if missing")
+    parser.add_argument("--record-baseline", action="store_true", help="save this run as the baseline instead of comparing against it")
+    parser.add_argument("--metric", default="p50_ms", choices=["mean_ms", "p50_ms", "p95_ms", "p99_ms"])
+    parser.add_argument("--tolerance", type=float, default=.2, help="allowed slowdown against the baseline, as a fraction")
+    args = parser.parse_args()
+
+    cv2.setNumThreads(args.threads)
+    cv2.setRNGSeed(0)
+
+    start = time.perf_counter()
+    if args.model is None:
+        with tempfile.TemporaryDirectory(prefix="synthetic yolo ") as model_dir:
+            write_synthetic_model(model_dir, args.classes)
+            results = run_suite(args, model_dir)
+    else:
+        results = run_suite(args, args.model)
+    print(f"suite ran in {time.perf_counter() - start:.1f} s")
+
+    with open(args.output, "w") as output_file:
+        json.dump({"environment": environment(), "model": args.model or "synthetic", "stages": results}, output_file, indent=2)
+
+    print(f"{'stage':>24} {'per second':>12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for stage, result in results.items():
+        print(f"{stage:>24} {result['per_second']:>12.1f} {result['p50_ms']:>8.3f} {result['p95_ms']:>8.3f} {result['p99_ms']:>8.3f}")
+
+    if args.record_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"recorded {args.baseline} as the baseline of this machine")
+    elif not os.path.isfile(args.baseline):
+        print(f"WARNING no baseline {args.baseline}, nothing was compared, record one on this machine with --record-baseline", file=sys.stderr)
+    else:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("environment") != environment() or baseline.get("model") != (args.model or "synthetic"):
+            print(f"WARNING {args.baseline} was recorded with another machine, library versions or model, timings may not compare", file=sys.stderr)
+        regressions = compare(results, baseline["stages"], args.metric, args.tolerance)
+        if len(regressions) > 0:
+            for stage, before, after in regressions:
+                print(f"REGRESSION {stage}: {args.metric} {before:.3f} -> {after:.3f}", file=sys.stderr)
+            sys.exit(1)
@@ -0,0 +1,381 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import cv2
+import numpy as np
+
+from object_detection import ObjectDetection, Detections
+
+try:
+    import fcntl
+except:
+    pass
+
+
+# hashes of files by path, size and modification time, so each file is only read once
+file_hashes = {}
+
+
+# content hash of a file, like a video or a model
+def file_hash(path):
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    digest = file_hashes.get(key)
+    if digest is None:
+        hasher = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as hashed_file:
+            for chunk in iter(lambda: hashed_file.read(1 << 20), b""):
+                hasher.update(chunk)
+        digest = file_hashes[key] = hasher.hexdigest()
+    return digest
+
+
+class CacheSegment:
+
+    # detections of one video with one detector configuration, one file per column, appended to and memory mapped
+    # frames: frame index, first detection and detection count of every cached frame
+    # boxes, class ids and confidences: one row per detection, class ids index the class table of the detector
+    columns = {
+        "frames": (np.int32, (3,)),
+        "boxes": (np.float32, (4,)),
+        "class_ids": (np.int16, ()),
+        "confidences": (np.float16, ())
+    }
+
+    def __init__(self, directory, key):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        meta_path = os.path.join(directory, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+        else:
+            meta = {"key": key}
+        self.key = meta["key"]
+
+        self.lock = threading.Lock()
+        self.frames = {}
+        self.frames_read = 0
+        self.maps = {}
+
+    # detections of a frame with the given class names and colors, None if not cached
+    def get(self, index, names, colors):
+        with self.lock:
+            try:
+                if index not in self.frames:
+                    self.__read_frames()
+                if index not in self.frames:
+                    return None
+
+                start, count = self.frames[index]
+                if count == 0:
+                    # frames without detections need no rows, the columns may still be empty files
+                    return Detections.empty(names, colors)
+                boxes = np.array(self.__column("boxes", start + count)[start:start + count])
+                class_ids = np.array(self.__column("class_ids", start + count)[start:start + count])
+                confidences = np.array(self.__column("confidences", start + count)[start:start + count])
+            except FileNotFoundError:
+                # evicted by another process
+                self.__forget()
+                return None
+
+        return Detections.create(boxes, class_ids, confidences, names, colors)
+
+    def put(self, index, detections):
+        detections = detections.valid_only()
+
+        with self.lock:
+            # the segment is written again from scratch after it was evicted
+            if not os.path.exists(self.__path("frames")):
+                self.__forget()
+            os.makedirs(self.directory, exist_ok=True)
+
+            with self.__file_lock():
+                self.__append_frame(index, detections)
+
+    def __append_frame(self, index, detections):
+        # other processes may have added frames since they were read
+        self.__read_frames()
+        if index in self.frames:
+            return
+        if not os.path.exists(os.path.join(self.directory, "meta.json")):
+            self.__write_meta()
+
+        start = os.path.getsize(self.__path("boxes")) // self.__row_size("boxes") if os.path.exists(self.__path("boxes")) else 0
+        self.__append("boxes", detections.boxes)
+        self.__append("class_ids", detections.class_ids)
+        self.__append("confidences", detections.confidences)
+        # the frame is written last, readers only see it once its detections are complete
+        self.__append("frames", np.int32([[index, start, len(detections)]]))
+        self.frames[index] = (start, len(detections))
+        self.frames_read += 1
+
+    # mark the segment as used for the least recently used eviction
+    def touch(self):
+        os.utime(self.directory)
+
+    # drop what was read of a segment that was evicted
+    def __forget(self):
+        self.frames = {}
+        self.frames_read = 0
+        self.maps = {}
+
+    def __path(self, column):
+        return os.path.join(self.directory, column + ".bin")
+
+    def __row_size(self, column):
+        dtype, shape = self.columns[column]
+        return np.dtype(dtype).itemsize * int(np.prod(shape))
+
+    # memory map of a column covering at least the given number of rows, empty files cannot be mapped
+    def __column(self, column, rows):
+        mapped = self.maps.get(column)
+        if mapped is None or len(mapped) < rows:
+            dtype, shape = self.columns[column]
+            length = os.path.getsize(self.__path(column)) // self.__row_size(column)
+            if length == 0:
+                return np.empty((0,) + shape, dtype=dtype)
+            mapped = self.maps[column] = np.memmap(self.__path(column), dtype=dtype, mode="r", shape=(length,) + shape)
+        return mapped
+
+    # frames appended since the last read, by this or another process
+    def __read_frames(self):
+        path = self.__path("frames")
+        if not os.path.exists(path):
+            return
+        rows = os.path.getsize(path) // self.__row_size("frames")
+        if rows <= self.frames_read:
+            return
+        for index, start, count in self.__column("frames", rows)[self.frames_read:rows]:
+            self.frames[int(index)] = (int(start), int(count))
+        self.frames_read = rows
+
+    def __write_meta(self):
+        meta_path = os.path.join(self.directory, "meta.json")
+        with open(meta_path + ".tmp", "w") as meta_file:
+            json.dump({"key": self.key}, meta_file)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    def __append(self, column, rows):
+        dtype, shape = self.columns[column]
+        with open(self.__path(column), "ab") as column_file:
+            column_file.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+
+    # lock against other processes writing the segment, where the platform supports it
+    def __file_lock(self):
+        return SegmentLock(os.path.join(self.directory, "lock"))
+
+
+class SegmentLock:
+
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.file = open(self.path, "a")
+        if 'fcntl' in globals():
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exception):
+        if 'fcntl' in globals():
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        return False
+
+
+class DetectionCache:
+
+    # detections on disk, one segment per video and detector configuration
+    # segments are evicted least recently used first once the cache is larger than max_bytes
+    def __init__(self, directory="detection cache", max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self.segments = {}
+        self.lock = threading.Lock()
+        self.puts = 0
+
+    # segment for a key of json types, created if it does not exist
+    def segment(self, key):
+        name = hashlib.blake2b(json.dumps(key, sort_keys=True).encode(), digest_size=12).hexdigest()
+        with self.lock:
+            segment = self.segments.get(name)
+            if segment is None:
+                segment = self.segments[name] = CacheSegment(os.path.join(self.directory, name), key)
+                segment.touch()
+        return segment
+
+    def get(self, key, index, names, colors):
+        return self.segment(key).get(index, names, colors)
+
+    # check the size limit every few stored frames, listing the cache is not free
+    def put(self, key, index, detections):
+        self.segment(key).put(index, detections)
+        self.puts += 1
+        if self.puts % 100 == 0:
+            self.evict()
+
+    def size(self):
+        return sum(self.__segment_size(path) for path in self.__segment_paths())
+
+    # remove least recently used segments until the cache fits its limit
+    def evict(self):
+        paths = sorted(self.__segment_paths(), key=os.path.getmtime)
+        sizes = {path: self.__segment_size(path) for path in paths}
+        total = sum(sizes.values())
+        for path in paths:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+            with self.lock:
+                self.segments.pop(os.path.basename(path), None)
+
+    @staticmethod
+    def __segment_size(path):
+        return sum(os.path.getsize(os.path.join(path, item)) for item in os.listdir(path))
+
+    def __segment_paths(self):
+        return [
+            os.path.join(self.directory, item) for item in os.listdir(self.directory)
+            if os.path.isdir(os.path.join(self.directory, item))
+        ]
+
+
+class CachedDetection(ObjectDetection):
+
+    # answers detections of video frames seen before from the cache, runs the wrapped detector on the others
+    # the key covers the video content, the model file, the input size, the thresholds and the enabled classes
+    # only a model is cached, sliced and motion gated detection keep state between frames and go around the cache
+    def __init__(self, detector, cache):
+        super().__init__()
+        if hasattr(detector, "detector"):
+            raise ValueError(f"{detector.name} wraps another detector, cache the model and wrap the cache instead")
+        self.detector = detector
+        self.cache = cache
+        self.name = detector.name
+
+        # classes and their toggles are shared with the wrapped detector
+        self._classes = detector._classes
+        self.enable_classes = detector.enable_classes
+
+        self.source = None
+        self.index = None
+        self.hits = 0
+        self.misses = 0
+
+    def image_resolution(self):
+        return self.detector.image_resolution()
+
+    def input_sizes(self):
+        return self.detector.input_sizes()
+
+    def set_input_size(self, resolution):
+        self.detector.set_input_size(resolution)
+
+    def class_table(self):
+        return self.detector.class_table()
+
+    def load(self, background=False):
+        self.detector.load(background)
+
+    def focus(self, boxes):
+        self.detector.focus(boxes)
+
+    def source_frame(self, source, index):
+        self.source = source
+        self.index = index
+        self.detector.source_frame(source, index)
+
+    def statistics(self):
+        statistics = {"cache hits": self.hits, "cache misses": self.misses}
+        statistics.update(self.detector.statistics())
+        return statistics
+
+    # file of the model the detector runs
+    def model_path(self):
+        return getattr(self.detector, "model_path", None)
+
+    def key(self, threshold, nms_threshold):
+        model_path = self.model_path()
+        return {
+            "video": file_hash(self.source),
+            "model": file_hash(model_path) if model_path is not None else None,
+            "detector": self.detector.name,
+            "input size": list(self.image_resolution()),
+            "threshold": float(threshold),
+            "nms threshold": float(nms_threshold),
+            "classes": [bool(enabled) for enabled in self.enable_classes],
+            "class names": [str(name) for name in self.class_table()[0]]
+        }
+
+    def detect(self, image, threshold, nms_threshold):
+        # only frames of video files can be found again
+        if self.source is None or self.index is None or not os.path.isfile(self.source):
+            return self.detector.detect(image, threshold, nms_threshold)
+
+        key = self.key(threshold, nms_threshold)
+        detections = self.cache.get(key, self.index, *self.class_table())
+        if detections is not None:
+            self.hits += 1
+            return detections
+
+        self.misses += 1
+        detections = self.detector.detect(image, threshold, nms_threshold)
+        self.cache.put(key, self.index, detections)
+        return detections
+
+    # batches are tiles or crops of a frame from the wrappers, not frames, they are not cached
+    def detect_batch(self, images, threshold, nms_threshold):
+        return self.detector.detect_batch(images, threshold, nms_threshold)
+
+
+# detect on every frame of every video in a folder, so later runs only read the cache
+def warm(cache, detector, folder, threshold=.2, nms_threshold=.5):
+    cached = CachedDetection(detector, cache)
+    for video in sorted(os.listdir(folder)):
+        path = os.path.join(folder, video)
+        capture = cv2.VideoCapture(path)
+        if not capture.isOpened():
+            continue
+
+        start = time.perf_counter()
+        index = 0
+        while True:
+            success, image = capture.read()
+            if not success:
+                break
+            # the same conversion FrameProcessor applies before detecting
+            cached.source_frame(path, index)
+            cached.detect(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), threshold, nms_threshold)
+            index += 1
+        capture.release()
+        print(f"{path}: {index} frames in {time.perf_counter() - start:.1f} s, {cached.hits} cached before")
+        cached.hits = 0
+    cache.evict()
+
+
+if __name__ == '__main__':
+    from yolo_object_detection import YoloObjectDetection
+
+    parser = argparse.ArgumentParser(description="fill the detection cache for every frame of every video in a folder")
+    parser.add_argument("--videos", default="videos")
+    parser.add_argument("--model", help="model directory name in yolo/, defaults to all of them")
+    parser.add_argument("--cache", default="detection cache", help="cache directory")
+    parser.add_argument("--max-megabytes", type=int, default=512)
+    parser.add_argument("--threshold", type=float, default=.2)
+    parser.add_argument("--nms-threshold", type=float, default=.5)
+    args = parser.parse_args()
+
+    cache = DetectionCache(args.cache, args.max_megabytes * 1024 * 1024)
+    for detector in YoloObjectDetection.look_for_models():
+        if args.model is None or detector.name == 'YOLO: ' + args.model:
+            warm(cache, detector, args.videos, args.threshold, args.nms_threshold)
+    print(f"cache size: {cache.size() / 1e6:.1f} MB")
@@ -0,0 +1,50 @@
+import sys
+import tempfile
+import numpy as np
+
+from detection_cache import DetectionCache
+from object_detection import Detections
+
+
+names = np.array(["bird", "plane"])
+colors = np.int64([[255, 0, 0], [0, 255, 0]])
+
+
+# stores frames without detections before any with detections, as a sky clip opening on empty frames does,
+# and reads them back through the segment that wrote them and through a fresh cache on the same directory
+def check(directory):
+    failures = []
+    key = {"video": "empty frames first"}
+
+    cache = DetectionCache(directory)
+    cache.put(key, 0, Detections.empty(names, colors))
+    cache.put(key, 1, Detections.empty(names, colors))
+    empty = cache.get(key, 0, names, colors)
+    if empty is None or len(empty) != 0:
+        failures.append(f"empty frame read back as {empty}")
+
+    boxes = np.float32([[10, 20, 30, 40], [50, 60, 70, 80]])
+    cache.put(key, 2, Detections.create(boxes, np.int16([0, 1]), np.float16([.5, .9]), names, colors))
+
+    for name, reader in [("writer", cache), ("new cache", DetectionCache(directory))]:
+        for index in (0, 1):
+            detections = reader.get(key, index, names, colors)
+            if detections is None or len(detections) != 0:
+                failures.append(f"{name}: frame {index} should be empty, got {detections}")
+        detections = reader.get(key, 2, names, colors)
+        if detections is None or not np.array_equal(detections.boxes, boxes) or detections.class_ids.tolist() != [0, 1]:
+            failures.append(f"{name}: frame 2 read back as {detections}")
+        if reader.get(key, 3, names, colors) is not None:
+            failures.append(f"{name}: frame 3 was never stored")
+    return failures
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        failures = check(directory)
+
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    if len(failures) > 0:
+        sys.exit(1)
+    print("empty and non-empty frames read back from the detection cache")
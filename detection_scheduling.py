@@ -0,0 +1,178 @@
+import logging
+import math
+import cv2
+import numpy as np
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+
+class DetectionScheduler(ABC):
+
+    name = ""
+
+    def __init__(self):
+        self.reset()
+
+    # decide if the detector runs on the next frame
+    @abstractmethod
+    def should_detect(self):
+        pass
+
+    # feedback after each frame, step is "detect", "track" or None, detections are the Detections after the step
+    def update(self, step, image, detections, seconds):
+        if step == "detect":
+            self.frames_since_detection = 1
+        elif self.frames_since_detection is not None:
+            self.frames_since_detection += 1
+
+    def reset(self):
+        # None until the first detection
+        self.frames_since_detection = None
+        self.last_reason = None
+
+
+class FixedFrequencyScheduler(DetectionScheduler):
+
+    name = "fixed"
+
+    def __init__(self, frequency=30):
+        super().__init__()
+        self.frequency = frequency
+
+    def should_detect(self):
+        if self.frames_since_detection is None or self.frames_since_detection >= self.frequency:
+            self.last_reason = "interval"
+            return True
+        return False
+
+
+class AdaptiveScheduler(DetectionScheduler):
+
+    name = "adaptive"
+
+    # side of the downscaled gray image used to measure scene motion
+    motion_size = 64
+
+    def __init__(self, max_interval=30, min_interval=1, target_latency=None, failure_ratio=.3, max_drift=.5, max_motion=8.0):
+        self.max_interval = max_interval
+        self.min_interval = min_interval
+        # average seconds per frame the detector and tracker together should stay under, None for no budget
+        self.target_latency = target_latency
+        # fraction of lost objects that triggers a detection
+        self.failure_ratio = failure_ratio
+        # movement of a tracked box since its detection, relative to its size, that triggers a detection
+        self.max_drift = max_drift
+        # mean absolute gray level change between frames that triggers a detection
+        self.max_motion = max_motion
+        super().__init__()
+
+    def should_detect(self):
+        reason = None
+        if self.frames_since_detection is None:
+            reason = "first frame"
+        elif self.trigger is not None and self.frames_since_detection >= self.budget_interval():
+            reason = self.trigger
+        elif self.frames_since_detection >= self.interval:
+            reason = "interval"
+
+        if reason is None:
+            return False
+
+        # back off after a calm period, come back quickly after trouble
+        if self.frames_since_detection is not None:
+            if self.trigger is None:
+                self.interval = min(self.max_interval, self.interval * 2)
+            else:
+                self.interval = max(self.min_interval, self.interval // 2)
+            self.interval = max(self.interval, self.budget_interval())
+
+        logger.info(f"detect after {self.frames_since_detection} frames: {reason}, next interval {self.interval}")
+        self.last_reason = reason
+        self.trigger = None
+        return True
+
+    def update(self, step, image, detections, seconds):
+        super().update(step, image, detections, seconds)
+
+        motion = self.__motion(image)
+
+        if step == "detect":
+            self.detect_time = self.__average(self.detect_time, seconds)
+            self.detected_boxes = None if detections is None else detections.boxes.copy()
+            return
+
+        if step == "track":
+            self.track_time = self.__average(self.track_time, seconds)
+            if detections is not None and len(detections) > 0 and self.trigger is None:
+                failures = 1 - detections.valid.mean()
+                if failures >= self.failure_ratio:
+                    self.trigger = f"{failures:.0%} of objects lost"
+                elif self.__drift(detections) >= self.max_drift:
+                    self.trigger = "boxes drifted"
+
+        if motion is not None and motion >= self.max_motion and self.trigger is None:
+            self.trigger = f"scene motion {motion:.1f}"
+
+    def reset(self):
+        super().reset()
+        self.interval = self.min_interval
+        self.trigger = None
+        self.detected_boxes = None
+        self.previous_image = None
+        self.detect_time = None
+        self.track_time = None
+
+    # smallest interval that keeps the average frame time within the target latency
+    def budget_interval(self):
+        if self.target_latency is None or self.detect_time is None:
+            return self.min_interval
+
+        track_time = self.track_time or 0
+        if self.target_latency <= track_time:
+            return self.max_interval
+
+        needed = math.ceil((self.detect_time - track_time) / (self.target_latency - track_time))
+        return min(self.max_interval, max(self.min_interval, needed))
+
+    # largest movement of a valid box since it was detected, relative to the box size
+    def __drift(self, detections):
+        if self.detected_boxes is None or len(detections) != len(self.detected_boxes):
+            return 0
+
+        boxes = detections.boxes[detections.valid]
+        detected = self.detected_boxes[detections.valid]
+        if len(boxes) == 0:
+            return 0
+        size = np.maximum(detected[:, 2:4].max(axis=1), 1)
+        return float((np.hypot(*(boxes[:, 0:2] - detected[:, 0:2]).T) / size).max())
+
+    def __motion(self, image):
+        if image is None:
+            return None
+
+        small = cv2.resize(image, (self.motion_size, self.motion_size), interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_RGB2GRAY)
+        previous = self.previous_image
+        self.previous_image = small
+        if previous is None:
+            return None
+
+        return float(cv2.absdiff(small, previous).mean())
+
+    @staticmethod
+    def __average(average, seconds):
+        if average is None:
+            return seconds
+        return .9 * average + .1 * seconds
+
+
+# names of all schedulers create_scheduler knows
+scheduler_names = [FixedFrequencyScheduler.name, AdaptiveScheduler.name]
+
+
+# the detector frequency is the fixed interval, or the longest interval of the adaptive scheduler
+def create_scheduler(name, detector_frequency):
+    if name == AdaptiveScheduler.name:
+        return AdaptiveScheduler(max_interval=detector_frequency)
+    return FixedFrequencyScheduler(detector_frequency)
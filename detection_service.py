@@ -0,0 +1,433 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import cv2
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from video_image_provider import VideoImageProvider
+try:
+    from picamera_image_provider import PicameraImageProvider
+except:
+    pass
+from object_detection import NoDetection
+from yolo_object_detection import YoloObjectDetection
+from sliced_detection import SlicedDetection
+from motion_gating import MotionGatedDetection
+from object_tracking import NoTracking, CV2Tracking, SortTracking, FlowTracking
+from accuracy_evaluation import AccuracyEvaluator
+from frame_processor import FrameProcessor
+from detection_scheduling import FixedFrequencyScheduler, AdaptiveScheduler
+from resolution_control import ResolutionController
+from pipeline import Pipeline, LatestQueue
+from detection_cache import DetectionCache, CachedDetection
+from instrumentation import metrics
+
+
+# detections as json types, only the valid ones, boxes as center x, center y, width, height
+def detections_json(detections):
+    if detections is None:
+        return []
+    detections = detections.valid_only()
+    return [
+        {"class": str(name), "confidence": round(confidence, 3), "track_id": track_id, "box": [round(c, 1) for c in box]}
+        for name, confidence, track_id, box in zip(
+            detections.class_names(), detections.confidences.tolist(), detections.track_ids.tolist(), detections.boxes.tolist()
+        )
+    ]
+
+
+class DetectionService:
+
+    # events kept for a subscriber that reads too slowly, older ones are dropped
+    event_queue_size = 64
+
+    # runs the pipeline without a window, frames are only drawn and encoded while a stream client is connected
+    def __init__(self, providers, evaluators, detectors, trackers, detector_frequency=30, jpeg_quality=80):
+        self.providers = providers
+        self.evaluators = evaluators
+        self.detectors = detectors
+        self.trackers = trackers
+        self.selected = {"provider": -1, "detector": -1, "tracker": -1}
+
+        self.detector_frequency = detector_frequency
+        self.schedulers = [FixedFrequencyScheduler(detector_frequency), AdaptiveScheduler(detector_frequency)]
+        self.processor = FrameProcessor(self.schedulers[0])
+        self.pipeline = Pipeline(self.processor)
+        self.pipeline.rendering.clear()
+        self.pipeline.observers.append(self.__processed)
+        self.jpeg_quality = jpeg_quality
+
+        self.lock = threading.Lock()
+        self.frame_counter = 0
+        self.latest = {"frame": None, "time": None, "step": None, "detections": None}
+        self.subscribers = []
+
+        # the newest encoded frame, shared by all stream clients
+        self.frame_condition = threading.Condition()
+        self.jpeg = None
+        self.jpeg_number = 0
+        self.stream_clients = 0
+        self.encoder = None
+
+    def start(self):
+        self.pipeline.start()
+
+    def stop(self):
+        self.pipeline.stop()
+        with self.frame_condition:
+            self.stream_clients = 0
+            self.frame_condition.notify_all()
+
+    # the selectable components, what is selected and the classes of the selected detector, like the tabs of the gui
+    def config(self):
+        detector = self.processor.detector
+        return {
+            "providers": [provider.name for provider in self.providers],
+            "provider": self.selected["provider"],
+            "detectors": [detector.name for detector in self.detectors],
+            "detector": self.selected["detector"],
+            "trackers": [tracker.name for tracker in self.trackers],
+            "tracker": self.selected["tracker"],
+            "schedulers": [scheduler.name for scheduler in self.schedulers],
+            "scheduler": self.processor.scheduler.name,
+            "detector_frequency": self.detector_frequency,
+            "input_sizes": [] if detector is None else [list(size) for size in detector.input_sizes()],
+            "input_size": None if detector is None else list(detector.image_resolution()),
+            # seconds per detection the input size is adapted to, None for a fixed size
+            "target_latency": None if self.processor.resolution_controller is None else self.processor.resolution_controller.target_latency,
+            "classes": {} if detector is None else {
+                name: bool(enabled) for name, enabled in zip(detector.class_table()[0].tolist(), detector.enable_classes)
+            }
+        }
+
+    # apply the given settings, any of the keys of config, components by index or name
+    # all of them are checked before any is applied, settings are left as they were if one of them is invalid
+    def configure(self, changes):
+        with self.lock:
+            indices = {
+                name: self.__index(components, changes[name])
+                for name, components in [("provider", self.providers), ("detector", self.detectors), ("tracker", self.trackers), ("scheduler", self.schedulers)]
+                if name in changes
+            }
+            if "detector_frequency" in changes:
+                detector_frequency = max(1, int(changes["detector_frequency"]))
+            if "target_latency" in changes:
+                target_latency = None if changes["target_latency"] is None else float(changes["target_latency"])
+
+            # input sizes and classes are those of the detector selected along with them, if one is
+            detector = self.detectors[indices["detector"]] if "detector" in indices else self.processor.detector
+            if ("input_size" in changes or "classes" in changes) and detector is None:
+                raise ValueError("no detector selected")
+            if "input_size" in changes:
+                size = tuple(int(c) for c in changes["input_size"])
+                if size not in detector.input_sizes():
+                    raise ValueError(f"input size {size} not supported, one of {detector.input_sizes()}")
+            enable_classes = {}
+            if "classes" in changes:
+                names = detector.class_table()[0].tolist()
+                for name, enabled in changes["classes"].items():
+                    if name not in names:
+                        raise ValueError(f"unknown class {name}")
+                    enable_classes[names.index(name)] = bool(enabled)
+
+            if "provider" in indices:
+                if 0 <= self.selected["provider"] < len(self.providers):
+                    self.processor.set_provider(None)
+                    self.providers[self.selected["provider"]].close()
+                self.selected["provider"] = indices["provider"]
+                provider = self.providers[indices["provider"]]
+                self.processor.set_provider(provider, self.evaluators.get(provider))
+
+            if "detector" in indices:
+                self.selected["detector"] = indices["detector"]
+                detector.load(background=True)
+                self.processor.set_detector(detector)
+
+            if "tracker" in indices:
+                self.selected["tracker"] = indices["tracker"]
+                self.processor.set_tracker(self.trackers[indices["tracker"]])
+
+            if "scheduler" in indices:
+                self.processor.set_scheduler(self.schedulers[indices["scheduler"]])
+
+            if "detector_frequency" in changes:
+                self.detector_frequency = detector_frequency
+                self.schedulers[0].frequency = detector_frequency
+                self.schedulers[1].max_interval = detector_frequency
+
+            if "input_size" in changes:
+                detector.set_input_size(size)
+
+            if "target_latency" in changes:
+                self.processor.set_resolution_controller(None if target_latency is None else ResolutionController(target_latency))
+
+            for index, enabled in enable_classes.items():
+                detector.enable_classes[index] = enabled
+
+        return self.config()
+
+    # the detections of the newest processed frame
+    def detections(self):
+        with self.lock:
+            latest = dict(self.latest)
+        latest["detections"] = detections_json(latest["detections"])
+        return latest
+
+    # queue the detection events of every processed frame are put into, until unsubscribed
+    def subscribe(self):
+        queue = LatestQueue(self.event_queue_size)
+        with self.lock:
+            self.subscribers.append(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        with self.lock:
+            self.subscribers.remove(queue)
+
+    # jpeg frames for one stream client, drawing and encoding run only while at least one is connected
+    def frames(self):
+        with self.frame_condition:
+            self.stream_clients += 1
+            if self.encoder is None:
+                self.encoder = threading.Thread(target=self.__encode, name="encode", daemon=True)
+                self.encoder.start()
+            self.pipeline.rendering.set()
+        try:
+            number = self.jpeg_number
+            while True:
+                with self.frame_condition:
+                    self.frame_condition.wait_for(lambda: self.jpeg_number != number or not self.pipeline.running.is_set(), 1)
+                    if not self.pipeline.running.is_set():
+                        return
+                    if self.jpeg_number == number:
+                        continue
+                    number = self.jpeg_number
+                    jpeg = self.jpeg
+                yield jpeg
+        finally:
+            with self.frame_condition:
+                self.stream_clients -= 1
+                if self.stream_clients == 0:
+                    self.pipeline.rendering.clear()
+
+    # one encoder for all clients, stops when the last one disconnects
+    def __encode(self):
+        while True:
+            with self.frame_condition:
+                if self.stream_clients == 0:
+                    self.encoder = None
+                    return
+            image = self.pipeline.latest(self.pipeline.poll_interval)
+            if image is None:
+                continue
+            with metrics.span("encode"):
+                success, jpeg = cv2.imencode(".jpg", cv2.cvtColor(image, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            if not success:
+                continue
+            with self.frame_condition:
+                self.jpeg = jpeg.tobytes()
+                self.jpeg_number += 1
+                self.frame_condition.notify_all()
+
+    # observer of the pipeline, keeps the newest detections and hands events to the subscribers
+    def __processed(self, source, detections, truth):
+        with self.lock:
+            self.frame_counter += 1
+            self.latest = {
+                "frame": self.frame_counter if source is None else source[1],
+                "time": time.time(),
+                "step": self.processor.last_step,
+                "detections": detections
+            }
+            subscribers = list(self.subscribers)
+        if len(subscribers) == 0:
+            return
+
+        event = json.dumps(dict(self.latest, detections=detections_json(detections)))
+        for queue in subscribers:
+            queue.put(event)
+
+    @staticmethod
+    def __index(components, selection):
+        if isinstance(selection, str):
+            names = [component.name for component in components]
+            if selection not in names:
+                raise ValueError(f"unknown component {selection}, one of {names}")
+            return names.index(selection)
+        index = int(selection)
+        if not 0 <= index < len(components):
+            raise ValueError(f"index {index} out of range")
+        return index
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+
+    # GET  /config       selectable components and current settings
+    # POST /config       change settings, like {"detector": 1, "tracker": "SORT", "classes": {"bird": false}}
+    # GET  /detections   detections of the newest frame
+    # GET  /events       server sent events with the detections of every processed frame
+    # GET  /stream.mjpg  annotated frames as motion jpeg, only drawn and encoded while requested
+    # GET  /metrics      stage timings, counters, detector statistics and accuracy
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/config":
+            self.send_json(service.config())
+        elif self.path == "/detections":
+            self.send_json(service.detections())
+        elif self.path == "/metrics":
+            detector = service.processor.detector
+            self.send_json({
+                "metrics": metrics.snapshot(),
+                "detector": {} if detector is None else {name: str(value) for name, value in detector.statistics().items()},
+                "accuracy": service.processor.accuracy.summary()
+            })
+        elif self.path == "/events":
+            self.send_events(service)
+        elif self.path == "/stream.mjpg":
+            self.send_stream(service)
+        else:
+            self.send_json({"error": f"unknown path {self.path}"}, 404)
+
+    def do_POST(self):
+        if self.path != "/config":
+            self.send_json({"error": f"unknown path {self.path}"}, 404)
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            changes = json.loads(self.rfile.read(length) or b"{}")
+            self.send_json(self.server.service.configure(changes))
+        except (ValueError, TypeError, KeyError) as error:
+            self.send_json({"error": str(error)}, 400)
+
+    def send_json(self, content, status=200):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_events(self, service):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        queue = service.subscribe()
+        try:
+            while service.pipeline.running.is_set():
+                event = queue.get(1)
+                # comments keep idle connections open and notice clients that left
+                message = ": idle\n\n" if event is None else f"event: detections\ndata: {event}\n\n"
+                self.wfile.write(message.encode())
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            service.unsubscribe(queue)
+            self.close_connection = True
+
+    def send_stream(self, service):
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        frames = service.frames()
+        try:
+            for jpeg in frames:
+                self.wfile.write(b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: " + str(len(jpeg)).encode() + b"\r\n\r\n")
+                self.wfile.write(jpeg)
+                self.wfile.write(b"\r\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            frames.close()
+            self.close_connection = True
+
+    # requests are not logged one by one, streams would flood the output
+    def log_message(self, format, *args):
+        pass
+
+
+# the components the gui offers, videos and the camera as providers, every yolo model plain, sliced and motion gated
+def load_components(args):
+    providers = []
+    evaluators = {}
+    if os.path.exists(args.videos):
+        for video in sorted(os.listdir(args.videos)):
+            provider = VideoImageProvider(os.path.join(args.videos, video), loop=True, decode_ahead=4, real_time=True)
+            providers.append(provider)
+            evaluators[provider] = AccuracyEvaluator(args.annotations, provider)
+    if 'picamera2' in sys.modules:
+        providers.append(PicameraImageProvider((640, 640)))
+
+    yolo_detectors = YoloObjectDetection.look_for_models()
+    detectors = [NoDetection()]
+    if args.cache is not None:
+        cache = DetectionCache(args.cache)
+        detectors.extend([CachedDetection(detector, cache) for detector in yolo_detectors])
+    else:
+        detectors.extend(yolo_detectors)
+    detectors.extend([SlicedDetection(detector) for detector in yolo_detectors])
+    detectors.extend([MotionGatedDetection(detector) for detector in yolo_detectors])
+
+    trackers = [NoTracking()]
+    for tracker in CV2Tracking.tracker_types:
+        trackers.append(CV2Tracking(tracker, (640, 640)))
+        trackers.append(CV2Tracking(tracker, (640, 640), parallel=True))
+    trackers.append(SortTracking())
+    trackers.append(FlowTracking((640, 640)))
+
+    return providers, evaluators, detectors, trackers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="run the detection pipeline without a window, controlled and watched over http")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on, 0.0.0.0 to serve the network")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--videos", default="videos")
+    parser.add_argument("--annotations", default="video annotations")
+    parser.add_argument("--cache", help="detection cache directory for the plain yolo detectors")
+    parser.add_argument("--provider", default="0", help="provider to start with, by index or name")
+    parser.add_argument("--detector", default="0", help="detector to start with, by index or name, 0 is none")
+    parser.add_argument("--tracker", default="0", help="tracker to start with, by index or name, 0 is none")
+    parser.add_argument("--detector-frequency", type=int, default=30)
+    parser.add_argument("--stream-size", type=int, nargs=2, help="width and height of the mjpeg stream, defaults to the source size")
+    parser.add_argument("--jpeg-quality", type=int, default=80)
+    parser.add_argument("--metrics", action="store_true", help="time the stages for /metrics")
+    args = parser.parse_args()
+
+    providers, evaluators, detectors, trackers = load_components(args)
+    if len(providers) == 0:
+        raise SystemExit(f"no videos in {args.videos} and no camera")
+
+    service = DetectionService(providers, evaluators, detectors, trackers, args.detector_frequency, args.jpeg_quality)
+    if args.stream_size is not None:
+        service.pipeline.display_resolution = tuple(args.stream_size)
+    metrics.enabled = args.metrics
+
+    selection = lambda value: int(value) if value.isdigit() else value
+    service.configure({
+        "provider": selection(args.provider), "detector": selection(args.detector), "tracker": selection(args.tracker)
+    })
+    service.start()
+
+    server = ThreadingHTTPServer((args.host, args.port), ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    print(f"serving on http://{args.host}:{server.server_port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+        service.providers[service.selected["provider"]].close()
@@ -0,0 +1,179 @@
+import argparse
+import http.client
+import json
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+from synthetic_image_provider import SyntheticImageProvider
+from object_detection import NoDetection
+from object_tracking import NoTracking, SortTracking
+from detection_service import DetectionService, ServiceRequestHandler
+from headless import find_detector
+
+
+class ServiceTest:
+
+    # runs the detection service on synthetic frames on a free local port and checks every endpoint like a client would
+    def __init__(self, args):
+        self.args = args
+        detectors = [NoDetection()]
+        if args.model is not None:
+            detectors.append(find_detector(args.model))
+        providers = [SyntheticImageProvider((640, 640), seed=args.seed)]
+        self.service = DetectionService(providers, {}, detectors, [NoTracking(), SortTracking()], detector_frequency=5)
+        self.service.configure({"provider": 0, "detector": len(detectors) - 1, "tracker": 0})
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ServiceRequestHandler)
+        self.server.daemon_threads = True
+        self.server.service = self.service
+        self.port = self.server.server_port
+        self.failures = []
+
+    def run(self):
+        self.service.start()
+        server_thread = threading.Thread(target=self.server.serve_forever, name="server", daemon=True)
+        server_thread.start()
+        try:
+            for check in [self.check_config, self.check_configure, self.check_detections, self.check_events, self.check_stream]:
+                try:
+                    check()
+                except Exception as error:
+                    self.fail(f"{check.__name__}: {type(error).__name__}: {error}")
+        finally:
+            self.server.shutdown()
+            self.server.server_close()
+            self.service.stop()
+            self.service.providers[0].close()
+        return self.failures
+
+    def fail(self, message):
+        self.failures.append(message)
+
+    def request(self, method, path, body=None):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.args.timeout)
+        try:
+            connection.request(method, path, body=None if body is None else json.dumps(body))
+            response = connection.getresponse()
+            return response.status, json.loads(response.read())
+        finally:
+            connection.close()
+
+    def check_config(self):
+        status, config = self.request("GET", "/config")
+        if status != 200:
+            self.fail(f"GET /config answered {status}")
+        for key in ["providers", "provider", "detectors", "detector", "trackers", "tracker", "schedulers", "classes"]:
+            if key not in config:
+                self.fail(f"GET /config has no {key}")
+        if config.get("provider") != 0 or config.get("tracker") != 0:
+            self.fail(f"GET /config shows provider {config.get('provider')} and tracker {config.get('tracker')}, expected 0 and 0")
+
+    def check_configure(self):
+        status, config = self.request("POST", "/config", {"tracker": "SORT", "detector_frequency": 3})
+        if status != 200 or config.get("tracker") != 1 or config.get("detector_frequency") != 3:
+            self.fail(f"POST /config answered {status} with tracker {config.get('tracker')}, frequency {config.get('detector_frequency')}")
+
+        # a rejected change leaves everything as it was, also the valid keys sent along with it
+        for changes in [
+            {"tracker": 0, "classes": {"no such class": True}},
+            {"tracker": 0, "input_size": [1, 1]},
+            {"tracker": 0, "detector": 99},
+            {"tracker": "no such tracker"}
+        ]:
+            status, answer = self.request("POST", "/config", changes)
+            if status != 400 or "error" not in answer:
+                self.fail(f"POST /config {changes} answered {status}, expected 400 with an error")
+        _, config = self.request("GET", "/config")
+        if config.get("tracker") != 1 or config.get("detector_frequency") != 3:
+            self.fail(f"rejected changes were applied, tracker {config.get('tracker')}, frequency {config.get('detector_frequency')}")
+
+        status, _ = self.request("POST", "/nowhere", {})
+        if status != 404:
+            self.fail(f"POST /nowhere answered {status}, expected 404")
+
+    def check_detections(self):
+        deadline = time.perf_counter() + self.args.timeout
+        latest = {}
+        while time.perf_counter() < deadline:
+            status, latest = self.request("GET", "/detections")
+            if status == 200 and latest.get("frame") is not None:
+                break
+            time.sleep(.1)
+        if latest.get("frame") is None or not isinstance(latest.get("detections"), list):
+            self.fail(f"GET /detections gave no processed frame within {self.args.timeout} s: {latest}")
+
+    def check_events(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.args.timeout)
+        try:
+            connection.request("GET", "/events")
+            response = connection.getresponse()
+            if response.getheader("Content-Type") != "text/event-stream":
+                self.fail(f"GET /events has content type {response.getheader('Content-Type')}")
+            frames = []
+            event = None
+            while len(frames) < 3:
+                line = response.fp.readline().decode().rstrip("\n")
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event == "detections":
+                    frames.append(json.loads(line[len("data: "):])["frame"])
+            if frames != sorted(frames) or len(set(frames)) != len(frames):
+                self.fail(f"GET /events frames out of order: {frames}")
+            response.close()
+        finally:
+            connection.close()
+
+    # two jpeg frames are read, then the client leaves and drawing has to stop
+    def check_stream(self):
+        if self.service.pipeline.rendering.is_set():
+            self.fail("frames are drawn before any stream client connected")
+
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=self.args.timeout)
+        try:
+            connection.request("GET", "/stream.mjpg")
+            response = connection.getresponse()
+            if not response.getheader("Content-Type", "").startswith("multipart/x-mixed-replace"):
+                self.fail(f"GET /stream.mjpg has content type {response.getheader('Content-Type')}")
+            for _ in range(2):
+                length = None
+                while True:
+                    line = response.fp.readline().strip()
+                    if line.lower().startswith(b"content-length:"):
+                        length = int(line.split(b":")[1])
+                    elif line == b"" and length is not None:
+                        break
+                jpeg = response.fp.read(length)
+                if not jpeg.startswith(b"\xff\xd8"):
+                    self.fail("GET /stream.mjpg part is not a jpeg")
+            if not self.service.pipeline.rendering.is_set():
+                self.fail("frames are not drawn while a stream client is connected")
+            # the response holds the socket open until it is closed itself
+            response.close()
+        finally:
+            connection.close()
+
+        # the server notices the client left on its next write
+        deadline = time.perf_counter() + self.args.timeout
+        while time.perf_counter() < deadline and (self.service.pipeline.rendering.is_set() or self.service.encoder is not None):
+            time.sleep(.05)
+        if self.service.pipeline.rendering.is_set():
+            self.fail("frames are still drawn after the stream client disconnected")
+        if self.service.encoder is not None:
+            self.fail("the encoder is still running after the stream client disconnected")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="start the detection service on synthetic frames and check its http api as a local client")
+    parser.add_argument("--model", help="model directory name in yolo/, only the empty detector if missing")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic frames")
+    parser.add_argument("--timeout", type=float, default=10, help="seconds to wait for any answer")
+    args = parser.parse_args()
+
+    failures = ServiceTest(args).run()
+    for failure in failures:
+        print(f"FAIL {failure}", file=sys.stderr)
+    if len(failures) > 0:
+        sys.exit(1)
+    print("config, detections, events and stream answered as expected, drawing stopped with the last stream client")
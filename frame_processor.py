@@ -0,0 +1,226 @@
+import threading
+import time
+import cv2
+import numpy as np
+
+from detection_scheduling import FixedFrequencyScheduler
+from instrumentation import metrics
+from accuracy_metrics import StreamingMetrics
+
+
+# left, top, right and bottom of center x, center y, width, height boxes as integer pixels, scaled by (x, y)
+def box_corners(boxes, scale=(1, 1)):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4) * np.float32(scale * 2)
+    half_sizes = np.trunc(boxes[:, 2:4] / 2)
+    return np.int32(np.concatenate((boxes[:, 0:2] - half_sizes, boxes[:, 0:2] + half_sizes), axis=1))
+
+
+# rectangles of the same color go to opencv in one call
+def draw_boxes(image, corners, colors, thickness=1):
+    colors = np.asarray(colors, dtype=np.int32).reshape(-1, 3)
+    outlines = corners[:, [0, 1, 2, 1, 2, 3, 0, 3]].reshape(-1, 4, 2)
+    unique_colors, color_index = np.unique(colors, axis=0, return_inverse=True)
+    for i, color in enumerate(unique_colors.tolist()):
+        cv2.polylines(image, list(outlines[color_index.reshape(-1) == i]), True, color, thickness)
+
+
+def draw_labels(image, points, texts, colors):
+    for point, text, color in zip(np.asarray(points, dtype=np.int32).tolist(), texts, colors):
+        cv2.putText(image, f"{text}", point, cv2.FONT_HERSHEY_SIMPLEX, .5, tuple(int(c) for c in color), 1, cv2.LINE_AA)
+
+
+# detections with the ids of their tracks, or ids unique to this detection round if the tracker gave none
+def identify(detections, detection_round):
+    if (detections.track_ids >= 0).all():
+        return detections
+    detections = detections.copy()
+    detections.track_ids[:] = detection_round * 100000 + np.arange(len(detections))
+    return detections
+
+
+class FrameProcessor:
+
+    threshold = .2
+    nms_threshold = .5
+
+    def __init__(self, scheduler=None):
+        self.provider = None
+        self.evaluator = None
+        self.detector = None
+        self.tracker = None
+        # decides on which frames the detector runs, the others are tracked
+        self.scheduler = scheduler or FixedFrequencyScheduler()
+        self.frame_counter = 0
+        self.detections = None
+
+        # what the last processed frame went through, "detect", "track" or None
+        self.last_step = None
+
+        # accuracy against the annotations since the last change of provider, detector or tracker
+        self.accuracy = StreamingMetrics()
+        # detections get new track ids each round if the tracker does not give them persistent ones
+        self.detection_round = 0
+
+        # tint moving pixels of detectors that measure motion
+        self.show_motion = False
+
+        # changes the input size of the detector to keep detections within a latency, None for a fixed size
+        self.resolution_controller = None
+
+        # selection changes come from the gui while frames are processed elsewhere
+        self.lock = threading.Lock()
+        # held while an image is taken from the provider, a provider is only replaced between two captures
+        self.capture_lock = threading.Lock()
+
+    # select the image provider and its accuracy evaluator, both can be None
+    # once this returns no capture uses the previous provider any more, it can be closed
+    def set_provider(self, provider, evaluator=None):
+        with self.capture_lock, self.lock:
+            # a provider closed when it was deselected opens again when it is selected
+            if provider is not None and hasattr(provider, "open"):
+                provider.open()
+            self.provider = provider
+            self.evaluator = evaluator
+            self.accuracy.reset()
+
+    # select the object detector, previous detections and tracked objects are dropped
+    def set_detector(self, detector):
+        with self.lock:
+            self.detector = detector
+            self.detections = None
+            self.accuracy.reset()
+            self.scheduler.reset()
+            if self.tracker is not None:
+                self.tracker.reset()
+            if self.resolution_controller is not None:
+                self.resolution_controller.reset()
+
+    # select the object tracker
+    def set_tracker(self, tracker):
+        with self.lock:
+            self.tracker = tracker
+            self.accuracy.reset()
+
+    # select the controller of the detector input size, None to keep the size the detector has
+    def set_resolution_controller(self, controller):
+        with self.lock:
+            self.resolution_controller = controller
+            if controller is not None:
+                controller.reset()
+
+    # select the detection scheduler, it starts with a detection on the next frame
+    def set_scheduler(self, scheduler):
+        with self.lock:
+            self.scheduler = scheduler
+            self.scheduler.reset()
+
+    # acquire a new image, the ground truth for it and where it comes from, None if no provider is selected or it ended
+    # where it comes from is the video path and frame index for videos, None for other providers
+    # out is passed on to the provider, to take the image into memory of the caller
+    def capture(self, out=None):
+        with self.capture_lock:
+            provider = self.provider
+            evaluator = self.evaluator
+            if provider is None:
+                return None, None, None
+
+            frame = provider.next_frame(out)
+            if frame is None:
+                return None, None, None
+            image = frame.image
+            source = None if frame.source is None else (frame.source, frame.index)
+
+            truth = None
+            if evaluator is not None:
+                truth = evaluator.evaluate((image.shape[1], image.shape[0]), frame.index)
+
+        return image, truth, source
+
+    # apply detection / tracking to an image, boxes are in the coordinates of the image
+    # source is where capture says the image comes from, detectors may use it to look up earlier results
+    def process(self, image, source=None):
+        with self.lock:
+            # the only copy of the frame, shared by the detector, the tracker and the display
+            # detectors scale it to their input size themselves
+            with metrics.span("convert"):
+                image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+            # if a detector is selected and the scheduler asks for it, run detection, otherwise track
+            self.last_step = None
+            if self.detector is not None:
+                start_time = time.perf_counter()
+                if self.scheduler.should_detect():
+                    self.last_step = "detect"
+                    # run the selected detector, telling it where the objects were last seen
+                    if self.detections is not None:
+                        self.detector.focus(self.detections.valid_only().boxes)
+                    if source is not None:
+                        self.detector.source_frame(*source)
+                    else:
+                        self.detector.source_frame(None, None)
+                    detect_start = time.perf_counter()
+                    with metrics.span("detect"):
+                        detections = self.detector.detect(image, self.threshold, self.nms_threshold)
+                    metrics.count("detector calls")
+                    if self.resolution_controller is not None:
+                        self.resolution_controller.update(self.detector, time.perf_counter() - detect_start)
+                    width, height = self.detector.image_resolution()
+                    metrics.gauge("input width", width)
+                    metrics.gauge("input height", height)
+                    if self.tracker is not None:
+                        with metrics.span("tracker init"):
+                            detections = self.tracker.init(image, detections)
+                    self.detection_round += 1
+                    self.detections = identify(detections, self.detection_round)
+                elif self.tracker is not None:
+                    if self.detections is not None:
+                        self.last_step = "track"
+                        with metrics.span("track"):
+                            self.detections = self.tracker.track(image)
+                        metrics.count("tracker calls")
+
+                self.scheduler.update(self.last_step, image, self.detections, time.perf_counter() - start_time)
+
+            self.frame_counter += 1
+
+            # detections are replaced, not changed, by the next frames and can be handed out as they are
+            detections = self.detections
+
+        return image, detections
+
+    # count the detections of a processed frame against its annotation, frames without annotation are skipped
+    def score(self, truth, detections):
+        if truth is None:
+            return
+        with self.lock:
+            self.accuracy.update(truth, detections)
+
+    # draw true and detected boxes onto a processed image
+    # scale maps the boxes to the image if it was resized for display after processing
+    def draw(self, image, detections, truth, scale=(1, 1)):
+        # draw the motion mask of the detector if there is one
+        motion_mask = getattr(self.detector, "motion_mask", None)
+        if self.show_motion and motion_mask is not None:
+            motion_mask = cv2.resize(motion_mask, (image.shape[1], image.shape[0]), interpolation=cv2.INTER_NEAREST) > 0
+            image[motion_mask] = image[motion_mask] // 2 + np.uint8([127, 0, 0])
+
+        # draw true boxes if available, names below them
+        if truth is not None and len(truth) > 0:
+            corners = box_corners(truth.boxes, scale)
+            draw_boxes(image, corners, np.zeros((len(corners), 3), dtype=np.uint8))
+            draw_labels(image, corners[:, [0, 3]] + [0, 10], truth.class_names(), [(0, 0, 0)] * len(corners))
+
+        # draw bounding boxes, names and confidences above them
+        if detections is not None:
+            detections = detections.valid_only()
+            if len(detections) > 0:
+                corners = box_corners(detections.boxes, scale)
+                colors = detections.class_colors()
+                draw_boxes(image, corners, colors)
+                draw_labels(
+                    image, corners[:, 0:2] - [0, 5],
+                    [f"{name} {confidence:.02}" for name, confidence in zip(detections.class_names(), detections.confidences.tolist())],
+                    colors.tolist()
+                )
+
+        return image
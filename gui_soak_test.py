@@ -0,0 +1,158 @@
+import argparse
+import csv
+import os
+import sys
+import time
+import numpy as np
+import tkinter as tk
+
+from video_image_provider import VideoImageProvider
+from object_tracking import create_tracker, tracker_names
+from accuracy_evaluation import AccuracyEvaluator
+from frame_processor import FrameProcessor
+from detection_scheduling import FixedFrequencyScheduler
+from pipeline import Pipeline
+from image_display import ImageDisplay
+from instrumentation import metrics
+from headless import find_detector
+
+
+# resident memory of this process in mb, None where /proc is missing
+def resident_memory():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        return None
+
+
+class SoakTest:
+
+    fields = ["minutes", "memory_mb", "canvas_items", "frames", "fps", "show_p50_ms", "show_p95_ms"]
+
+    # shows a looping video through the gui render path for hours, sampling memory and frame times
+    def __init__(self, window, args):
+        self.window = window
+        self.args = args
+        self.duration = args.hours * 3600
+
+        self.processor = FrameProcessor(FixedFrequencyScheduler(args.detector_frequency))
+        self.pipeline = Pipeline(self.processor)
+        self.pipeline.display_resolution = tuple(args.resolution)
+
+        self.canvas = tk.Canvas(window, width=args.resolution[0], height=args.resolution[1])
+        self.canvas.pack()
+        self.display = ImageDisplay(self.canvas, args.resolution)
+        # redrawn on every sample like the hud of the app
+        self.text = self.canvas.create_text(8, 8, anchor=tk.NW, fill="yellow", font=("Courier", 11))
+
+        provider = VideoImageProvider(args.video, loop=True, decode_ahead=4, real_time=True)
+        self.processor.set_provider(provider, AccuracyEvaluator(args.annotations, provider))
+        self.processor.set_tracker(create_tracker(args.tracker, (640, 640)))
+        if args.model is not None:
+            self.processor.set_detector(find_detector(args.model))
+        metrics.enabled = True
+
+        self.samples = []
+        self.show_times = []
+        self.frames = 0
+        self.writer = None
+        if args.output is not None:
+            self.output = open(args.output, "w", newline='')
+            self.writer = csv.writer(self.output)
+            self.writer.writerow(self.fields)
+
+    def start(self):
+        self.start_time = time.perf_counter()
+        self.last_sample = self.start_time
+        self.pipeline.start()
+        self.tick()
+
+    def tick(self):
+        image = self.pipeline.latest()
+        if image is not None:
+            start = time.perf_counter()
+            self.display.show(image)
+            self.show_times.append(time.perf_counter() - start)
+            self.frames += 1
+
+        now = time.perf_counter()
+        if now - self.last_sample >= self.args.sample_interval:
+            self.sample(now)
+        if now - self.start_time >= self.duration:
+            self.finish()
+            return
+        self.window.after(self.args.interval, self.tick)
+
+    def sample(self, now):
+        ms = np.array(self.show_times) * 1000 if self.show_times else np.zeros(1)
+        sample = [
+            (now - self.start_time) / 60, resident_memory(), self.display.items(), self.frames,
+            len(self.show_times) / (now - self.last_sample), float(np.percentile(ms, 50)), float(np.percentile(ms, 95))
+        ]
+        self.samples.append(sample)
+        self.show_times = []
+        self.last_sample = now
+
+        print(" ".join(f"{name} {value:.2f}" if isinstance(value, float) else f"{name} {value}" for name, value in zip(self.fields, sample)), flush=True)
+        self.canvas.itemconfigure(self.text, text=f"{sample[0]:.0f} min, {sample[1] or 0:.0f} mb, {sample[4]:.1f} fps")
+        if self.writer is not None:
+            self.writer.writerow(sample)
+            self.output.flush()
+
+    # compare the end of the run to its start, after the first sample as warm up
+    def finish(self):
+        self.pipeline.stop()
+        self.processor.provider.close()
+        self.window.destroy()
+        if self.writer is not None:
+            self.output.close()
+
+        samples = self.samples[1:]
+        if len(samples) < 2:
+            raise SystemExit("too few samples, run longer or sample more often")
+        minutes, memory, items, _, fps, _, show_p95 = (np.array(column, dtype=np.float64) for column in zip(*samples))
+
+        failures = []
+        if len(set(items)) > 1:
+            failures.append(f"canvas items went from {items[0]:.0f} to {items[-1]:.0f}")
+        if not np.isnan(memory[0]):
+            growth = memory[-1] - memory[0]
+            slope = np.polyfit(minutes / 60, memory, 1)[0]
+            print(f"memory: {memory[0]:.1f} -> {memory[-1]:.1f} mb, {slope:+.2f} mb per hour")
+            if growth > self.args.max_growth:
+                failures.append(f"memory grew by {growth:.1f} mb")
+        print(f"show p95: {show_p95[0]:.2f} -> {show_p95[-1]:.2f} ms, fps: {fps[0]:.1f} -> {fps[-1]:.1f}")
+        if show_p95[-1] > show_p95[0] * (1 + self.args.max_slowdown) + .5:
+            failures.append(f"showing a frame slowed from {show_p95[0]:.2f} to {show_p95[-1]:.2f} ms")
+
+        for failure in failures:
+            print(f"FAIL {failure}", file=sys.stderr)
+        if len(failures) > 0:
+            sys.exit(1)
+        print("memory and frame time stayed flat")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="loop a video through the gui render path for hours and check memory and frame time stay flat")
+    parser.add_argument("--video", default=os.path.join("videos", sorted(os.listdir("videos"))[0]) if os.path.isdir("videos") else None)
+    parser.add_argument("--annotations", default="video annotations")
+    parser.add_argument("--model", help="model directory name in yolo/, no detection if missing")
+    parser.add_argument("--tracker", default="none", choices=tracker_names)
+    parser.add_argument("--detector-frequency", type=int, default=30)
+    parser.add_argument("--hours", type=float, default=2)
+    parser.add_argument("--sample-interval", type=float, default=60, help="seconds between samples")
+    parser.add_argument("--resolution", type=int, nargs=2, default=[600, 600], help="display width and height")
+    parser.add_argument("--interval", type=int, default=10, help="milliseconds between display updates, as in the app")
+    parser.add_argument("--max-growth", type=float, default=50, help="allowed memory growth in mb after the first sample")
+    parser.add_argument("--max-slowdown", type=float, default=.5, help="allowed increase of the p95 time to show a frame, as a fraction")
+    parser.add_argument("--output", help="csv file for the samples")
+    args = parser.parse_args()
+    if args.video is None:
+        raise SystemExit("no video given and no videos/ folder")
+
+    root = tk.Tk()
+    root.title("soak test")
+    test = SoakTest(root, args)
+    test.start()
+    root.mainloop()
@@ -0,0 +1,313 @@
+import argparse
+import csv
+import json
+import logging
+import sys
+import time
+import numpy as np
+from functools import partial
+
+from video_image_provider import VideoImageProvider
+from synthetic_image_provider import SyntheticImageProvider
+try:
+    from picamera_image_provider import PicameraImageProvider
+except:
+    pass
+from yolo_object_detection import YoloObjectDetection
+from sliced_detection import SlicedDetection
+from motion_gating import MotionGatedDetection
+from object_tracking import create_tracker, tracker_names
+from frame_processor import FrameProcessor
+from accuracy_evaluation import AccuracyEvaluator
+from detection_scheduling import create_scheduler, scheduler_names
+from instrumentation import metrics, MetricsExporter
+from detection_cache import DetectionCache, CachedDetection
+from process_pipeline import ProcessPipeline
+from resolution_control import ResolutionController
+
+
+class DetectionWriter:
+
+    csv_fields = ["frame", "time", "step", "class", "confidence", "x", "y", "width", "height"]
+
+    # writes detections as json lines or csv rows, chosen by the file extension
+    def __init__(self, path):
+        self.file = open(path, "w", newline='')
+        self.csv = None
+        if path.endswith(".csv"):
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(self.csv_fields)
+
+    def write(self, frame, timestamp, step, detections):
+        if detections is None:
+            return
+
+        detections = detections.valid_only()
+        for name, confidence, box in zip(detections.class_names(), detections.confidences.tolist(), np.int64(detections.boxes).tolist()):
+            row = [frame, round(timestamp, 4), step, str(name), confidence] + box
+            if self.csv is not None:
+                self.csv.writerow(row)
+            else:
+                self.file.write(json.dumps(dict(zip(self.csv_fields, row))) + "\n")
+
+    def close(self):
+        self.file.close()
+
+
+class StageTimes:
+
+    # per stage latency samples in seconds
+    def __init__(self):
+        self.samples = {}
+
+    def add(self, stage, seconds):
+        self.samples.setdefault(stage, []).append(seconds)
+
+    def report(self):
+        lines = []
+        for stage, samples in self.samples.items():
+            ms = np.array(samples) * 1000
+            lines.append(
+                f"{stage:>12}: {len(ms):6} calls, mean {ms.mean():7.2f} ms, "
+                f"p50 {np.percentile(ms, 50):7.2f} ms, p95 {np.percentile(ms, 95):7.2f} ms"
+            )
+        return "\n".join(lines)
+
+
+def find_detector(model_name):
+    detectors = YoloObjectDetection.look_for_models()
+    for detector in detectors:
+        if model_name is None or detector.name == 'YOLO: ' + model_name:
+            return detector
+    raise SystemExit(f"no yolo model {model_name} in yolo/, found: {[d.name for d in detectors]}")
+
+
+# factory of the image provider asked for on the command line, videos loop if more frames than one pass are asked for
+def image_provider_factory(args, decode_ahead):
+    if args.camera:
+        if 'picamera2' not in sys.modules:
+            raise SystemExit("picamera2 is not installed")
+        return partial(PicameraImageProvider, (640, 640))
+    if args.synthetic:
+        return partial(SyntheticImageProvider, (640, 640), seed=args.seed)
+    return partial(VideoImageProvider, args.video, loop=True, decode_ahead=decode_ahead, real_time=args.real_time)
+
+
+# the detector with the wrappers asked for on the command line
+def build_detector(args):
+    detector = find_detector(args.model)
+    if args.input_size is not None:
+        # models with open height and width only offer their sizes once loaded
+        detector.load()
+        size = tuple(args.input_size)
+        if size not in detector.input_sizes():
+            raise SystemExit(f"input size {size[0]}x{size[1]} not supported by {detector.name}, one of {[f'{w}x{h}' for w, h in detector.input_sizes()]}")
+        detector.set_input_size(size)
+    # the cache holds what the model found on whole frames, the wrappers keep state between frames and go around it
+    if args.cache is not None:
+        detector = CachedDetection(detector, DetectionCache(args.cache))
+    if args.sliced:
+        detector = SlicedDetection(detector, max_tiles=args.max_tiles)
+    if args.motion is not None:
+        detector = MotionGatedDetection(detector, method=args.motion)
+    return detector
+
+
+# capture, detection and tracking in processes of their own, the components are made in the process using them
+def run_processes(args):
+    # the capture process already works ahead of the others, it decodes in line into one reused array
+    provider_factory = image_provider_factory(args, 0)
+    evaluator_factory = None
+    if args.annotations is not None and args.video is not None:
+        evaluator_factory = partial(AccuracyEvaluator, args.annotations)
+
+    pipeline = ProcessPipeline(
+        provider_factory,
+        detector_factory=partial(build_detector, args),
+        tracker_factory=partial(create_tracker, args.tracker, (640, 640)),
+        scheduler_factory=partial(create_scheduler, args.scheduler, args.detector_frequency),
+        evaluator_factory=evaluator_factory,
+        controller_factory=None if args.target_latency is None else partial(ResolutionController, args.target_latency / 1000),
+        slots=args.slots,
+        # the camera delivers the size it is configured for, it must not be opened to find out
+        resolution=(640, 640) if args.camera else None,
+        paced=False
+    )
+    # nothing is displayed, frames are only tracked and their slots freed
+    pipeline.rendering.clear()
+
+    writer = None
+    if args.output is not None:
+        writer = DetectionWriter(args.output)
+
+    frames = args.frames
+    if frames is None and args.video is not None:
+        provider = provider_factory()
+        frames = provider.frame_count
+        provider.close()
+
+    exporter = MetricsExporter(metrics, args.metrics_jsonl, args.metrics_prometheus, args.metrics_interval)
+    metrics.enabled = exporter.enabled()
+
+    stage_times = StageTimes()
+    pipeline.start()
+    start_time = time.perf_counter()
+    last_report = start_time
+    frame = 0
+    try:
+        while (frames is None or frame < frames) and not pipeline.ended:
+            item = pipeline.receive(timeout=pipeline.stop_timeout)
+            if item is None:
+                continue
+
+            for stage, seconds in item["times"].items():
+                stage_times.add(stage, seconds)
+            if writer is not None:
+                writer.write(item["frame"], item["capture time"] - start_time, item["step"], item["detections"])
+            frame += 1
+            exporter.update()
+
+            now = time.perf_counter()
+            if now - last_report >= args.report_interval:
+                print(f"frame {frame}: {frame / (now - start_time):.1f} frames/s", flush=True)
+                last_report = now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pipeline.stop()
+        if writer is not None:
+            writer.close()
+        exporter.update(force=True)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"{frame} frames in {elapsed:.2f} s, {frame / elapsed:.1f} frames/s")
+    print(stage_times.report())
+    for name, value in pipeline.statistics.items():
+        print(f"{name}: {value}")
+    if pipeline.accuracy.frames > 0:
+        for name, value in pipeline.accuracy.summary().items():
+            print(f"{name}: {value if value is None or isinstance(value, int) else round(value, 4)}")
+
+
+def run(args):
+    provider = image_provider_factory(args, args.decode_ahead)()
+
+    tracker = create_tracker(args.tracker, (640, 640))
+
+    processor = FrameProcessor(create_scheduler(args.scheduler, args.detector_frequency))
+    evaluator = None
+    if args.annotations is not None and args.video is not None:
+        evaluator = AccuracyEvaluator(args.annotations, provider)
+    processor.set_provider(provider, evaluator)
+    processor.set_tracker(tracker)
+    processor.set_detector(build_detector(args))
+    if args.target_latency is not None:
+        processor.set_resolution_controller(ResolutionController(args.target_latency / 1000))
+
+    writer = None
+    if args.output is not None:
+        writer = DetectionWriter(args.output)
+
+    frames = args.frames
+    if frames is None and args.video is not None:
+        frames = provider.frame_count
+
+    # images the provider decodes in line go into one reused array, images decoded ahead are taken from its ring
+    buffer = None
+    reuse_buffer = not isinstance(provider, VideoImageProvider) or provider.decode_ahead == 0
+
+    # stages are only timed in detail when the metrics are exported
+    exporter = MetricsExporter(metrics, args.metrics_jsonl, args.metrics_prometheus, args.metrics_interval)
+    metrics.enabled = exporter.enabled()
+
+    stage_times = StageTimes()
+    start_time = time.perf_counter()
+    last_report = start_time
+    frame = 0
+    try:
+        while frames is None or frame < frames:
+            frame_start = time.perf_counter()
+            image, truth, source = processor.capture(buffer)
+            if image is None:
+                break
+            if buffer is None and reuse_buffer:
+                buffer = np.empty_like(image)
+            capture_end = time.perf_counter()
+            image, detections = processor.process(image, source)
+            process_end = time.perf_counter()
+            processor.score(truth, detections)
+
+            stage_times.add("capture", capture_end - frame_start)
+            stage_times.add(processor.last_step or "none", process_end - capture_end)
+
+            if writer is not None:
+                writer.write(frame, frame_start - start_time, processor.last_step, detections)
+            frame += 1
+
+            metrics.record("capture", capture_end - frame_start)
+            if isinstance(provider, VideoImageProvider):
+                metrics.gauge("provider dropped frames", provider.dropped_frames)
+            exporter.update()
+
+            if process_end - last_report >= args.report_interval:
+                print(f"frame {frame}: {frame / (process_end - start_time):.1f} frames/s", flush=True)
+                last_report = process_end
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if writer is not None:
+            writer.close()
+        exporter.update(force=True)
+
+    provider.close()
+
+    elapsed = time.perf_counter() - start_time
+    if isinstance(provider, VideoImageProvider) and provider.dropped_frames > 0:
+        print(f"{provider.dropped_frames} video frames dropped to keep real time")
+    print(f"{frame} frames in {elapsed:.2f} s, {frame / elapsed:.1f} frames/s")
+    print(stage_times.report())
+    for name, value in processor.detector.statistics().items():
+        print(f"{name}: {value}")
+    if processor.accuracy.frames > 0:
+        for name, value in processor.accuracy.summary().items():
+            print(f"{name}: {value if value is None or isinstance(value, int) else round(value, 4)}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="run image provider, detector and tracker without a display")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--video", help="video file to process")
+    source.add_argument("--camera", action="store_true", help="use the raspberry pi camera")
+    source.add_argument("--synthetic", action="store_true", help="procedural frames of moving boxes, the same on every run")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic frames")
+    parser.add_argument("--model", help="model directory name in yolo/, defaults to the first one found")
+    parser.add_argument("--sliced", action="store_true", help="detect on overlapping tiles of the full resolution image")
+    parser.add_argument("--max-tiles", type=int, help="most tiles per sliced detection, tiles around tracked objects first")
+    parser.add_argument("--motion", choices=MotionGatedDetection.methods, help="skip static frames and detect only around motion")
+    parser.add_argument("--input-size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), help="detector input size, one the model supports")
+    parser.add_argument("--target-latency", type=float, help="milliseconds per detection to keep to by changing the detector input size")
+    parser.add_argument("--tracker", default="none", choices=tracker_names)
+    parser.add_argument("--detector-frequency", type=int, default=30, help="frames per detector run, at most for the adaptive scheduler")
+    parser.add_argument("--scheduler", default="fixed", choices=scheduler_names, help="when to run the detector")
+    parser.add_argument("--log-decisions", action="store_true", help="log why the detector runs and changes its input size")
+    parser.add_argument("--frames", type=int, help="number of frames to process, defaults to one pass of the video, no limit for other sources")
+    parser.add_argument("--real-time", action="store_true", help="play the video at its frame rate, dropping frames the pipeline is too slow for")
+    parser.add_argument("--decode-ahead", type=int, default=4, help="video frames decoded ahead in a background thread, 0 to decode in line")
+    parser.add_argument("--output", help="file to stream detections to, .jsonl or .csv")
+    parser.add_argument("--cache", help="detection cache directory, frames detected on before are read from it")
+    parser.add_argument("--annotations", help="folder of video annotations to score the detections against")
+    parser.add_argument("--processes", action="store_true", help="run capture, detection and tracking in separate processes")
+    parser.add_argument("--slots", type=int, default=4, help="shared memory frames in flight between the processes")
+    parser.add_argument("--report-interval", type=float, default=5, help="seconds between throughput reports")
+    parser.add_argument("--metrics-jsonl", help="file to append stage timings and counters to as json lines")
+    parser.add_argument("--metrics-prometheus", help="file to keep the metrics in, in the prometheus text format")
+    parser.add_argument("--metrics-interval", type=float, default=10, help="seconds between metrics exports")
+
+    args = parser.parse_args()
+    if args.log_decisions:
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.processes:
+        run_processes(args)
+    else:
+        run(args)
@@ -0,0 +1,28 @@
+import tkinter as tk
+from PIL import Image, ImageTk
+
+
+class ImageDisplay:
+
+    # shows frames on a canvas through one photo image and one canvas item, both made once and updated in place
+    # a new photo image per frame leaves its canvas item behind, so items, memory and redraw time grow with every frame
+    def __init__(self, canvas, resolution):
+        self.canvas = canvas
+        self.resolution = tuple(resolution)
+        self.photo = ImageTk.PhotoImage(Image.new("RGB", self.resolution))
+        self.item = self.canvas.create_image(0, 0, anchor=tk.NW, image=self.photo)
+        # items made later, like the hud, stay above the image without being raised every frame
+        self.canvas.tag_lower(self.item)
+
+    # copy an rgb image into the photo image, it only is replaced if the size changed
+    def show(self, image):
+        resolution = (image.shape[1], image.shape[0])
+        if resolution != self.resolution:
+            self.resolution = resolution
+            self.photo = ImageTk.PhotoImage(Image.new("RGB", self.resolution))
+            self.canvas.itemconfigure(self.item, image=self.photo)
+        self.photo.paste(Image.fromarray(image))
+
+    # canvas items, stays constant while frames are shown
+    def items(self):
+        return len(self.canvas.find_all())
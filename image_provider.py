@@ -1,14 +1,47 @@
 from abc import ABC , abstractmethod
 
 
+class Frame:
+
+    # an image with where and when it was taken
+    # sequence counts the frames handed out since the provider was opened, index is the position in the source,
+    # the frame of a video or None for a camera, timestamp the capture time in seconds on the clock of the source,
+    # resolution the width and height the source delivers and source the video path, None for a camera
+    def __init__(self, image, sequence, timestamp, resolution, index=None, source=None):
+        self.image = image
+        self.sequence = sequence
+        self.timestamp = timestamp
+        self.resolution = resolution
+        self.index = index
+        self.source = source
+
+
 class ImageProvider(ABC):
 
     name=""
 
+    # set once the source has no images left, next_frame returns None from then on until it is reset or closed
+    ended = False
+
+    # next Frame, None at the end of the stream
+    # out is an optional array of the source resolution owned by the caller, the image is written into it instead of
+    # a new array, without it the image may be memory of the provider, valid until a few more frames are taken
     @abstractmethod
-    def next(self):
+    def next_frame(self, out=None):
         pass
 
+    # next image without the frame information, None at the end of the stream
+    def next(self, out=None):
+        frame = self.next_frame(out)
+        if frame is None:
+            return None
+        return frame.image
+
     @abstractmethod
     def dt(self):
         pass
+
+    # release resources held while images are taken, providers that hold some give no images until opened again,
+    # which selecting them in a FrameProcessor does
+    def close(self):
+        pass
@@ -0,0 +1,124 @@
+import cv2
+import numpy as np
+from abc import ABC, abstractmethod
+
+try:
+    import onnxruntime
+    from onnxruntime.capi.onnxruntime_pybind11_state import Fail, InvalidArgument
+except:
+    onnxruntime = None
+
+
+class InferenceBackend(ABC):
+
+    name = ""
+    # exceptions forward raises for inputs the model does not accept, like a batch larger than the model allows
+    errors = ()
+
+    @staticmethod
+    def available():
+        return True
+
+    # run the model on a float32 blob of shape (batch, 3, height, width), returns its first output
+    @abstractmethod
+    def forward(self, blob):
+        pass
+
+    # settings as shown in benchmarks and logs
+    def description(self):
+        return self.name
+
+    # shape of the model input as exported, dimensions left open are names or None, None if the backend cannot tell
+    def input_shape(self):
+        return None
+
+
+class OpenCVBackend(InferenceBackend):
+
+    name = "opencv"
+    errors = (cv2.error,)
+
+    dnn_backends = {
+        "default": cv2.dnn.DNN_BACKEND_DEFAULT,
+        "opencv": cv2.dnn.DNN_BACKEND_OPENCV,
+        "openvino": cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE,
+        "cuda": cv2.dnn.DNN_BACKEND_CUDA
+    }
+    dnn_targets = {
+        "cpu": cv2.dnn.DNN_TARGET_CPU,
+        "cpu_fp16": cv2.dnn.DNN_TARGET_CPU_FP16,
+        "opencl": cv2.dnn.DNN_TARGET_OPENCL,
+        "opencl_fp16": cv2.dnn.DNN_TARGET_OPENCL_FP16,
+        "cuda": cv2.dnn.DNN_TARGET_CUDA,
+        "cuda_fp16": cv2.dnn.DNN_TARGET_CUDA_FP16
+    }
+
+    # threads is process wide in opencv, the last backend created sets it for all of them
+    def __init__(self, model_path, dnn_backend="default", dnn_target="cpu", threads=None):
+        self.dnn_backend = dnn_backend
+        self.dnn_target = dnn_target
+        self.threads = threads
+
+        self.net = cv2.dnn.readNetFromONNX(model_path)
+        # left alone by default, some opencv versions warn about any target set
+        if dnn_backend != "default":
+            self.net.setPreferableBackend(self.dnn_backends[dnn_backend])
+        if dnn_target != "cpu":
+            self.net.setPreferableTarget(self.dnn_targets[dnn_target])
+        if threads is not None:
+            cv2.setNumThreads(threads)
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward()
+
+    def description(self):
+        threads = self.threads if self.threads is not None else cv2.getNumThreads()
+        return f"{self.name} {self.dnn_backend}/{self.dnn_target} {threads} threads"
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+
+    name = "onnxruntime"
+
+    def __init__(self, model_path, threads=None):
+        self.threads = threads
+        self.errors = (Fail, InvalidArgument)
+
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    @staticmethod
+    def available():
+        return onnxruntime is not None
+
+    def forward(self, blob):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(blob, dtype=np.float32)})[0]
+
+    def description(self):
+        threads = self.threads if self.threads is not None else "default"
+        return f"{self.name} cpu {threads} threads"
+
+    def input_shape(self):
+        return self.session.get_inputs()[0].shape
+
+
+# backends in order of preference, the ones whose packages are missing are left out
+backends = {backend.name: backend for backend in [OnnxRuntimeBackend, OpenCVBackend] if backend.available()}
+backend_names = list(backends)
+
+
+# backend for a model, the preferred available one if name is None or not available
+def create_backend(model_path, name=None, threads=None, dnn_backend="default", dnn_target="cpu"):
+    if name is not None and name not in backends:
+        print(f"inference backend {name} is not available, using {backend_names[0]}")
+        name = None
+    if name is None:
+        name = backend_names[0]
+
+    if name == OpenCVBackend.name:
+        return OpenCVBackend(model_path, dnn_backend, dnn_target, threads)
+    return backends[name](model_path, threads)
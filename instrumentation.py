@@ -0,0 +1,179 @@
+import json
+import os
+import threading
+import time
+import numpy as np
+from collections import deque
+
+
+class Span:
+
+    # times the block it is entered for and records it under its name
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.metrics.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NoSpan:
+
+    # stands in for a span while instrumentation is off, one instance is shared
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+class Metrics:
+
+    # latest samples of each span the percentiles are taken over
+    window = 300
+
+    __no_span = NoSpan()
+
+    def __init__(self, enabled=False):
+        # with instrumentation off spans, counters and gauges return right away
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.totals = {}
+            self.counters = {}
+            self.gauges = {}
+
+    # context manager timing a stage, as in: with metrics.span("detect"):
+    def span(self, name):
+        if not self.enabled:
+            return self.__no_span
+        return Span(self, name)
+
+    # add the duration of a stage in seconds
+    def record(self, name, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+                self.totals[name] = [0, 0.0]
+            samples.append(seconds)
+            self.totals[name][0] += 1
+            self.totals[name][1] += seconds
+
+    # increase a counter, like the calls of the detector
+    def count(self, name, amount=1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    # set a value that goes up and down, or is counted elsewhere, like dropped frames
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.gauges[name] = value
+
+    # rolling statistics of every span in milliseconds, with the counters and gauges
+    def snapshot(self):
+        with self.lock:
+            samples = {name: np.array(values) * 1000 for name, values in self.samples.items()}
+            totals = {name: list(total) for name, total in self.totals.items()}
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+
+        spans = {}
+        for name, ms in samples.items():
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            spans[name] = {
+                "count": totals[name][0],
+                "sum_seconds": totals[name][1],
+                "mean_ms": float(ms.mean()),
+                "p50_ms": float(p50),
+                "p95_ms": float(p95),
+                "p99_ms": float(p99)
+            }
+        return {"time": time.time(), "spans": spans, "counters": counters, "gauges": gauges}
+
+    # append the current snapshot as one line of json
+    def write_jsonl(self, path):
+        with open(path, "a") as jsonl_file:
+            jsonl_file.write(json.dumps(self.snapshot()) + "\n")
+
+    # replace a file with the metrics in the prometheus text format, for the node exporter textfile collector
+    def write_prometheus(self, path, prefix="object_tracking"):
+        snapshot = self.snapshot()
+        lines = [
+            f"# HELP {prefix}_stage_seconds duration of pipeline stages over the last {self.window} samples",
+            f"# TYPE {prefix}_stage_seconds summary"
+        ]
+        for name, span in snapshot["spans"].items():
+            stage = self.__label(name)
+            for quantile, key in [(.5, "p50_ms"), (.95, "p95_ms"), (.99, "p99_ms")]:
+                lines.append(f'{prefix}_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {span[key] / 1000:.6f}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {span["sum_seconds"]:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {span["count"]}')
+
+        for name, value in snapshot["counters"].items():
+            metric = f"{prefix}_{self.__metric_name(name)}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, value in snapshot["gauges"].items():
+            metric = f"{prefix}_{self.__metric_name(name)}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+
+        # written next to the target and renamed, so collectors never read half a file
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def __label(name):
+        return name.replace("\\", "\\\\").replace('"', '\\"')
+
+    @staticmethod
+    def __metric_name(name):
+        return "".join(c if c.isalnum() else "_" for c in name.lower())
+
+
+class MetricsExporter:
+
+    # writes the metrics to the given files at most every interval seconds, paths can be None
+    def __init__(self, metrics, jsonl_path=None, prometheus_path=None, interval=10):
+        self.metrics = metrics
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.interval = interval
+        self.last_export = None
+
+    def enabled(self):
+        return self.jsonl_path is not None or self.prometheus_path is not None
+
+    # export if the interval has passed since the last export, or always if forced
+    def update(self, force=False):
+        if not self.enabled():
+            return
+        now = time.perf_counter()
+        if not force and self.last_export is not None and now - self.last_export < self.interval:
+            return
+        self.last_export = now
+
+        if self.jsonl_path is not None:
+            self.metrics.write_jsonl(self.jsonl_path)
+        if self.prometheus_path is not None:
+            self.metrics.write_prometheus(self.prometheus_path)
+
+
+# metrics of the whole process, off until an application turns them on
+metrics = Metrics()
@@ -0,0 +1,61 @@
+import cv2
+import numpy as np
+
+
+class Letterbox:
+
+    # gray of the border around the scaled image, the color yolo models are trained with
+    pad_value = 114
+
+    # scales images into a reused float32 blob of shape (batch, 3, height, width), keeping their aspect ratio
+    def __init__(self, resolution):
+        self.resolution = tuple(resolution)
+        width, height = self.resolution
+
+        self.canvas = np.full((height, width, 3), self.pad_value, dtype=np.uint8)
+        self.blob = np.empty((0, 3, height, width), dtype=np.float32)
+        # position and size of the image on the canvas, the border is only painted when it changes
+        self.placement = None
+
+        # buffers allocated so far, constant once the largest batch has been seen
+        self.allocations = 1
+
+    # scale and placement of an image of the given size, as scale, x, y, width, height on the canvas
+    def fit(self, width, height):
+        target_width, target_height = self.resolution
+        scale = min(target_width / width, target_height / height)
+        scaled_width = min(target_width, max(1, round(width * scale)))
+        scaled_height = min(target_height, max(1, round(height * scale)))
+        x = (target_width - scaled_width) // 2
+        y = (target_height - scaled_height) // 2
+        return scale, x, y, scaled_width, scaled_height
+
+    # blob of the images and one (scale, x, y) per image to map boxes back with
+    # the blob is overwritten by the next call
+    def prepare(self, images):
+        if len(self.blob) < len(images):
+            width, height = self.resolution
+            self.blob = np.empty((len(images), 3, height, width), dtype=np.float32)
+            self.allocations += 1
+
+        placements = []
+        for i, image in enumerate(images):
+            scale, x, y, width, height = self.fit(image.shape[1], image.shape[0])
+            if self.placement != (x, y, width, height):
+                self.canvas[:] = self.pad_value
+                self.placement = (x, y, width, height)
+
+            # resized straight onto the canvas, then converted, scaled and reordered to channels first in one pass
+            cv2.resize(image, (width, height), dst=self.canvas[y:y + height, x:x + width], interpolation=cv2.INTER_LINEAR)
+            np.multiply(self.canvas.transpose(2, 0, 1), np.float32(1 / 255), out=self.blob[i])
+            placements.append((scale, x, y))
+
+        return self.blob[:len(images)], placements
+
+    # boxes as center x, center y, width, height from blob coordinates back to the image
+    @staticmethod
+    def unmap(boxes, placement):
+        scale, x, y = placement
+        boxes = np.float32(boxes).reshape(-1, 4)
+        boxes[:, 0:2] -= np.float32([x, y])
+        return boxes / np.float32(scale)
@@ -0,0 +1,171 @@
+import cv2
+import numpy as np
+from object_detection import ObjectDetection, Detections, batched_nms
+
+
+class MotionGatedDetection(ObjectDetection):
+
+    methods = ["difference", "background"]
+
+    # runs the wrapped detector only where the image changed since the last detection
+    def __init__(self, detector, method="difference", motion_width=160, pixel_threshold=25, min_motion=.0005, max_crop_area=.5, padding=16, min_crop_size=96):
+        super().__init__()
+        self.detector = detector
+        self.name = detector.name + " motion"
+
+        # classes and their toggles are shared with the wrapped detector
+        self._classes = detector._classes
+        self.enable_classes = detector.enable_classes
+
+        # frame differencing against the last detected image, or a learned background
+        self.method = method
+        # width of the downscaled image the motion is measured on
+        self.motion_width = motion_width
+        # gray level change of a pixel to count as moving
+        self.pixel_threshold = pixel_threshold
+        # fraction of moving pixels below which the image counts as static and detection is skipped
+        self.min_motion = min_motion
+        # fraction of the image the moving regions may cover before the whole image is detected on
+        self.max_crop_area = max_crop_area
+        # pixels added around moving regions, and the smallest crop side, in image pixels
+        self.padding = padding
+        self.min_crop_size = min_crop_size
+
+        self.reset()
+
+    def reset(self):
+        self.previous_image = None
+        self.background = None
+        if self.method == "background":
+            self.background = cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+        self.last_result = None
+        # mask of the moving pixels at motion resolution, for debugging overlays
+        self.motion_mask = None
+
+        self.frames_skipped = 0
+        self.frames_cropped = 0
+        self.frames_full = 0
+        self.pixels_total = 0
+        self.pixels_saved = 0
+
+    def image_resolution(self):
+        return self.detector.image_resolution()
+
+    def input_sizes(self):
+        return self.detector.input_sizes()
+
+    def set_input_size(self, resolution):
+        self.detector.set_input_size(resolution)
+
+    def class_table(self):
+        return self.detector.class_table()
+
+    def load(self, background=False):
+        self.detector.load(background)
+
+    def source_frame(self, source, index):
+        self.detector.source_frame(source, index)
+
+    def focus(self, boxes):
+        self.detector.focus(boxes)
+
+    def statistics(self):
+        saved = self.pixels_saved / self.pixels_total if self.pixels_total > 0 else 0
+        statistics = {
+            "skipped": self.frames_skipped,
+            "cropped": self.frames_cropped,
+            "full": self.frames_full,
+            "pixels saved": f"{saved:.0%}"
+        }
+        statistics.update(self.detector.statistics())
+        return statistics
+
+    # moving regions of the image as x, y, width, height in image pixels
+    def moving_regions(self, image):
+        height, width = image.shape[0:2]
+        motion_height = max(1, int(height * self.motion_width / width))
+        small = cv2.cvtColor(cv2.resize(image, (self.motion_width, motion_height), interpolation=cv2.INTER_AREA), cv2.COLOR_RGB2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+
+        if self.background is not None:
+            mask = self.background.apply(small)
+        elif self.previous_image is None or self.previous_image.shape != small.shape:
+            mask = np.full(small.shape, 255, dtype=np.uint8)
+        else:
+            mask = cv2.absdiff(small, self.previous_image)
+            mask = cv2.threshold(mask, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1]
+        self.previous_image = small
+
+        mask = cv2.dilate(mask, None, iterations=2)
+        self.motion_mask = mask
+
+        if np.count_nonzero(mask) < self.min_motion * mask.size:
+            return np.empty((0, 4), dtype=np.int64)
+
+        # bounding boxes of the moving blobs, scaled up and padded
+        _, _, stats, _ = cv2.connectedComponentsWithStats(mask)
+        regions = np.float32(stats[1:, 0:4]) * np.float32([width / self.motion_width, height / motion_height] * 2)
+        regions[:, 0:2] -= self.padding
+        regions[:, 2:4] += 2 * self.padding
+        grow = np.maximum(self.min_crop_size - regions[:, 2:4], 0)
+        regions[:, 0:2] -= grow / 2
+        regions[:, 2:4] += grow
+
+        top_left = np.clip(regions[:, 0:2], 0, [width, height])
+        bottom_right = np.clip(regions[:, 0:2] + regions[:, 2:4], 0, [width, height])
+        return self.__merge(np.int64(np.concatenate((top_left, bottom_right - top_left), axis=1)))
+
+    def detect(self, image, threshold, nms_threshold):
+        height, width = image.shape[0:2]
+        area = width * height
+        self.pixels_total += area
+
+        regions = self.moving_regions(image)
+
+        # nothing moved, the last detections still hold
+        if len(regions) == 0 and self.last_result is not None:
+            self.frames_skipped += 1
+            self.pixels_saved += area
+            return self.last_result
+
+        if len(regions) == 0 or np.prod(regions[:, 2:4], axis=1).sum() > self.max_crop_area * area:
+            self.frames_full += 1
+            self.last_result = self.detector.detect(image, threshold, nms_threshold)
+            return self.last_result
+
+        # detect only on crops around the moving regions, mapped back to image coordinates
+        self.frames_cropped += 1
+        self.pixels_saved += area - np.prod(regions[:, 2:4], axis=1).sum()
+
+        crops = [image[y:y + h, x:x + w] for x, y, w, h in regions]
+        results = self.detector.detect_batch(crops, threshold, nms_threshold)
+        detections = Detections.concatenate(results, *self.class_table())
+        detections.boxes[:, 0:2] += np.repeat(np.float32(regions[:, 0:2]), [len(result) for result in results], axis=0)
+
+        # objects on overlapping crops are found twice
+        valid_boxes = batched_nms(detections.boxes, detections.class_ids, detections.confidences, threshold, nms_threshold)
+
+        self.last_result = detections[valid_boxes]
+        return self.last_result
+
+    # join overlapping regions until none overlap
+    @staticmethod
+    def __merge(regions):
+        regions = [list(region) for region in regions]
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(regions)):
+                for j in range(i + 1, len(regions)):
+                    a = regions[i]
+                    b = regions[j]
+                    if a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]:
+                        x = min(a[0], b[0])
+                        y = min(a[1], b[1])
+                        regions[i] = [x, y, max(a[0] + a[2], b[0] + b[2]) - x, max(a[1] + a[3], b[1] + b[3]) - y]
+                        del regions[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+        return np.array(regions, dtype=np.int64).reshape(-1, 4)
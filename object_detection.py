@@ -1,26 +1,195 @@
+import cv2
+import numpy as np
 from abc import ABC, abstractmethod
 
 
+# indices of the boxes kept by non maximum suppression done separately for every class
+# boxes are center x, center y, width, height
+def batched_nms(boxes, class_ids, confidences, threshold, nms_threshold):
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    class_ids = np.asarray(class_ids)
+
+    # boxes of each class are shifted so they never overlap other classes, boxes reaching past the top left
+    # are moved to start at zero first, so the offset covers the whole range of coordinates
+    corners = boxes.copy()
+    corners[:, :2] -= corners[:, 2:] / 2
+    corners[:, :2] -= corners[:, :2].min(initial=0)
+    class_offset = (corners[:, :2] + corners[:, 2:]).max(initial=0) + 1
+    corners[:, :2] += (class_ids * class_offset)[:, None]
+
+    return np.array(
+        cv2.dnn.NMSBoxes(corners, np.asarray(confidences, dtype=np.float32), threshold, nms_threshold), dtype=np.int64
+    ).reshape(-1)
+
+
+class Detections:
+
+    # one record per box: center x, center y, width, height in image pixels, index into the class names and colors,
+    # confidence, persistent track id or -1 without one, and whether the box is valid, lost tracks are not
+    dtype = np.dtype([
+        ("box", np.float32, (4,)),
+        ("class_id", np.int16),
+        ("confidence", np.float16),
+        ("track_id", np.int64),
+        ("valid", np.bool_)
+    ])
+
+    # records is an array of dtype, names and colors are the class tables of the detector, shared and never copied
+    def __init__(self, records, names, colors):
+        self.records = records
+        self.names = names
+        self.colors = colors
+
+    @classmethod
+    def create(cls, boxes, class_ids=None, confidences=None, names=None, colors=None, track_ids=None):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        records = np.empty(len(boxes), dtype=cls.dtype)
+        records["box"] = boxes
+        records["class_id"] = 0 if class_ids is None else class_ids
+        records["confidence"] = 1 if confidences is None else confidences
+        records["track_id"] = -1 if track_ids is None else track_ids
+        records["valid"] = True
+        if names is None:
+            names = np.array([""])
+            colors = np.zeros((1, 3), dtype=np.int64)
+        return cls(records, names, colors)
+
+    @classmethod
+    def empty(cls, names, colors):
+        return cls(np.empty(0, dtype=cls.dtype), names, colors)
+
+    # detections of several images with the same class tables as one
+    @classmethod
+    def concatenate(cls, detections, names, colors):
+        return cls(np.concatenate([d.records for d in detections] + [np.empty(0, dtype=cls.dtype)]), names, colors)
+
+    # boxes as left, top, right, bottom
+    @staticmethod
+    def to_corners(boxes):
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        return np.concatenate((boxes[:, 0:2] - boxes[:, 2:4] / 2, boxes[:, 0:2] + boxes[:, 2:4] / 2), axis=1)
+
+    # boxes as center x, center y, width, height from left, top, right, bottom
+    @staticmethod
+    def from_corners(corners):
+        corners = np.asarray(corners, dtype=np.float32).reshape(-1, 4)
+        return np.concatenate(((corners[:, 0:2] + corners[:, 2:4]) / 2, corners[:, 2:4] - corners[:, 0:2]), axis=1)
+
+    def __len__(self):
+        return len(self.records)
+
+    # slices are views of the records, masks and index arrays copies
+    def __getitem__(self, index):
+        return Detections(self.records[index], self.names, self.colors)
+
+    # the fields are views, writing to them changes the records
+    @property
+    def boxes(self):
+        return self.records["box"]
+
+    @property
+    def class_ids(self):
+        return self.records["class_id"]
+
+    @property
+    def confidences(self):
+        return self.records["confidence"]
+
+    @property
+    def track_ids(self):
+        return self.records["track_id"]
+
+    @property
+    def valid(self):
+        return self.records["valid"]
+
+    def class_names(self):
+        return self.names[self.class_ids]
+
+    def class_colors(self):
+        return self.colors[self.class_ids]
+
+    def corners(self):
+        return self.to_corners(self.boxes)
+
+    def copy(self):
+        return Detections(self.records.copy(), self.names, self.colors)
+
+    # only the valid boxes, the same instance if all are valid
+    def valid_only(self):
+        if self.valid.all():
+            return self
+        return self[self.valid]
+
+    # copy with other boxes, like the boxes of the same objects tracked on a later frame
+    def moved(self, boxes, valid=None):
+        detections = self.copy()
+        detections.boxes[:] = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        if valid is not None:
+            detections.valid[:] = valid
+        return detections
+
+
 class ObjectDetection(ABC):
 
     name = ""
-    _image_height = 640
-    _image_width = 640
+    # width and height of the detector input, replaced as a whole so a detection never sees half of a change
+    _image_size = (640, 640)
+
+    __class_table = None
 
     def __init__(self):
         self._classes = {}
         self.enable_classes = []
 
     def image_resolution(self):
-        return (self._image_width, self._image_height)
+        return self._image_size
+
+    # input sizes as (width, height) the detector can run at, the current one among them
+    def input_sizes(self):
+        return [self.image_resolution()]
+
+    # run at another of the input sizes from the next detection on
+    def set_input_size(self, resolution):
+        self._image_size = tuple(resolution)
 
     def classes(self):
         return {key: f'#{value[0]:02x}{value[1]:02x}{value[2]:02x}' for key, value in self._classes.items()}
 
+    # class names and colors as arrays, the class ids of the detections index them
+    def class_table(self):
+        if self.__class_table is None or len(self.__class_table[0]) != len(self._classes):
+            self.__class_table = (
+                np.array(list(self._classes), dtype=str),
+                np.array(list(self._classes.values()), dtype=np.int64).reshape(-1, 3)
+            )
+        return self.__class_table
+
+    # prepare the detector for use, in a background thread if asked to
+    def load(self, background=False):
+        pass
+
+    # hint where objects are expected on the next detection, boxes as center x, center y, width, height
+    def focus(self, boxes):
+        pass
+
+    # hint which frame of which source the next detection runs on, source is a video path, index None if unknown
+    def source_frame(self, source, index):
+        pass
+
+    # counters worth showing next to the detector, by name
+    def statistics(self):
+        return {}
+
+    # detections on an image as Detections, boxes in image coordinates
     @abstractmethod
     def detect(self, image, threshold, nms_threshold):
         pass
 
+    # detect on several images, returns one Detections per image
+    def detect_batch(self, images, threshold, nms_threshold):
+        return [self.detect(image, threshold, nms_threshold) for image in images]
+
 
 class NoDetection(ObjectDetection):
 
@@ -30,4 +199,4 @@ class NoDetection(ObjectDetection):
         super().__init__()
 
     def detect(self, image, threshold, nms_threshold):
-        return [], [], [], []
+        return Detections.empty(*self.class_table())
@@ -1,14 +1,91 @@
 import cv2
+import numpy as np
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from object_detection import Detections
+try:
+    from scipy.optimize import linear_sum_assignment
+except:
+    linear_sum_assignment = None
+
+
+# intersection over union of every box in a with every box in b, all as center x, center y, width, height
+def iou_matrix(a, b):
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(1, -1, 4)
+
+    top_left = np.maximum(a[..., 0:2] - a[..., 2:4] / 2, b[..., 0:2] - b[..., 2:4] / 2)
+    bottom_right = np.minimum(a[..., 0:2] + a[..., 2:4] / 2, b[..., 0:2] + b[..., 2:4] / 2)
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    union = np.prod(a[..., 2:4], axis=2) + np.prod(b[..., 2:4], axis=2) - intersection
+
+    return intersection / np.maximum(union, 1e-6)
+
+
+# closeness of every box center in a to every box center in b, 1 on the same center and 0 at max_distance box sizes away
+def center_similarity(a, b, max_distance):
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(1, -1, 4)
+
+    distance = np.linalg.norm(a[..., 0:2] - b[..., 0:2], axis=2)
+    size = np.maximum(np.linalg.norm(a[..., 2:4], axis=2), np.linalg.norm(b[..., 2:4], axis=2))
+
+    return np.clip(1 - distance / np.maximum(size * max_distance, 1e-6), 0, None)
+
+
+# pairs of rows and columns maximizing the total iou, only pairs above the minimum iou are kept
+def assign(iou, min_iou):
+    if iou.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(-iou)
+    else:
+        # without scipy match greedily, best overlap first
+        order = np.argsort(-iou, axis=None)
+        order = order[iou.flat[order] >= min_iou]
+        used_rows = np.zeros(iou.shape[0], dtype=bool)
+        used_cols = np.zeros(iou.shape[1], dtype=bool)
+        rows = []
+        cols = []
+        for row, col in zip(*np.unravel_index(order, iou.shape)):
+            if used_rows[row] or used_cols[col]:
+                continue
+            used_rows[row] = used_cols[col] = True
+            rows.append(row)
+            cols.append(col)
+        rows = np.array(rows, dtype=np.int64)
+        cols = np.array(cols, dtype=np.int64)
+
+    matched = iou[rows, cols] >= min_iou
+    return rows[matched], cols[matched]
+
+
+# median of the values of every group, groups are indices below count, nan for groups without values
+def group_median(values, groups, count):
+    order = np.lexsort((values, groups))
+    values = values[order]
+    sizes = np.bincount(groups, minlength=count)
+    starts = np.cumsum(sizes) - sizes
+
+    medians = np.full(count, np.nan, dtype=np.float32)
+    present = sizes > 0
+    low = starts[present] + (sizes[present] - 1) // 2
+    high = starts[present] + sizes[present] // 2
+    medians[present] = (values[low] + values[high]) / 2
+    return medians
+
 
 class ObjectTracking(ABC):
 
     name = ""
     
+    # start tracking the objects of new detections, returns them with the track ids given to them, if any
     @abstractmethod
-    def init(self, image, boxes):
+    def init(self, image, detections):
         pass
 
+    # the detections of the last init moved to the image, lost objects marked invalid, None without tracking
     @abstractmethod
     def track(self, image):
         pass
@@ -21,8 +98,8 @@ class NoTracking(ObjectTracking):
 
     name = "none"
 
-    def init(self, image, boxes):
-        pass
+    def init(self, image, detections):
+        return detections
 
     def track(self, image):
         pass
@@ -38,32 +115,318 @@ class CV2Tracking(ObjectTracking):
         "MOSSE" : cv2.legacy.TrackerMOSSE_create
     }
 
-    def __init__(self, tracker, resolution):
+    def __init__(self, tracker, resolution, parallel=False, workers=None):
         self.name = tracker
         self.tracker_init = self.tracker_types[tracker]
         self.resolution = resolution
         self.trackers = []
+        self.detections = None
+        # every init starts new tracks, opencv trackers cannot tell the objects of two detections apart
+        self.next_id = 0
 
-    def init(self, image, boxes):
-        image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-        self.trackers = [self.tracker_init() for box in boxes]
+        # opencv releases the gil while updating, a persistent pool spreads the objects over all cores
+        self.pool = None
+        if parallel:
+            self.name += " parallel"
+            self.pool = ThreadPoolExecutor(workers, thread_name_prefix=self.name)
 
-        for i in range(len(boxes)):
-            self.trackers[i].init(image, boxes[i])
+    def init(self, image, detections):
+        scale = self.__scale(image)
+        image = self.__prepare(image)
+        boxes = [tuple(box) for box in np.int64(detections.boxes * scale).tolist()]
 
-    def track(self, image):
-        image = cv2.resize(image, self.resolution)
-        boxes = []
+        if self.pool is None:
+            self.trackers = [self.__create(image, box) for box in boxes]
+        else:
+            self.trackers = list(self.pool.map(lambda box: self.__create(image, box), boxes))
+
+        self.detections = detections.copy()
+        self.detections.track_ids[:] = self.next_id + np.arange(len(detections))
+        self.next_id += len(detections)
+        return self.detections
 
-        for tracker in self.trackers:
-            (success, box) = tracker.update(image)
+    def track(self, image):
+        scale = self.__scale(image)
+        image = self.__prepare(image)
 
-            if success:
-                boxes.append(box)
-            else:
-                boxes.append(None)
+        if self.pool is None:
+            boxes = [self.__update(tracker, image) for tracker in self.trackers]
+        else:
+            boxes = list(self.pool.map(lambda tracker: self.__update(tracker, image), self.trackers))
 
-        return boxes
+        if self.detections is None:
+            return None
+        valid = np.array([box is not None for box in boxes], dtype=bool)
+        moved = self.detections.boxes.copy()
+        if valid.any():
+            moved[valid] = np.float32([box for box in boxes if box is not None]) / scale
+        return self.detections.moved(moved, valid)
 
     def reset(self):
         self.trackers.clear()
+        self.detections = None
+
+    # factor from image coordinates to tracking resolution coordinates, per axis and box element
+    def __scale(self, image):
+        scale_x = self.resolution[0] / image.shape[1]
+        scale_y = self.resolution[1] / image.shape[0]
+        return np.array([scale_x, scale_y, scale_x, scale_y])
+
+    # one converted frame at tracking resolution shared by all trackers
+    def __prepare(self, image):
+        if (image.shape[1], image.shape[0]) != tuple(self.resolution):
+            image = cv2.resize(image, self.resolution)
+        return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+
+    def __create(self, image, box):
+        tracker = self.tracker_init()
+        tracker.init(image, box)
+        return tracker
+
+    @staticmethod
+    def __update(tracker, image):
+        (success, box) = tracker.update(image)
+
+        if success:
+            return box
+        return None
+
+class SortTracking(ObjectTracking):
+
+    name = "SORT"
+
+    # constant velocity model on center x, center y, width, height
+    transition = np.eye(8, dtype=np.float32) + np.eye(8, k=4, dtype=np.float32)
+    measurement = np.eye(4, 8, dtype=np.float32)
+    process_noise = np.diag(np.float32([1, 1, 1, 1, .01, .01, .01, .01]))
+    measurement_noise = np.diag(np.float32([1, 1, 10, 10]))
+    initial_covariance = np.diag(np.float32([10, 10, 10, 10, 1000, 1000, 1000, 1000]))
+
+    def __init__(self, min_iou=.3, max_age=3, max_distance=2):
+        self.min_iou = min_iou
+        # small fast objects may not overlap their prediction, they are matched by center distance in box sizes
+        self.max_distance = max_distance
+        # detector runs a track may go unmatched before it is removed
+        self.max_age = max_age
+        self.next_id = 0
+        self.reset()
+
+    def init(self, image, detections):
+        boxes = np.asarray(detections.boxes, dtype=np.float32).reshape(-1, 4)
+        self.__predict()
+
+        # match detections to the predicted tracks by overlap, then the rest by distance, and correct them
+        track_rows, detection_cols = assign(iou_matrix(self.states[:, :4], boxes), self.min_iou)
+        free_tracks = np.setdiff1d(np.arange(len(self.states)), track_rows)
+        free_detections = np.setdiff1d(np.arange(len(boxes)), detection_cols)
+        near_rows, near_cols = assign(
+            center_similarity(self.states[free_tracks, :4], boxes[free_detections], self.max_distance), 1e-6
+        )
+        track_rows = np.concatenate((track_rows, free_tracks[near_rows]))
+        detection_cols = np.concatenate((detection_cols, free_detections[near_cols]))
+        self.__update(track_rows, boxes[detection_cols])
+        self.misses += 1
+        self.misses[track_rows] = 0
+
+        detection_tracks = np.full(len(boxes), -1, dtype=np.int64)
+        detection_tracks[detection_cols] = track_rows
+
+        # forget tracks that have not been seen for too long
+        alive = self.misses <= self.max_age
+        new_rows = np.cumsum(alive) - 1
+        detection_tracks[detection_tracks >= 0] = new_rows[detection_tracks[detection_tracks >= 0]]
+        self.states = self.states[alive]
+        self.covariances = self.covariances[alive]
+        self.misses = self.misses[alive]
+        self.track_ids = self.track_ids[alive]
+
+        # start new tracks for unmatched detections
+        new_detections = np.flatnonzero(detection_tracks < 0)
+        new_states = np.zeros((len(new_detections), 8), dtype=np.float32)
+        new_states[:, :4] = boxes[new_detections]
+        detection_tracks[new_detections] = len(self.states) + np.arange(len(new_detections))
+        self.states = np.concatenate((self.states, new_states))
+        self.covariances = np.concatenate((self.covariances, np.tile(self.initial_covariance, (len(new_detections), 1, 1))))
+        self.misses = np.concatenate((self.misses, np.zeros(len(new_detections), dtype=np.int64)))
+        self.track_ids = np.concatenate((self.track_ids, self.next_id + np.arange(len(new_detections))))
+        self.next_id += len(new_detections)
+
+        self.detection_tracks = detection_tracks
+        self.detections = detections.copy()
+        self.detections.track_ids[:] = self.track_ids[detection_tracks]
+        return self.detections
+
+    # predicted boxes of the tracks of the last detections, no image processing is needed
+    def track(self, image):
+        self.__predict()
+
+        if self.detections is None:
+            return None
+        boxes = self.states[self.detection_tracks, :4]
+        return self.detections.moved(boxes, (boxes[:, 2] > 0) & (boxes[:, 3] > 0))
+
+    def reset(self):
+        self.states = np.empty((0, 8), dtype=np.float32)
+        self.covariances = np.empty((0, 8, 8), dtype=np.float32)
+        self.misses = np.empty(0, dtype=np.int64)
+        self.track_ids = np.empty(0, dtype=np.int64)
+        self.detection_tracks = np.empty(0, dtype=np.int64)
+        # the last detections with the persistent ids of their tracks
+        self.detections = None
+
+    # advance all tracks by one frame
+    def __predict(self):
+        self.states = self.states @ self.transition.T
+        self.covariances = self.transition @ self.covariances @ self.transition.T + self.process_noise
+
+    # kalman correction of the given tracks with measured boxes
+    def __update(self, rows, boxes):
+        if len(rows) == 0:
+            return
+
+        states = self.states[rows]
+        covariances = self.covariances[rows]
+
+        residuals = boxes - states @ self.measurement.T
+        innovation = self.measurement @ covariances @ self.measurement.T + self.measurement_noise
+        gains = covariances @ self.measurement.T @ np.linalg.inv(innovation)
+
+        self.states[rows] = states + (gains @ residuals[:, :, None])[:, :, 0]
+        self.covariances[rows] = (np.eye(8, dtype=np.float32) - gains @ self.measurement) @ covariances
+
+class FlowTracking(ObjectTracking):
+
+    name = "optical flow"
+
+    lk_criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, .03)
+
+    # sparse lucas kanade flow of feature points found in the boxes, all objects in one pass, so the cost grows with
+    # the total number of points rather than with the objects
+    # a point is kept while it is found again when tracked back to the previous frame within max_error pixels,
+    # an object is lost once fewer than min_points of its points are left
+    def __init__(self, resolution, points=24, window=(21, 21), levels=3, max_error=1., min_points=3):
+        self.resolution = resolution
+        self.points_per_object = points
+        self.window = window
+        self.levels = levels
+        self.max_error = max_error
+        self.min_points = min_points
+        # every init starts new tracks, like the opencv trackers
+        self.next_id = 0
+        self.reset()
+
+    def init(self, image, detections):
+        scale = self.__scale(image)
+        gray = self.__prepare(image)
+        self.boxes = np.float32(detections.boxes).reshape(-1, 4) * scale
+
+        points = []
+        owners = []
+        height, width = gray.shape
+        for i, (left, top, right, bottom) in enumerate(np.int64(np.round(Detections.to_corners(self.boxes))).tolist()):
+            left, top = max(left, 0), max(top, 0)
+            right, bottom = min(right, width), min(bottom, height)
+            if right - left < 3 or bottom - top < 3:
+                continue
+            corners = cv2.goodFeaturesToTrack(gray[top:bottom, left:right], self.points_per_object, .01, 3)
+            if corners is None:
+                continue
+            points.append(corners.reshape(-1, 2) + np.float32([left, top]))
+            owners.append(np.full(len(corners), i, dtype=np.int64))
+
+        self.points = np.concatenate(points) if points else np.empty((0, 2), dtype=np.float32)
+        self.owners = np.concatenate(owners) if owners else np.empty(0, dtype=np.int64)
+        self.gray = gray
+
+        self.detections = detections.copy()
+        self.detections.track_ids[:] = self.next_id + np.arange(len(detections))
+        self.next_id += len(detections)
+        return self.detections
+
+    def track(self, image):
+        if self.detections is None:
+            return None
+        scale = self.__scale(image)
+        count = len(self.boxes)
+        if len(self.points) == 0:
+            return self.detections.moved(self.boxes / scale, np.zeros(count, dtype=bool))
+
+        # one gray frame serves the forward pass and the check back to the previous frame, each pass takes all points
+        gray = self.__prepare(image)
+        moved, found, _ = cv2.calcOpticalFlowPyrLK(
+            self.gray, gray, self.points.reshape(-1, 1, 2), None,
+            winSize=self.window, maxLevel=self.levels, criteria=self.lk_criteria
+        )
+        back, found_back, _ = cv2.calcOpticalFlowPyrLK(
+            gray, self.gray, moved, None,
+            winSize=self.window, maxLevel=self.levels, criteria=self.lk_criteria
+        )
+        moved = moved.reshape(-1, 2)
+        error = np.linalg.norm(back.reshape(-1, 2) - self.points, axis=1)
+        good = (found.ravel() == 1) & (found_back.ravel() == 1) & (error < self.max_error)
+
+        points, moved, owners = self.points[good], moved[good], self.owners[good]
+        valid = np.bincount(owners, minlength=count) >= self.min_points
+
+        if valid.any():
+            # boxes move by the median motion of their points and scale by the median change of the point spread
+            shift = np.stack([group_median(moved[:, axis] - points[:, axis], owners, count) for axis in (0, 1)], axis=1)
+            centers = np.stack([group_median(points[:, axis], owners, count) for axis in (0, 1)], axis=1)
+            spread = np.linalg.norm(points - centers[owners], axis=1)
+            after = moved - (centers + shift)[owners]
+            spreading = spread > 1
+            growth = group_median(
+                np.linalg.norm(after[spreading], axis=1) / spread[spreading], owners[spreading], count
+            )
+            growth = np.where(np.isnan(growth), 1, growth)
+
+            self.boxes[valid, 0:2] += shift[valid]
+            self.boxes[valid, 2:4] *= growth[valid, None]
+
+        # points of lost objects are dropped with them
+        keep = valid[owners]
+        self.points = moved[keep]
+        self.owners = owners[keep]
+        self.gray = gray
+        return self.detections.moved(self.boxes / scale, valid)
+
+    def reset(self):
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        # feature points at tracking resolution and the index of the box each belongs to
+        self.points = np.empty((0, 2), dtype=np.float32)
+        self.owners = np.empty(0, dtype=np.int64)
+        self.gray = None
+        self.detections = None
+
+    # factor from image coordinates to tracking resolution coordinates, per axis and box element
+    def __scale(self, image):
+        scale_x = self.resolution[0] / image.shape[1]
+        scale_y = self.resolution[1] / image.shape[0]
+        return np.float32([scale_x, scale_y, scale_x, scale_y])
+
+    # flow only needs intensity, the image is reduced to gray before it is resized
+    def __prepare(self, image):
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        if (gray.shape[1], gray.shape[0]) != tuple(self.resolution):
+            gray = cv2.resize(gray, self.resolution, interpolation=cv2.INTER_AREA)
+        return gray
+
+# names of all trackers create_tracker knows
+tracker_names = \
+    [NoTracking.name] + \
+    list(CV2Tracking.tracker_types) + \
+    [f"{tracker} parallel" for tracker in CV2Tracking.tracker_types] + \
+    [SortTracking.name] + \
+    [FlowTracking.name]
+
+
+def create_tracker(name, resolution):
+    if name == NoTracking.name:
+        return NoTracking()
+    if name == SortTracking.name:
+        return SortTracking()
+    if name == FlowTracking.name:
+        return FlowTracking(resolution)
+    if name.endswith(" parallel"):
+        return CV2Tracking(name[:-len(" parallel")], resolution, parallel=True)
+    return CV2Tracking(name, resolution)
@@ -1,19 +1,32 @@
-import time
 import cv2
 import numpy as np
-from picamera2 import Picamera2, Preview
+from picamera2 import Picamera2, Preview, MappedArray
 from libcamera import Transform, controls
-from image_provider import ImageProvider
+from image_provider import ImageProvider, Frame
 
 class PicameraImageProvider(ImageProvider):
 
     name = "Camera"
-    last_time = time.time()
-    current_time = time.time()
 
     def __init__(self, resolution):
+        self.resolution = tuple(resolution)
+        # the camera is opened when it is first needed, only one process can hold it
+        self.camera = None
+        # set by close, a closed camera is not opened again by taking images, only by open
+        self.closed = False
+
+        self.sequence = 0
+        # sensor timestamps of the last two frames in seconds, the frame interval comes from the camera, not the consumer
+        self.last_time = None
+        self.current_time = None
+
+    def open(self):
+        self.closed = False
+        if self.camera is not None:
+            return
+
         self.camera = Picamera2()
-        self.config = self.camera.create_preview_configuration(main={"size": resolution,
+        self.config = self.camera.create_preview_configuration(main={"size": self.resolution,
                                                                      "format": "RGB888"},
                                                                queue=True)
         self.camera.configure(self.config)
@@ -21,11 +34,43 @@ class PicameraImageProvider(ImageProvider):
         self.camera.start_preview()
         self.camera.start()
 
-    def next(self):
-        img = self.camera.capture_array()
+    # timestamps are when the sensor exposed the frame, on the monotonic clock of the kernel
+    def next_frame(self, out=None):
+        if self.closed:
+            return None
+        self.open()
+        request = self.camera.capture_request()
+        try:
+            if out is not None:
+                # the frame is copied out of the camera buffer into memory of the caller without a new array
+                with MappedArray(request, "main") as mapped:
+                    np.copyto(out, mapped.array)
+                image = out
+            else:
+                image = request.make_array("main")
+            timestamp = request.get_metadata().get("SensorTimestamp")
+        finally:
+            request.release()
+
         self.last_time = self.current_time
-        self.current_time = time.time()
-        return img
+        self.current_time = None if timestamp is None else timestamp / 1e9
+        frame = Frame(image, self.sequence, self.current_time, self.resolution)
+        self.sequence += 1
+        return frame
 
+    # -1 until two frames with timestamps were taken
     def dt(self):
+        if self.last_time is None or self.current_time is None:
+            return -1
         return self.current_time - self.last_time
+
+    # stop and release the camera so another process can open it, it is only opened again by open
+    def close(self):
+        self.closed = True
+        if self.camera is not None:
+            self.camera.stop()
+            self.camera.close()
+            self.camera = None
+        self.sequence = 0
+        self.last_time = None
+        self.current_time = None
@@ -0,0 +1,166 @@
+import time
+import threading
+import cv2
+from collections import deque
+from instrumentation import metrics
+
+
+class LatestQueue:
+
+    # bounded queue, when full the oldest item is dropped instead of blocking the producer
+    def __init__(self, size):
+        self.items = deque(maxlen=size)
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self.condition:
+            if len(self.items) == self.items.maxlen:
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+
+    # oldest item in the queue, None if nothing arrived before the timeout
+    def get(self, timeout=None):
+        with self.condition:
+            if len(self.items) == 0:
+                self.condition.wait(timeout)
+            if len(self.items) == 0:
+                return None
+            return self.items.popleft()
+
+    def clear(self):
+        with self.condition:
+            self.items.clear()
+
+
+class Pipeline:
+
+    # seconds a stage waits for input before checking if it should stop
+    poll_interval = .1
+
+    def __init__(self, processor, queue_size=1):
+        self.processor = processor
+        self.capture_queue = LatestQueue(queue_size)
+        self.render_queue = LatestQueue(queue_size)
+        self.output_queue = LatestQueue(1)
+
+        self.running = threading.Event()
+        self.threads = []
+
+        # size of the finished frames, None to keep the processing resolution
+        self.display_resolution = None
+        # hold frames back to the frame interval of the provider, off to process as fast as possible
+        self.paced = True
+
+        # frames are only drawn for display while set, without a viewer all time goes to detection and tracking
+        self.rendering = threading.Event()
+        self.rendering.set()
+
+        # called from the process stage with the source, detections and truth of every processed frame
+        self.observers = []
+
+        # rolling glass to glass latency in seconds, from capture to display
+        self.latency = None
+        self.displayed_frames = 0
+        self.last_display_time = None
+
+    def start(self):
+        self.running.set()
+        self.threads = [
+            threading.Thread(target=self.__capture, name="capture", daemon=True),
+            threading.Thread(target=self.__process, name="process", daemon=True),
+            threading.Thread(target=self.__render, name="render", daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        self.running.clear()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def dropped_frames(self):
+        return self.capture_queue.dropped + self.render_queue.dropped + self.output_queue.dropped
+
+    # newest finished frame to display, None if no new frame is ready within the timeout
+    def latest(self, timeout=0):
+        item = self.output_queue.get(timeout=timeout)
+        if item is None:
+            return None
+
+        capture_time, image = item
+        now = time.perf_counter()
+        latency = now - capture_time
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = .9 * self.latency + .1 * latency
+        self.displayed_frames += 1
+
+        # the interval between displayed frames gives the frame rate
+        if self.last_display_time is not None:
+            metrics.record("display interval", now - self.last_display_time)
+        self.last_display_time = now
+        metrics.record("latency", latency)
+        metrics.count("displayed frames")
+
+        return image
+
+    # pull images from the provider at its own rate
+    def __capture(self):
+        while self.running.is_set():
+            start_time = time.perf_counter()
+            with metrics.span("capture"):
+                image, truth, source = self.processor.capture()
+            if image is None:
+                time.sleep(self.poll_interval)
+                continue
+
+            capture_time = time.perf_counter()
+            self.capture_queue.put((capture_time, image, truth, source))
+
+            # wait out the rest of the frame interval of the provider, it may have been deselected since
+            provider = self.processor.provider
+            dt = provider.dt() if provider is not None else -1
+            if self.paced and dt > 0:
+                time.sleep(max(0, start_time + dt - time.perf_counter()))
+
+    # detection and tracking
+    def __process(self):
+        while self.running.is_set():
+            item = self.capture_queue.get(self.poll_interval)
+            if item is None:
+                continue
+
+            capture_time, image, truth, source = item
+            image, detections = self.processor.process(image, source)
+            self.processor.score(truth, detections)
+            metrics.count("processed frames")
+            for observer in self.observers:
+                observer(source, detections, truth)
+            if self.rendering.is_set():
+                self.render_queue.put((capture_time, image, detections, truth))
+
+    # drawing of the overlays
+    def __render(self):
+        while self.running.is_set():
+            item = self.render_queue.get(self.poll_interval)
+            if item is None:
+                continue
+
+            capture_time, image, detections, truth = item
+            # overlays are drawn after scaling to the display, so lines and text keep their size whatever the source is
+            scale = (1, 1)
+            if self.display_resolution is not None and (image.shape[1], image.shape[0]) != tuple(self.display_resolution):
+                scale = (self.display_resolution[0] / image.shape[1], self.display_resolution[1] / image.shape[0])
+                with metrics.span("resize"):
+                    image = cv2.resize(image, tuple(self.display_resolution))
+            with metrics.span("draw"):
+                image = self.processor.draw(image, detections, truth, scale)
+            self.output_queue.put((capture_time, image))
+
+            metrics.gauge("dropped frames", self.dropped_frames())
+            provider = self.processor.provider
+            metrics.gauge("provider dropped frames", getattr(provider, "dropped_frames", 0))
@@ -0,0 +1,460 @@
+import queue
+import signal
+import time
+import multiprocessing
+import cv2
+import numpy as np
+from multiprocessing import shared_memory
+
+from object_detection import Detections
+from frame_processor import FrameProcessor, identify
+from detection_scheduling import FixedFrequencyScheduler
+from accuracy_metrics import StreamingMetrics
+from instrumentation import metrics
+
+
+# seconds a stage waits for input or a free slot before checking if it should stop
+poll_interval = .1
+
+
+class FrameRing:
+
+    # fixed size slots in one block of shared memory, processes hand each other slot indices instead of frames
+    # without a name the block is created, with the name of an existing block it is attached to
+    def __init__(self, slots, slot_size, name=None):
+        self.slots = slots
+        self.slot_size = slot_size
+        if name is None:
+            self.memory = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+        self.buffer = np.ndarray((slots, slot_size), dtype=np.uint8, buffer=self.memory.buf)
+
+    # what another process needs to attach to the ring
+    def address(self):
+        return self.slots, self.slot_size, self.memory.name
+
+    # image of the given shape at the start of a slot, a view into the shared memory
+    def image(self, slot, shape):
+        return self.buffer[slot, :int(np.prod(shape))].reshape(shape)
+
+    # the memory stays mapped while views of it are still referenced, it is freed with the last process using it
+    def close(self, unlink=False):
+        self.buffer = None
+        if unlink:
+            self.memory.unlink()
+        try:
+            self.memory.close()
+        except BufferError:
+            pass
+
+
+class DetectionChannel:
+
+    # detections cross processes as their records, the class tables only go along the first time and when they change
+    # the sending and the receiving end each have their own channel and see every message in order
+    def __init__(self):
+        self.tables = None
+
+    def pack(self, detections):
+        if detections is None:
+            return None
+        if self.tables is not None and detections.names is self.tables[0]:
+            return detections.records, None
+        self.tables = (detections.names, detections.colors)
+        return detections.records, self.tables
+
+    def unpack(self, packed):
+        if packed is None:
+            return None
+        records, tables = packed
+        if tables is not None:
+            self.tables = tables
+        return Detections(records, *self.tables)
+
+
+# next item of a queue and whether one arrived within the poll interval, items can be None
+def poll(source):
+    try:
+        return source.get(timeout=poll_interval), True
+    except queue.Empty:
+        return None, False
+
+
+# stages run until the running event is cleared or the end of the stream passes them
+# ctrl-c goes to the whole process group, the stages leave stopping to the parent
+def run_stage(stage, ring_address, outputs, running, *args):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ring = FrameRing(*ring_address)
+    try:
+        stage(ring, running, *args)
+    finally:
+        # messages still buffered for a parent that stopped reading must not keep the process from exiting
+        if not running.is_set():
+            for output in outputs:
+                output.cancel_join_thread()
+        ring.close()
+
+
+# takes images from the provider and converts them to rgb straight into free slots
+def capture_stage(ring, running, free_slots, output, provider_factory, evaluator_factory, frame_shape, paced):
+    provider = provider_factory()
+    processor = FrameProcessor()
+    processor.set_provider(provider, None if evaluator_factory is None else evaluator_factory(provider))
+    truth_channel = DetectionChannel()
+    frame = 0
+    # the provider writes every image into the same array, from where it is converted into the slot
+    decoded = None
+
+    while running.is_set():
+        # backpressure, all slots are in use further down the pipeline
+        slot, received = poll(free_slots)
+        if not received:
+            continue
+
+        start_time = time.perf_counter()
+        image, truth, source = processor.capture(decoded)
+        if image is None:
+            output.put(None)
+            break
+        if decoded is None:
+            decoded = np.empty_like(image)
+
+        target = ring.image(slot, frame_shape)
+        if image.shape != frame_shape:
+            image = cv2.resize(image, (frame_shape[1], frame_shape[0]))
+        cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=target)
+
+        # perf_counter is the monotonic clock of the system, comparable between processes
+        capture_time = time.perf_counter()
+        output.put({
+            "slot": slot, "frame": frame, "source": source, "capture time": capture_time, "step": None,
+            "detections": None, "truth": truth_channel.pack(truth), "times": {"capture": capture_time - start_time}
+        })
+        frame += 1
+
+        # wait out the rest of the frame interval of the provider, as the threaded pipeline does
+        dt = provider.dt()
+        if paced and dt > 0:
+            time.sleep(max(0, start_time + dt - time.perf_counter()))
+
+    provider.close()
+
+
+# runs the detector on the frames the scheduler picks, the other frames pass through to be tracked
+def detection_stage(ring, running, source, output, feedback, detector_factory, scheduler_factory, controller_factory, frame_shape, threshold, nms_threshold):
+    detector = None if detector_factory is None else detector_factory()
+    if detector is not None:
+        detector.load()
+    scheduler = FixedFrequencyScheduler() if scheduler_factory is None else scheduler_factory()
+    controller = None if controller_factory is None else controller_factory()
+    channel = DetectionChannel()
+    feedback_channel = DetectionChannel()
+
+    # the newest tracked detections, a few frames behind, tell the scheduler how tracking goes
+    tracked = None
+    track_seconds = 0
+
+    while running.is_set():
+        item, received = poll(source)
+        if not received:
+            continue
+        if item is None:
+            output.put(None)
+            break
+
+        while True:
+            try:
+                packed, track_seconds = feedback.get_nowait()
+            except queue.Empty:
+                break
+            tracked = feedback_channel.unpack(packed)
+
+        if detector is not None:
+            image = ring.image(item["slot"], frame_shape)
+            start_time = time.perf_counter()
+            if scheduler.should_detect():
+                if tracked is not None:
+                    detector.focus(tracked.valid_only().boxes)
+                detector.source_frame(*(item["source"] or (None, None)))
+                detections = detector.detect(image, threshold, nms_threshold)
+                seconds = time.perf_counter() - start_time
+                scheduler.update("detect", image, detections, seconds)
+                if controller is not None:
+                    controller.update(detector, seconds)
+
+                item["step"] = "detect"
+                item["detections"] = channel.pack(detections)
+                item["statistics"] = detector.statistics()
+                item["times"]["detect"] = seconds
+            else:
+                scheduler.update(None if tracked is None else "track", image, tracked, track_seconds)
+            del image
+
+        output.put(item)
+
+
+# tracks the objects through the frames between detections and draws the overlays while rendering is on
+# rendered frames keep their slot until the parent is done showing them, the others free it right away
+def tracking_stage(ring, running, source, output, feedback, free_slots, rendering, tracker_factory, frame_shape, display_resolution):
+    tracker = None if tracker_factory is None else tracker_factory()
+    processor = FrameProcessor()
+    detections_channel = DetectionChannel()
+    truth_channel = DetectionChannel()
+    output_channel = DetectionChannel()
+    feedback_channel = DetectionChannel()
+    detections = None
+    detection_round = 0
+
+    while running.is_set():
+        item, received = poll(source)
+        if not received:
+            continue
+        if item is None:
+            output.put(None)
+            break
+
+        slot = item["slot"]
+        image = ring.image(slot, frame_shape)
+        truth = truth_channel.unpack(item["truth"])
+        start_time = time.perf_counter()
+        if item["step"] == "detect":
+            detections = detections_channel.unpack(item["detections"])
+            if tracker is not None:
+                detections = tracker.init(image, detections)
+            detection_round += 1
+            detections = identify(detections, detection_round)
+            item["times"]["tracker init"] = time.perf_counter() - start_time
+        elif tracker is not None and detections is not None:
+            detections = tracker.track(image)
+            seconds = time.perf_counter() - start_time
+            item["step"] = "track"
+            item["times"]["track"] = seconds
+            feedback.put((feedback_channel.pack(detections), seconds))
+        item["detections"] = output_channel.pack(detections)
+
+        if rendering.is_set():
+            start_time = time.perf_counter()
+            # overlays are drawn after scaling to the display, the slots are large enough for either size
+            if display_resolution is not None and (image.shape[1], image.shape[0]) != display_resolution:
+                scale = (display_resolution[0] / image.shape[1], display_resolution[1] / image.shape[0])
+                resized = processor.draw(cv2.resize(image, display_resolution), detections, truth, scale)
+                image = ring.image(slot, resized.shape)
+                image[:] = resized
+            else:
+                processor.draw(image, detections, truth)
+            item["shape"] = image.shape
+            item["times"]["draw"] = time.perf_counter() - start_time
+        else:
+            free_slots.put(slot)
+            item["slot"] = None
+        del image
+
+        output.put(item)
+
+
+class ProcessPipeline:
+
+    # seconds the stage processes get to finish before they are terminated
+    stop_timeout = 5
+
+    # capture, detection and tracking with drawing run in processes of their own, past the global interpreter lock
+    # frames stay in a ring of shared memory slots, the queues between the processes carry slot indices and detections
+    # the components are made in the processes using them, by factories that can be pickled like functools.partial
+    # the evaluator factory gets the provider of the capture process
+    # the controller factory makes a resolution controller for the detector, None to keep its input size
+    def __init__(self, provider_factory, detector_factory=None, tracker_factory=None, scheduler_factory=None,
+                 evaluator_factory=None, controller_factory=None, slots=4, resolution=None, display_resolution=None, paced=True):
+        self.provider_factory = provider_factory
+        self.detector_factory = detector_factory
+        self.tracker_factory = tracker_factory
+        self.scheduler_factory = scheduler_factory
+        self.evaluator_factory = evaluator_factory
+        self.controller_factory = controller_factory
+
+        # frames in flight, capture waits for a free slot when all of them are taken
+        self.slots = slots
+        # width and height frames are processed at, read from the first frame of a provider if None
+        self.resolution = resolution
+        # size of the finished frames, None to keep the processing resolution, fixed once started
+        self.display_resolution = display_resolution
+        # hold frames back to the frame interval of the provider, off to process as fast as possible
+        self.paced = paced
+
+        self.threshold = FrameProcessor.threshold
+        self.nms_threshold = FrameProcessor.nms_threshold
+
+        # spawned processes do not inherit the threads of the parent, like those of opencv or a gui
+        self.context = multiprocessing.get_context("spawn")
+        self.running = self.context.Event()
+        self.rendering = self.context.Event()
+        self.rendering.set()
+        self.processes = []
+        self.ring = None
+
+        self.accuracy = StreamingMetrics()
+        self.statistics = {}
+        # set when the provider ran out of images and the last frame has come through
+        self.ended = False
+        self.dropped = 0
+        self.held_slot = None
+
+        # rolling glass to glass latency in seconds, from capture to display
+        self.latency = None
+        self.displayed_frames = 0
+        self.last_display_time = None
+
+    def start(self):
+        if self.resolution is None:
+            self.resolution = self.__frame_size()
+        frame_shape = (self.resolution[1], self.resolution[0], 3)
+        slot_size = int(np.prod(frame_shape))
+        if self.display_resolution is not None:
+            self.display_resolution = tuple(self.display_resolution)
+            slot_size = max(slot_size, self.display_resolution[0] * self.display_resolution[1] * 3)
+        self.ring = FrameRing(self.slots, slot_size)
+
+        self.free_slots = self.context.Queue()
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+        # the processes only attach to the queues after start returned, so the pipeline keeps them
+        self.queues = [self.context.Queue() for _ in range(3)]
+        captured, detected, feedback = self.queues
+        self.results = self.context.Queue()
+
+        self.detections_channel = DetectionChannel()
+        self.truth_channel = DetectionChannel()
+        self.ended = False
+        self.held_slot = None
+        self.running.set()
+        address = self.ring.address()
+        stages = [
+            ("capture", capture_stage, [captured],
+             (self.free_slots, captured, self.provider_factory, self.evaluator_factory, frame_shape, self.paced)),
+            ("detect", detection_stage, [detected],
+             (captured, detected, feedback, self.detector_factory, self.scheduler_factory, self.controller_factory, frame_shape,
+              self.threshold, self.nms_threshold)),
+            ("track", tracking_stage, [self.results, feedback, self.free_slots],
+             (detected, self.results, feedback, self.free_slots, self.rendering, self.tracker_factory, frame_shape, self.display_resolution))
+        ]
+        self.processes = [
+            self.context.Process(target=run_stage, args=(stage, address, outputs, self.running) + args, name=name, daemon=True)
+            for name, stage, outputs, args in stages
+        ]
+        for process in self.processes:
+            process.start()
+
+    def stop(self):
+        self.running.clear()
+        for process in self.processes:
+            process.join(self.stop_timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+        if self.ring is not None:
+            self.ring.close(unlink=True)
+            self.ring = None
+
+    def dropped_frames(self):
+        return self.dropped
+
+    # next processed frame as a dict with its frame number, source, step, detections, truth, stage times and image
+    # the image is None unless rendering is on, it is a view into shared memory and valid until the next call
+    # None if no frame arrived within the timeout or the stream has ended
+    def receive(self, timeout=None):
+        self.__release()
+        item = self.__get(timeout)
+        if item is not None and item["image"] is not None:
+            self.held_slot = item["slot"]
+            self.__displayed(item["capture time"])
+        return item
+
+    # newest finished frame to display, None if no new frame is ready within the timeout, older frames are dropped
+    def latest(self, timeout=0):
+        self.__release()
+        newest = None
+        item = self.__get(timeout)
+        while item is not None:
+            if item["image"] is not None:
+                if newest is not None:
+                    self.free_slots.put(newest["slot"])
+                    self.dropped += 1
+                newest = item
+            item = self.__get(0)
+
+        if newest is None:
+            return None
+        self.held_slot = newest["slot"]
+        self.__displayed(newest["capture time"])
+        return newest["image"]
+
+    # the parent is done with the frame it showed last
+    def __release(self):
+        if self.held_slot is not None:
+            self.free_slots.put(self.held_slot)
+            self.held_slot = None
+
+    def __get(self, timeout):
+        if self.ended:
+            return None
+        try:
+            item = self.results.get(timeout=timeout)
+        except queue.Empty:
+            for process in self.processes:
+                if process.exitcode not in (None, 0):
+                    raise RuntimeError(f"{process.name} process stopped with exit code {process.exitcode}")
+            return None
+        if item is None:
+            self.ended = True
+            return None
+
+        item["detections"] = self.detections_channel.unpack(item["detections"])
+        item["truth"] = self.truth_channel.unpack(item["truth"])
+        item["image"] = None if item["slot"] is None else self.ring.image(item["slot"], item["shape"])
+        if item["truth"] is not None:
+            self.accuracy.update(item["truth"], item["detections"])
+        if "statistics" in item:
+            self.statistics = item["statistics"]
+
+        for stage, seconds in item["times"].items():
+            metrics.record(stage, seconds)
+        metrics.count("processed frames")
+        if item["step"] == "detect":
+            metrics.count("detector calls")
+        elif item["step"] == "track":
+            metrics.count("tracker calls")
+        metrics.gauge("dropped frames", self.dropped)
+        return item
+
+    def __displayed(self, capture_time):
+        now = time.perf_counter()
+        latency = now - capture_time
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = .9 * self.latency + .1 * latency
+        self.displayed_frames += 1
+
+        if self.last_display_time is not None:
+            metrics.record("display interval", now - self.last_display_time)
+        self.last_display_time = now
+        metrics.record("latency", latency)
+        metrics.count("displayed frames")
+
+    # size the provider delivers, from what it knows once opened, a first frame is only taken if it does not know it
+    # the provider is closed again, so a camera is free for the capture process to open
+    def __frame_size(self):
+        provider = self.provider_factory()
+        try:
+            if hasattr(provider, "open"):
+                provider.open()
+            resolution = getattr(provider, "resolution", None)
+            if resolution is None or min(resolution) <= 0:
+                image = provider.next()
+                if image is None:
+                    raise RuntimeError(f"{provider.name} gave no first frame to take the frame size from")
+                resolution = (image.shape[1], image.shape[0])
+        finally:
+            provider.close()
+        return tuple(resolution)
@@ -0,0 +1,63 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+# pixels of an input size
+def area(size):
+    return size[0] * size[1]
+
+
+class ResolutionController:
+
+    # switches the input size of a detector at runtime to keep detections within a target latency in seconds
+    # steps down to the next smaller size while detections take too long, and back up when the next larger size is
+    # expected to fit within the headroom, assuming detection time grows with the number of input pixels
+    # after a change it waits for cooldown detections, the first one at a new size is not counted as it allocates
+    def __init__(self, target_latency, headroom=.8, cooldown=3, smoothing=.3):
+        self.target_latency = target_latency
+        self.headroom = headroom
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.reset()
+
+    def reset(self):
+        # smoothed seconds per detection at the current size, None before the first one
+        self.average = None
+        self.detections = None
+        self.changes = 0
+
+    # feedback after every detection, returns the new input size if it was changed, otherwise None
+    def update(self, detector, seconds):
+        sizes = sorted(detector.input_sizes(), key=area)
+        current = tuple(detector.image_resolution())
+        if len(sizes) < 2 or current not in sizes:
+            return None
+
+        if self.detections is None:
+            self.detections = 0
+            return None
+        if self.average is None:
+            self.average = seconds
+        else:
+            self.average = (1 - self.smoothing) * self.average + self.smoothing * seconds
+        self.detections += 1
+        if self.detections < self.cooldown:
+            return None
+
+        i = sizes.index(current)
+        size = None
+        if self.average > self.target_latency and i > 0:
+            size = sizes[i - 1]
+        elif i + 1 < len(sizes) and self.average * area(sizes[i + 1]) / area(current) < self.target_latency * self.headroom:
+            size = sizes[i + 1]
+        if size is None:
+            return None
+
+        logger.info(f"input size {current[0]}x{current[1]} -> {size[0]}x{size[1]}, detection took {self.average * 1000:.0f} ms")
+        detector.set_input_size(size)
+        # expected time at the new size until it is measured
+        self.average *= area(size) / area(current)
+        self.detections = None
+        self.changes += 1
+        return size
@@ -0,0 +1,123 @@
+import numpy as np
+from object_detection import ObjectDetection, Detections, batched_nms
+
+
+class SlicedDetection(ObjectDetection):
+
+    # cuts a large image into overlapping tiles, detects on all of them in one batch and merges the boxes
+    def __init__(self, detector, tile_size=640, overlap=.2, full_frame=True, max_tiles=None, focus_only=False, full_scan_interval=10):
+        super().__init__()
+        self.detector = detector
+        self.name = detector.name + " sliced"
+
+        # classes and their toggles are shared with the wrapped detector
+        self._classes = detector._classes
+        self.enable_classes = detector.enable_classes
+
+        self.tile_size = tile_size
+        self.overlap = overlap
+        # also detect on the whole image scaled down, for objects larger than a tile
+        self.full_frame = full_frame
+        # most tiles per detection, tiles around focus boxes come first and the others take turns
+        self.max_tiles = max_tiles
+        # only run tiles around focus boxes, with a scan of all tiles every full_scan_interval detections,
+        # with max_tiles as well the scan is the only time the other tiles take turns
+        self.focus_only = focus_only
+        self.full_scan_interval = full_scan_interval
+
+        self.focus_boxes = None
+        self.detection_counter = 0
+        self.scan_cursor = 0
+        self.last_tile_count = 0
+
+    def image_resolution(self):
+        return self.detector.image_resolution()
+
+    def input_sizes(self):
+        return self.detector.input_sizes()
+
+    def set_input_size(self, resolution):
+        self.detector.set_input_size(resolution)
+
+    def class_table(self):
+        return self.detector.class_table()
+
+    def load(self, background=False):
+        self.detector.load(background)
+
+    def source_frame(self, source, index):
+        self.detector.source_frame(source, index)
+
+    def statistics(self):
+        return self.detector.statistics()
+
+    def focus(self, boxes):
+        self.focus_boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+
+    # top left corners of tiles covering the image with the configured overlap
+    def tiles(self, width, height):
+        tile_size = min(self.tile_size, width, height)
+        stride = max(1, int(tile_size * (1 - self.overlap)))
+
+        xs = list(range(0, max(width - tile_size, 0) + 1, stride))
+        if xs[-1] + tile_size < width:
+            xs.append(width - tile_size)
+        ys = list(range(0, max(height - tile_size, 0) + 1, stride))
+        if ys[-1] + tile_size < height:
+            ys.append(height - tile_size)
+
+        return np.array([(x, y) for y in ys for x in xs]), tile_size
+
+    # tiles to run on this detection, all of them unless limited to focus boxes or a maximum count
+    def select_tiles(self, tiles, tile_size):
+        full_scan = self.detection_counter % self.full_scan_interval == 0
+        self.detection_counter += 1
+
+        # tiles containing the center of a focus box
+        focused = np.zeros(len(tiles), dtype=bool)
+        if self.focus_boxes is not None and len(self.focus_boxes) > 0:
+            centers = self.focus_boxes[:, None, 0:2]
+            inside = (centers >= tiles[None]) & (centers < tiles[None] + tile_size)
+            focused = inside.all(axis=2).any(axis=0)
+
+        if self.focus_only and not full_scan:
+            return tiles[np.flatnonzero(focused)[:self.max_tiles]]
+        if self.max_tiles is None:
+            return tiles
+
+        # focused tiles first, the others take turns in the remaining slots
+        selected = list(np.flatnonzero(focused)[:self.max_tiles])
+        others = np.flatnonzero(~focused)
+        count = min(self.max_tiles - len(selected), len(others))
+        if count > 0:
+            start = self.scan_cursor % len(others)
+            selected.extend(np.roll(others, -start)[:count])
+            self.scan_cursor = start + count
+
+        return tiles[np.sort(np.array(selected, dtype=np.int64))]
+
+    def detect(self, image, threshold, nms_threshold):
+        height, width = image.shape[0:2]
+        tiles, tile_size = self.tiles(width, height)
+        tiles = self.select_tiles(tiles, tile_size)
+
+        # tiles are views into the image, the detector scales them and returns boxes in tile coordinates
+        crops = [image[y:y + tile_size, x:x + tile_size] for x, y in tiles]
+        offsets = [np.float32([x, y, 0, 0]) for x, y in tiles]
+        if self.full_frame:
+            crops.append(image)
+            offsets.append(np.zeros(4, dtype=np.float32))
+        self.last_tile_count = len(crops)
+        # nothing in focus and no full frame, there is nothing to detect on
+        if len(crops) == 0:
+            return Detections.empty(*self.class_table())
+
+        # one batched forward pass for all tiles, boxes moved back to image coordinates
+        results = self.detector.detect_batch(crops, threshold, nms_threshold)
+        detections = Detections.concatenate(results, *self.class_table())
+        detections.boxes[:] += np.repeat(np.float32(offsets).reshape(-1, 4), [len(result) for result in results], axis=0)
+
+        # merge boxes found on several tiles
+        valid_boxes = batched_nms(detections.boxes, detections.class_ids, detections.confidences, threshold, nms_threshold)
+
+        return detections[valid_boxes]
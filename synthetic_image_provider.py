@@ -0,0 +1,78 @@
+import cv2
+import numpy as np
+from image_provider import ImageProvider, Frame
+from object_detection import Detections
+
+
+class SyntheticImageProvider(ImageProvider):
+
+    # procedural frames for tests and benchmarks that must not depend on video files or decoders
+    # a textured background with filled boxes moving in straight lines and bouncing off the edges,
+    # every frame only depends on the seed and its index, so runs repeat exactly
+    def __init__(self, resolution=(640, 640), fps=30, objects=5, frame_count=None, loop=False, seed=0, box_sizes=(24, 96), max_speed=8):
+        self.resolution = tuple(resolution)
+        self.fps = fps
+        # frames in the stream, None for no end
+        self.frame_count = frame_count
+        self.loop = loop
+        self.seed = seed
+        self.name = f"synthetic: {objects} objects, seed {seed}"
+
+        width, height = self.resolution
+        random = np.random.default_rng(seed)
+        self.sizes = random.uniform(*box_sizes, size=(objects, 2)).astype(np.float32)
+        # the centers stay inside the image by half the box size
+        self.low = self.sizes / 2
+        self.span = np.maximum(np.float32([width, height]) - self.sizes, 1)
+        self.starts = self.low + random.uniform(0, 1, size=(objects, 2)).astype(np.float32) * self.span
+        self.velocities = random.uniform(-max_speed, max_speed, size=(objects, 2)).astype(np.float32)
+        self.colors = random.integers(0, 256, size=(objects, 3)).tolist()
+
+        # smooth gradient with fine noise, so trackers and motion detection find texture
+        x, y = np.meshgrid(np.linspace(0, 1, width, dtype=np.float32), np.linspace(0, 1, height, dtype=np.float32))
+        gradient = np.stack((x * 160, y * 160, (1 - x) * 80 + 40), axis=2)
+        self.background = np.uint8(np.clip(gradient + random.normal(0, 8, size=gradient.shape), 0, 255))
+
+        self.sequence = 0
+        self.ended = False
+
+    # boxes of the objects on a frame as center x, center y, width, height, the ground truth of the frame
+    def boxes(self, index):
+        # positions move back and forth between the edges
+        travelled = np.mod(self.starts - self.low + self.velocities * index, 2 * self.span)
+        centers = self.low + self.span - np.abs(travelled - self.span)
+        return np.concatenate((centers, self.sizes), axis=1)
+
+    # draws into out if it has the resolution of the provider
+    def next_frame(self, out=None):
+        if self.ended:
+            return None
+        index = self.sequence
+        if self.frame_count is not None:
+            if index >= self.frame_count and not self.loop:
+                self.ended = True
+                return None
+            index %= self.frame_count
+
+        width, height = self.resolution
+        image = out if out is not None and out.shape == (height, width, 3) else np.empty((height, width, 3), dtype=np.uint8)
+        np.copyto(image, self.background)
+        corners = np.int32(np.round(Detections.to_corners(self.boxes(index))))
+        for (left, top, right, bottom), color in zip(corners.tolist(), self.colors):
+            cv2.rectangle(image, (left, top), (right, bottom), color, -1)
+            # a darker core gives the box inner edges to track
+            cv2.rectangle(image, ((3 * left + right) // 4, (3 * top + bottom) // 4), ((left + 3 * right) // 4, (top + 3 * bottom) // 4), [c // 2 for c in color], -1)
+
+        frame = Frame(image, self.sequence, index * self.dt(), self.resolution, index)
+        self.sequence += 1
+        return frame
+
+    def dt(self):
+        return 1 / self.fps
+
+    def reset(self):
+        self.sequence = 0
+        self.ended = False
+
+    def close(self):
+        self.reset()
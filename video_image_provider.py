@@ -1,41 +1,258 @@
+import time
+import threading
 import cv2
-from image_provider import ImageProvider
+import numpy as np
+from collections import deque
+from image_provider import ImageProvider, Frame
 
 
 class VideoImageProvider(ImageProvider):
 
     video_path = ""
-    frame_count = 0
     current_frame = 0
     video = None
 
-    def __init__(self, video):
+    # images handed out stay valid until this many more images are taken, the consumer may still hold them
+    keep_frames = 3
+
+    # at the end of the video it starts over if loop is set, otherwise the stream ends
+    def __init__(self, video, loop=False, decode_ahead=0, real_time=False):
         self.video_path = video
-        self.video = cv2.VideoCapture(video)
+        self.loop = loop
 
-        self.frame_count = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        # the video is opened when it is first needed
+        self.video = None
+        self.fps = None
+        self.resolution = None
+        self.__frame_count = 0
         self.current_frame = 0
+        self.sequence = 0
+        self.ended = False
 
         self.name = 'video: ' + video
 
+        # frames decoded in a background thread ahead of the consumer, 0 decodes on the caller thread
+        self.decode_ahead = decode_ahead
+        # drop frames the consumer is too slow for and wait for frames it is too fast for, like a live camera
+        self.real_time = real_time
+
+        self.frame_index = 0
+        self.played_frames = 0
+        self.dropped_frames = 0
+        self.clock_start = None
+
+        self.decoder = None
+        self.condition = threading.Condition()
+
+        # set by close, a closed video is not opened again by taking images, only by open
+        self.closed = False
+
+    def open(self):
+        self.closed = False
+        self.__open()
 
-    def next(self):
-        success, image = self.video.read()
+    @property
+    def frame_count(self):
+        self.__open()
+        return self.__frame_count
+
+    # the timestamp of a frame is its position in the video, None once closed
+    def next_frame(self, out=None):
+        if not self.__open():
+            return None
+        if self.ended:
+            return None
+        if self.decode_ahead > 0:
+            return self.__next_decoded(out)
+
+        # skip frames the consumer has fallen behind on without converting them
+        if self.real_time:
+            while self.clock_start is not None and self.played_frames < self.__clock_frame():
+                if not self.video.grab():
+                    break
+                self.frame_index += 1
+                self.played_frames += 1
+                self.dropped_frames += 1
+
+        # opencv decodes into out if it has the size of the video
+        success, image = self.video.read(out)
 
         if (success):
-            self.current_frame += 1
-            return image
+            index = self.frame_index
+            self.frame_index += 1
+            self.current_frame = self.frame_index
+            played = self.played_frames
+            self.played_frames += 1
+            self.__wait_for(played)
+            return self.__frame(image, index)
+
+        # a video without frames ends even when looping, starting it over would find nothing again
+        if not self.loop or self.frame_index == 0:
+            self.ended = True
+            return None
 
         self.reset()
-        return self.next()
+        return self.next_frame(out)
 
     def dt(self):
-        if (self.video is None):
+        self.__open()
+        if not self.fps:
             return -1
 
-        fps = self.video.get(cv2.CAP_PROP_FPS)
-        return 1/fps
+        return 1/self.fps
 
     def reset(self):
+        self.__stop_decoder()
         self.current_frame = 0
+        self.frame_index = 0
+        self.ended = False
         self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    # stop decoding and release the video, it starts over from the beginning once opened again
+    # a consumer still holding the provider gets no more images, and does not open the video again
+    def close(self):
+        self.closed = True
+        self.__stop_decoder()
+        if self.video is not None:
+            self.video.release()
+            self.video = None
+        self.current_frame = 0
+        self.frame_index = 0
+        self.sequence = 0
+        self.ended = False
+
+    # opens the video on first use, False if it was closed
+    def __open(self):
+        if self.closed:
+            return False
+        if self.video is not None:
+            return True
+
+        self.video = cv2.VideoCapture(self.video_path)
+        self.__frame_count = int(self.video.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.video.get(cv2.CAP_PROP_FPS)
+        self.resolution = (int(self.video.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.video.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        return True
+
+    def __frame(self, image, index):
+        frame = Frame(image, self.sequence, index * self.dt(), self.resolution, index, self.video_path)
+        self.sequence += 1
+        return frame
+
+    def __stop_decoder(self):
+        self.clock_start = None
+        decoder = self.decoder
+        if decoder is None:
+            return
+
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        decoder.join()
+        self.decoder = None
+
+    # frame number the real time clock is at
+    def __clock_frame(self):
+        return int((time.perf_counter() - self.clock_start) / self.dt())
+
+    # in real time mode, hold a frame back until its time has come
+    def __wait_for(self, played):
+        if not self.real_time:
+            return
+
+        if self.clock_start is None:
+            self.clock_start = time.perf_counter() - played * self.dt()
+        delay = self.clock_start + played * self.dt() - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __start_decoder(self):
+        width, height = self.resolution
+
+        # ring of preallocated frames, free ones are decoded into and decoded ones wait for the consumer
+        self.buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(self.decode_ahead + self.keep_frames)]
+        self.free_slots = deque(range(len(self.buffers)))
+        self.decoded_slots = deque()
+        self.handed_out_slots = deque()
+        self.stopping = False
+        self.decoded_all = False
+
+        self.decoder = threading.Thread(target=self.__decode, name="decode " + self.video_path, daemon=True)
+        self.decoder.start()
+
+    def __decode(self):
+        while True:
+            with self.condition:
+                while len(self.free_slots) == 0 and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                slot = self.free_slots.popleft()
+
+            # frames already late in real time are only grabbed, not converted
+            while self.real_time and self.clock_start is not None and self.played_frames < self.__clock_frame():
+                if not self.video.grab():
+                    break
+                self.frame_index += 1
+                self.played_frames += 1
+                self.dropped_frames += 1
+
+            success, image = self.video.read(self.buffers[slot])
+            if not success and self.loop:
+                self.video.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                self.frame_index = 0
+                success, image = self.video.read(self.buffers[slot])
+
+            with self.condition:
+                if not success:
+                    self.free_slots.append(slot)
+                    self.decoded_all = True
+                    self.condition.notify_all()
+                    return
+
+                # opencv allocates a new image if the decoded size differs from the buffer
+                self.buffers[slot] = image
+                self.decoded_slots.append((slot, self.frame_index, self.played_frames))
+                self.frame_index += 1
+                self.played_frames += 1
+                self.condition.notify_all()
+
+    def __next_decoded(self, out):
+        if self.decoder is None:
+            self.__start_decoder()
+
+        with self.condition:
+            while True:
+                while len(self.decoded_slots) == 0 and not self.decoded_all and not self.stopping:
+                    self.condition.wait()
+                if len(self.decoded_slots) == 0:
+                    self.ended = self.decoded_all
+                    return None
+
+                slot, index, played = self.decoded_slots.popleft()
+
+                # decoded frames the real time clock has already passed are dropped
+                if self.real_time and self.clock_start is not None and played < self.__clock_frame():
+                    self.free_slots.append(slot)
+                    self.dropped_frames += 1
+                    self.condition.notify_all()
+                    continue
+                break
+
+            # copied to memory of the consumer the slot is free again right away
+            # handed out, it is reused once the consumer has taken keep_frames more images
+            image = self.buffers[slot]
+            if out is not None and out.shape == image.shape:
+                np.copyto(out, image)
+                image = out
+                self.free_slots.append(slot)
+                self.condition.notify_all()
+            else:
+                self.handed_out_slots.append(slot)
+                if len(self.handed_out_slots) > self.keep_frames:
+                    self.free_slots.append(self.handed_out_slots.popleft())
+                    self.condition.notify_all()
+
+        self.current_frame = index + 1
+        self.__wait_for(played)
+        return self.__frame(image, index)
@@ -1,73 +1,264 @@
-import cv2
 import csv
+import json
 import os
+import threading
 import numpy as np
-from object_detection import ObjectDetection
+from collections import OrderedDict
+from object_detection import ObjectDetection, Detections, batched_nms
+from inference_backend import create_backend
+from letterbox import Letterbox
+
+
+# decode a single (4 + classes, candidates) yolo output into boxes, class ids and confidences
+def decode_output(out, threshold, nms_threshold, enable_classes, max_candidates=None):
+    # best class of every candidate, thresholded before touching the boxes
+    scores = out[4:]
+    confs = scores.max(axis=0)
+    candidates = np.flatnonzero(confs >= threshold)
+
+    class_ids = scores[:, candidates].argmax(axis=0)
+    enabled = np.asarray(enable_classes, dtype=bool)[class_ids]
+    candidates, class_ids = candidates[enabled], class_ids[enabled]
+    confs = confs[candidates]
+
+    # keep only the most confident candidates for nms
+    if max_candidates is not None and len(candidates) > max_candidates:
+        top = np.argpartition(-confs, max_candidates)[:max_candidates]
+        candidates, class_ids, confs = candidates[top], class_ids[top], confs[top]
+
+    # boxes as center x, center y, width, height
+    boxes = out[:4, candidates].T
+
+    valid_boxes = batched_nms(boxes, class_ids, confs, threshold, nms_threshold)
+
+    return \
+        boxes[valid_boxes].reshape(-1, 4), \
+        class_ids[valid_boxes], \
+        np.float16(confs[valid_boxes])
+
+
+# optional settings of a model directory, read from its config.json
+# backend: "opencv" or "onnxruntime", defaults to the preferred one installed
+# input_size: [width, height] the model was exported for, defaults to 640 by 640
+# input_sizes: [[width, height], ...] the model can also run at, like [[320, 320], [416, 416], [640, 640]], the largest
+#   is used unless input_size is given, models exported with open height and width get the usual sizes without it
+# threads: inference threads, defaults to the backend's choice
+# precision: reduced precision variant of the model to use, "fp16" reads model.fp16.onnx instead of model.onnx
+# dnn_backend, dnn_target: preferable backend and target of the opencv backend, like "default" and "cpu"
+def read_model_config(model_dir):
+    config_path = os.path.join(model_dir, "config.json")
+    if not os.path.isfile(config_path):
+        return {}
+
+    with open(config_path) as config_file:
+        return json.load(config_file)
 
 
 class YoloObjectDetection(ObjectDetection):
 
-    __net = None
-    __class_names = None
-    __class_colors = None
+    max_candidates = 300
+    batch_size = 8
+
+    # input widths offered for models with open height and width, up to the size they were exported for
+    standard_widths = (320, 416, 512, 640)
+
+    # nets stay loaded for the most recently used models only
+    max_loaded_models = 2
+    __loaded_models = OrderedDict()
+    __loaded_models_lock = threading.Lock()
 
-    def __init__(self, name, model, classes):
+    __backend = None
+
+    def __init__(self, name, model, classes, batch_size=None, config=None):
         super().__init__()
         self.name = name
-        self.__net = cv2.dnn.readNetFromONNX(model)
+        if batch_size is not None:
+            self.batch_size = batch_size
+
+        self.config = config if config is not None else {}
+        self.__input_sizes = None
+        if "input_sizes" in self.config:
+            self.__input_sizes = sorted((tuple(size) for size in self.config["input_sizes"]), key=lambda size: size[0] * size[1])
+            self._image_size = self.__input_sizes[-1]
+        if "input_size" in self.config:
+            self._image_size = tuple(self.config["input_size"])
+        self.__exported_size = self.image_resolution()
+
+        # a reduced precision variant next to the model replaces it
+        self.model_path = model
+        precision = self.config.get("precision")
+        if precision is not None:
+            variant = os.path.splitext(model)[0] + "." + precision + ".onnx"
+            if os.path.isfile(variant):
+                self.model_path = variant
+            else:
+                print(f"{variant} not found, using {model}")
+
+        # images are letterboxed into one input blob reused for every detection
+        self.__letterbox = None
+
+        # the model is only read when it is first needed
+        self.__loader = None
+        self.__net_lock = threading.Lock()
+
         with open(classes, newline='') as classes_file:
             reader = csv.reader(classes_file, delimiter=',', quotechar='\"')
 
-            self.__class_names = []
-            self.__class_colors = []
+            class_names = []
+            class_colors = []
             for row in reader:
                 class_name = row[0]
                 class_color = tuple([int(str.replace(c, "\"", "")) for c in row[1:]])
-                self.__class_names.append(class_name)
-                self.__class_colors.append(class_color)
+                class_names.append(class_name)
+                class_colors.append(class_color)
                 self._classes[class_name] = class_color
 
-            self.enable_classes = [True for i in self.__class_names]
+            self.enable_classes = [True for i in class_names]
+            # indexed by the class ids of the model, even if names repeat
+            self.__class_table = (np.array(class_names), np.array(class_colors, dtype=np.int64).reshape(-1, 3))
 
-    def detect(self, image, threshold, nms_threshold):
-        image_blob = cv2.dnn.blobFromImage(
-            image, scalefactor=1/255, size=(640, 640)
-        )
+    # read the model, in a background thread if asked to, detection waits for it
+    def load(self, background=False):
+        with self.__net_lock:
+            if self.__backend is not None:
+                return
+            # a load already running is waited for instead of started twice, the loader clears itself when done
+            loader = self.__loader
+            if loader is None:
+                loader = self.__loader = threading.Thread(target=self.__load, name="load " + self.name, daemon=True)
+                loader.start()
+
+        if not background:
+            loader.join()
+
+    # drop the model, it is read again when needed
+    def release(self):
+        with self.__net_lock:
+            self.__backend = None
+        with YoloObjectDetection.__loaded_models_lock:
+            YoloObjectDetection.__loaded_models.pop(id(self), None)
+
+    def class_table(self):
+        return self.__class_table
+
+    def loaded(self):
+        return self.__backend is not None
+
+    # inference backend and settings the model runs with, None until it is loaded
+    def backend(self):
+        backend = self.__backend
+        return backend.description() if backend is not None else None
+
+    def statistics(self):
+        width, height = self.image_resolution()
+        statistics = {"input size": f"{width}x{height}"}
+        backend = self.backend()
+        if backend is not None:
+            statistics["backend"] = backend
+        return statistics
+
+    # sizes of the config, or once the model is loaded the standard sizes if its height and width are open
+    def input_sizes(self):
+        if self.__input_sizes is not None:
+            return list(self.__input_sizes)
 
-        self.__net.setInput(image_blob)
-        out = self.__net.forward()
+        sizes = [self.__exported_size]
+        backend = self.__backend
+        shape = backend.input_shape() if backend is not None else None
+        if shape is not None and len(shape) == 4 and not all(isinstance(dimension, int) for dimension in shape[2:4]):
+            width, height = self.__exported_size
+            sizes = [(w, max(32, round(w * height / width / 32) * 32)) for w in self.standard_widths if w < width] + sizes
+        return sizes
 
-        _, n_outputs, n_objects = out.shape
+    def __load(self):
+        backend = None
+        try:
+            backend = create_backend(
+                self.model_path,
+                self.config.get("backend"),
+                self.config.get("threads"),
+                self.config.get("dnn_backend", "default"),
+                self.config.get("dnn_target", "cpu")
+            )
 
-        class_ids = []
-        class_confs = []
-        boxes = []
+            # the first forward pass allocates everything, do it before the first real image
+            width, height = self.image_resolution()
+            backend.forward(np.zeros((1, 3, height, width), dtype=np.float32))
+        finally:
+            with self.__net_lock:
+                self.__backend = backend
+                self.__loader = None
+        self.__use()
 
-        for i in range(n_objects):
-            conf = out[:, 4:, i].reshape(-1)
+    # loaded model, read now if it is not loaded yet
+    def __model(self):
+        loader = self.__loader
+        if loader is not None:
+            loader.join()
+        if self.__backend is None:
+            self.load()
+        backend = self.__backend
+        if backend is None:
+            raise RuntimeError(f"could not load {self.model_path}")
+        self.__use()
+        return backend
 
-            class_id = np.argmax(conf)
+    # mark the model as recently used and release the least recently used ones over the limit
+    def __use(self):
+        with YoloObjectDetection.__loaded_models_lock:
+            YoloObjectDetection.__loaded_models[id(self)] = self
+            YoloObjectDetection.__loaded_models.move_to_end(id(self))
+            idle = []
+            while len(YoloObjectDetection.__loaded_models) > self.max_loaded_models:
+                idle.append(YoloObjectDetection.__loaded_models.popitem(last=False)[1])
+        for detector in idle:
+            detector.release()
 
-            if not self.enable_classes[class_id]:
+    # boxes are returned in image coordinates
+    def detect(self, image, threshold, nms_threshold):
+        image_blob, placements = self.__prepare([image])
+
+        out = self.__model().forward(image_blob)
+
+        return self.__decode(out[0], placements[0], threshold, nms_threshold)
+
+    def detect_batch(self, images, threshold, nms_threshold):
+        results = []
+
+        backend = self.__model()
+        start = 0
+        while start < len(images):
+            batch = images[start:start + self.batch_size]
+            image_blob, placements = self.__prepare(batch)
+
+            try:
+                out = backend.forward(image_blob)
+            except backend.errors:
+                # models exported with a fixed batch of one cannot run batches, fall back to single images
+                if len(batch) == 1:
+                    raise
+                self.batch_size = 1
                 continue
 
-            class_conf = conf[class_id]
+            results.extend(self.__decode(frame_out, placement, threshold, nms_threshold) for frame_out, placement in zip(out, placements))
+            start += len(batch)
 
-            if class_conf >= threshold:
-                class_ids.append(class_id)
-                class_confs.append(class_conf)
-                boxes.append([int(a) for a in out[:, :4, i].reshape(4)])
+        return results
 
-        valid_boxes = cv2.dnn.NMSBoxes(
-            boxes, class_confs, threshold, nms_threshold
-        )
+    # images letterboxed into the input blob at the current input size
+    def __prepare(self, images):
+        resolution = self.image_resolution()
+        letterbox = self.__letterbox
+        if letterbox is None or letterbox.resolution != resolution:
+            letterbox = self.__letterbox = Letterbox(resolution)
+        return letterbox.prepare(images)
 
-        return \
-            np.int16(boxes)[valid_boxes], \
-            np.array(self.__class_colors)[class_ids], \
-            np.array(self.__class_names)[class_ids], \
-            np.float16(class_confs)[valid_boxes]
+    def __decode(self, out, placement, threshold, nms_threshold):
+        boxes, class_ids, class_confs = decode_output(
+            out, threshold, nms_threshold, self.enable_classes, self.max_candidates
+        )
 
+        return Detections.create(Letterbox.unmap(boxes, placement), class_ids, class_confs, *self.class_table())
 
     @staticmethod
     def look_for_models():
@@ -93,7 +284,7 @@ class YoloObjectDetection(ObjectDetection):
             if model_path == None or class_list_path == None:
                 continue
 
-            yolo_list.append(YoloObjectDetection('YOLO: ' + dir, model_path, class_list_path))
+            yolo_list.append(YoloObjectDetection('YOLO: ' + dir, model_path, class_list_path, config=read_model_config(dir_path)))
 
 
         return yolo_list